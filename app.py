@@ -1,72 +1,135 @@
 import os
-from flask import Flask, request, jsonify
+import mimetypes
+import click
+from flask import Flask, Blueprint, request, jsonify, send_file
+from flask.cli import with_appcontext
 from flask_cors import CORS
 from flask_jwt_extended import JWTManager, jwt_required, get_jwt_identity
 from flask_socketio import SocketIO
-from models import db
+from werkzeug.middleware.proxy_fix import ProxyFix
+from config import Config
+from models import db, User, upgrade_schema, backfill_blocking_keys
 from auth import init_auth, register_user, login_user, get_current_user, update_profile
-from matching import find_potential_matches, create_match, get_user_matches
+from matching import create_match, get_user_matches
+from suggestions import suggestions_cli, get_suggested_matches, get_nearby_matches, init_suggestions
+from search import search_users, rebuild_search_index
+from presence import init_presence
+from match_graph import init_match_graph
+from read_receipts import init_read_receipts, backfill_watermarks
+from rate_limit import init_rate_limits
+from archive import messages_cli, drop_archive_tables, rebuild_conversation_index
+from outbox import outbox_cli, init_outbox
+from read_models import user_rows
+from readiness import init_readiness, check_readiness
+from media import IMMUTABLE_CACHE, init_media, get_storage, picture_urls, resolve_media, upload_profile_picture
 from chat import init_socket_events, get_conversation, get_unread_count, get_recent_conversations
 from notifications import get_user_notifications, mark_notification_read
 import json
 
-# Initialize Flask app
-app = Flask(__name__)
-
-# Configuration
-app.config['SECRET_KEY'] = os.getenv('SECRET_KEY', 'your-secret-key-here')
-app.config['SQLALCHEMY_DATABASE_URI'] = os.getenv('DATABASE_URL', 'sqlite:///roomimatch.db')
-app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
-app.config['JWT_SECRET_KEY'] = os.getenv('JWT_SECRET_KEY', 'jwt-secret-key')
-
-# Initialize extensions
-CORS(app, supports_credentials=True, resources={
-    r"/*": {
-        "origins": [
-            "http://localhost:8081",
-            "http://localhost:3000",
-            "https://roomimatch-frontend.onrender.com"
-        ]
-    }
-})
-db.init_app(app)
-jwt = JWTManager(app)
-socketio = SocketIO(app, cors_allowed_origins="*", async_mode="threading")
-
-# Initialize auth
-oauth, google = init_auth(app)
-
-# Initialize socket events
+# Extensions are created unbound and attached to an app in create_app()
+jwt = JWTManager()
+socketio = SocketIO()
+api = Blueprint('api', __name__)
+
+# Socket handlers are collected on the SocketIO object and bound on init_app
 init_socket_events(socketio)
 
-# Create database tables
-with app.app_context():
-    try:
-        db.create_all()
-    except Exception as e:
-        print(f"Database initialization error: {e}")
-        pass
+
+def create_app(config=None):
+    """Build and configure a Flask app.
+
+    `config` may be a config object/class or a dict of overrides. Nothing here
+    touches the database; run `flask --app app init-db` to create or upgrade
+    the schema.
+    """
+    app = Flask(__name__)
+    app.config.from_object(Config)
+    if isinstance(config, dict):
+        app.config.update(config)
+    elif config is not None:
+        app.config.from_object(config)
+
+    CORS(app, supports_credentials=True, resources={
+        r"/*": {"origins": app.config['CORS_ORIGINS']}
+    })
+    db.init_app(app)
+    jwt.init_app(app)
+    socketio.init_app(
+        app, cors_allowed_origins="*", async_mode="threading",
+        serializer=app.config['SOCKETIO_SERIALIZER'],
+        http_compression=True,
+        compression_threshold=app.config['SOCKETIO_COMPRESSION_THRESHOLD'],
+        message_queue=app.config['SOCKETIO_MESSAGE_QUEUE']
+    )
+    if app.config['TRUSTED_PROXIES']:
+        # Wraps the Socket.IO middleware too, so socket sessions see client addresses
+        hops = app.config['TRUSTED_PROXIES']
+        app.wsgi_app = ProxyFix(app.wsgi_app, x_for=hops, x_proto=hops)
+
+    # OAuth clients are registered lazily on first use
+    init_auth(app)
+    init_presence(app)
+    init_match_graph(app)
+    init_read_receipts(app)
+    init_rate_limits(app)
+    init_suggestions(app)
+    init_outbox(app)
+    init_media(app)
+    init_readiness(app)
+
+    app.register_blueprint(api)
+    app.cli.add_command(init_db_command)
+    app.cli.add_command(suggestions_cli)
+    app.cli.add_command(messages_cli)
+    app.cli.add_command(outbox_cli)
+
+    return app
+
+
+@click.command('init-db')
+@click.option('--drop', is_flag=True, help='Drop all tables before creating them.')
+@with_appcontext
+def init_db_command(drop):
+    """Create database tables and bring an existing schema up to date."""
+    if drop:
+        drop_archive_tables()
+        db.drop_all()
+    db.create_all()
+    added = upgrade_schema()
+    if added:
+        click.echo(f"Added {', '.join(added)}.")
+    # The search index must exist before backfilled rows trigger its sync
+    rebuild_search_index()
+    updated = backfill_blocking_keys()
+    if updated:
+        click.echo(f'Backfilled blocking and location keys for {updated} users.')
+    rebuild_conversation_index()
+    backfilled = backfill_watermarks()
+    if backfilled:
+        click.echo(f'Backfilled read watermarks for {backfilled} conversations.')
+    click.echo('Database initialized.')
+
 
 # Auth routes
-@app.route('/api/auth/register', methods=['POST'])
+@api.route('/api/auth/register', methods=['POST'])
 def register():
     data = request.get_json()
     result, status_code = register_user(data)
     return jsonify(result), status_code
 
-@app.route('/api/auth/login', methods=['POST'])
+@api.route('/api/auth/login', methods=['POST'])
 def login():
     data = request.get_json()
     result, status_code = login_user(data)
     return jsonify(result), status_code
 
-@app.route('/api/auth/me', methods=['GET'])
+@api.route('/api/auth/me', methods=['GET'])
 @jwt_required()
 def get_me():
     result, status_code = get_current_user()
     return jsonify(result), status_code
 
-@app.route('/api/auth/update-profile', methods=['PUT'])
+@api.route('/api/auth/update-profile', methods=['PUT'])
 @jwt_required()
 def update_user_profile():
     data = request.get_json()
@@ -75,10 +138,10 @@ def update_user_profile():
     return jsonify(result), status_code
 
 # User routes
-@app.route('/api/users', methods=['GET'])
+@api.route('/api/users', methods=['GET'])
 def api_get_users():
     try:
-        users = User.query.all()
+        users = user_rows(User.query.order_by(User.id))
         user_data = []
         for user in users:
             user_data.append({
@@ -92,34 +155,54 @@ def api_get_users():
                 'interests': json.loads(user.interests) if user.interests else [],
                 'bio': user.bio,
                 'location': user.location,
-                'profile_picture': user.profile_picture
+                'profile_picture': user.profile_picture,
+                'profile_pictures': picture_urls(user)
             })
         return jsonify(user_data), 200
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+@api.route('/api/users/search', methods=['GET'])
+@jwt_required(optional=True)
+def api_search_users():
+    filters = {key: request.args[key] for key in ('gender', 'budget', 'occupation') if key in request.args}
+    radius_km = request.args.get('radius_km', type=float)
+    if radius_km is not None:
+        filters['radius_km'] = radius_km
+    page = max(request.args.get('page', 1, type=int), 1)
+    per_page = min(max(request.args.get('per_page', 20, type=int), 1), 100)
+    result, status_code = search_users(request.args.get('q'), filters, page, per_page, get_jwt_identity())
+    return jsonify(result), status_code
+
 # Matching routes
-@app.route('/api/matches/potential', methods=['GET'])
+@api.route('/api/matches/potential', methods=['GET'])
 @jwt_required()
 def get_matches():
-    result, status_code = find_potential_matches()
+    user_id = get_jwt_identity()
+    radius_km = request.args.get('radius_km', type=float)
+    if radius_km is not None:
+        result, status_code = get_nearby_matches(user_id, radius_km)
+    else:
+        result, status_code = get_suggested_matches(user_id)
     return jsonify(result), status_code
 
-@app.route('/api/matches', methods=['POST'])
+@api.route('/api/matches', methods=['POST'])
 @jwt_required()
 def create_new_match():
-    data = request.get_json()
-    result, status_code = create_match(data)
+    data = request.get_json() or {}
+    if not data.get('user_id'):
+        return jsonify({'error': 'user_id is required'}), 400
+    result, status_code = create_match(get_jwt_identity(), data['user_id'])
     return jsonify(result), status_code
 
-@app.route('/api/matches', methods=['GET'])
+@api.route('/api/matches', methods=['GET'])
 @jwt_required()
 def get_matches_list():
-    result, status_code = get_user_matches()
+    result, status_code = get_user_matches(get_jwt_identity())
     return jsonify(result), status_code
 
 # Chat routes
-@app.route('/api/chat/conversation/<int:user2_id>', methods=['GET'])
+@api.route('/api/chat/conversation/<int:user2_id>', methods=['GET'])
 @jwt_required()
 def get_chat_conversation(user2_id):
     user1_id = get_jwt_identity()
@@ -128,38 +211,71 @@ def get_chat_conversation(user2_id):
     result, status_code = get_conversation(user1_id, user2_id, page, per_page)
     return jsonify(result), status_code
 
-@app.route('/api/chat/unread-count', methods=['GET'])
+@api.route('/api/chat/unread-count', methods=['GET'])
 @jwt_required()
 def get_unread_message_count():
     user_id = get_jwt_identity()
     result, status_code = get_unread_count(user_id)
     return jsonify(result), status_code
 
-@app.route('/api/chat/recent-conversations', methods=['GET'])
+@api.route('/api/chat/recent-conversations', methods=['GET'])
 @jwt_required()
 def get_recent_chats():
     user_id = get_jwt_identity()
     result, status_code = get_recent_conversations(user_id)
     return jsonify(result), status_code
 
+# Profile picture routes
+@api.route('/api/users/me/picture', methods=['POST'])
+@jwt_required()
+def upload_picture():
+    user_id = get_jwt_identity()
+    result, status_code = upload_profile_picture(user_id, request.files.get('picture'))
+    return jsonify(result), status_code
+
+@api.route('/media/<path:key>', methods=['GET'])
+def serve_media(key):
+    stored, immutable = resolve_media(key)
+    if stored is None:
+        return jsonify({'error': 'Not found'}), 404
+    # Keys are content-addressed, so the stored key is a stable ETag
+    response = send_file(get_storage().open(stored), mimetype=mimetypes.guess_type(stored)[0],
+                         etag=stored, conditional=True)
+    response.headers['Cache-Control'] = IMMUTABLE_CACHE if immutable else 'no-cache'
+    return response
+
+@api.app_errorhandler(413)
+def request_too_large(e):
+    return jsonify({'error': 'Request is too large'}), 413
+
 # Notification routes
-@app.route('/api/notifications', methods=['GET'])
+@api.route('/api/notifications', methods=['GET'])
 @jwt_required()
 def get_notifications():
     user_id = get_jwt_identity()
     result, status_code = get_user_notifications(user_id)
     return jsonify(result), status_code
 
-@app.route('/api/notifications/<int:notification_id>/read', methods=['PUT'])
+@api.route('/api/notifications/<int:notification_id>/read', methods=['PUT'])
 @jwt_required()
 def mark_notification_as_read(notification_id):
     result, status_code = mark_notification_read(notification_id)
     return jsonify(result), status_code
 
 # Health check
-@app.route('/api/health', methods=['GET'])
+@api.route('/api/health', methods=['GET'])
 def health_check():
     return jsonify({'status': 'healthy'}), 200
 
+# Readiness: dependencies checked and this process warmed up
+@api.route('/api/ready', methods=['GET'])
+def readiness_check():
+    result, status_code = check_readiness()
+    return jsonify(result), status_code
+
+app = create_app()
+
 if __name__ == '__main__':
+    with app.app_context():
+        db.create_all()
     socketio.run(app, debug=os.getenv('FLASK_ENV') != 'production', host='0.0.0.0', port=int(os.environ.get('PORT', 5000)), allow_unsafe_werkzeug=True)
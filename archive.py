@@ -0,0 +1,161 @@
+from datetime import datetime, timedelta
+import click
+from flask.cli import AppGroup
+from models import db, Message, ArchivePartition, ConversationArchive
+
+messages_cli = AppGroup('messages', help='Manage message history storage.')
+
+ARCHIVE_TABLE_PREFIX = 'message_archive_'
+
+# Archive tables live outside db.metadata so create_all/drop_all leave them alone
+archive_metadata = db.MetaData()
+
+
+def _month_start(when):
+    return datetime(when.year, when.month, 1)
+
+
+def archive_table(month_start):
+    """Table object for the archive partition holding `month_start`'s messages."""
+    name = f'{ARCHIVE_TABLE_PREFIX}{month_start:%Y_%m}'
+    if name in archive_metadata.tables:
+        return archive_metadata.tables[name]
+    columns = [db.Column(column.name, column.type, primary_key=column.primary_key)
+               for column in Message.__table__.columns]
+    return db.Table(
+        name, archive_metadata, *columns,
+        db.Index(f'ix_{name}_pair', 'sender_id', 'receiver_id', 'created_at')
+    )
+
+
+def _ensure_partition(month_start):
+    table = archive_table(month_start)
+    partition = db.session.get(ArchivePartition, table.name)
+    if partition is None:
+        table.create(db.session.connection(), checkfirst=True)
+        partition = ArchivePartition(table_name=table.name, month_start=month_start, message_count=0)
+        db.session.add(partition)
+    return table, partition
+
+
+def _pair(user1_id, user2_id):
+    return tuple(sorted((int(user1_id), int(user2_id))))
+
+
+def _index_conversations(counts):
+    """Add {(user1_id, user2_id, month_start): count} to the conversation index."""
+    for (user1_id, user2_id, month_start), count in counts.items():
+        entry = db.session.get(ConversationArchive, (user1_id, user2_id, month_start))
+        if entry is None:
+            db.session.add(ConversationArchive(user1_id=user1_id, user2_id=user2_id,
+                                               month_start=month_start, message_count=count))
+        else:
+            entry.message_count += count
+
+
+def rebuild_conversation_index():
+    """Fill the conversation index from the partitions if it is empty.
+
+    Archives written before the index existed are otherwise invisible to
+    archived_conversation(). Returns the number of entries written.
+    """
+    if db.session.query(ConversationArchive.user1_id).first() is not None:
+        return 0
+    counts = {}
+    for partition in ArchivePartition.query:
+        table = archive_table(partition.month_start)
+        for sender_id, receiver_id, count in db.session.execute(
+            db.select(table.c.sender_id, table.c.receiver_id, db.func.count())
+            .group_by(table.c.sender_id, table.c.receiver_id)
+        ):
+            key = (*_pair(sender_id, receiver_id), partition.month_start)
+            counts[key] = counts.get(key, 0) + count
+    _index_conversations(counts)
+    db.session.commit()
+    return len(counts)
+
+
+def drop_archive_tables():
+    """Drop every archive partition (used by `flask init-db --drop`)."""
+    inspector = db.inspect(db.engine)
+    for name in inspector.get_table_names():
+        if name.startswith(ARCHIVE_TABLE_PREFIX):
+            db.Table(name, db.MetaData()).drop(db.engine)
+
+
+def archive_messages(cutoff, batch_size=1000):
+    """Move messages created before `cutoff` into monthly archive tables.
+
+    Works in batches, each committed on its own, so it can be stopped and
+    rerun safely. Each batch also updates the per-conversation index read by
+    archived_conversation(). Returns the number of messages moved.
+    """
+    columns = [column.name for column in Message.__table__.columns]
+    moved = 0
+    while True:
+        batch = Message.query.filter(Message.created_at < cutoff) \
+            .order_by(Message.id).limit(batch_size).all()
+        if not batch:
+            return moved
+
+        by_month, counts = {}, {}
+        for message in batch:
+            month_start = _month_start(message.created_at)
+            by_month.setdefault(month_start, []).append(
+                {name: getattr(message, name) for name in columns}
+            )
+            key = (*_pair(message.sender_id, message.receiver_id), month_start)
+            counts[key] = counts.get(key, 0) + 1
+        for month_start, rows in by_month.items():
+            table, partition = _ensure_partition(month_start)
+            db.session.execute(table.insert(), rows)
+            partition.message_count += len(rows)
+        _index_conversations(counts)
+
+        Message.query.filter(Message.id.in_([m.id for m in batch])).delete(synchronize_session=False)
+        db.session.commit()
+        db.session.expunge_all()
+        moved += len(batch)
+
+
+def _conversation_filter(table, user1_id, user2_id):
+    c = table.c
+    return ((c.sender_id == user1_id) & (c.receiver_id == user2_id)) | \
+        ((c.sender_id == user2_id) & (c.receiver_id == user1_id))
+
+
+def archived_conversation(user1_id, user2_id, offset, limit):
+    """Read archived messages newest first, skipping `offset` of them.
+
+    Only the partitions the conversation index lists for this pair are read,
+    newest month first and only until `limit` rows are found; a conversation
+    with nothing archived costs one index lookup.
+    """
+    user1_id, user2_id = _pair(user1_id, user2_id)
+    entries = ConversationArchive.query.filter_by(user1_id=user1_id, user2_id=user2_id) \
+        .order_by(ConversationArchive.month_start.desc()).all()
+    results = []
+    for entry in entries:
+        if len(results) >= limit:
+            break
+        if offset >= entry.message_count:
+            offset -= entry.message_count
+            continue
+        table = archive_table(entry.month_start)
+        rows = db.session.execute(
+            db.select(table).where(_conversation_filter(table, user1_id, user2_id))
+            .order_by(table.c.created_at.desc()).offset(offset).limit(limit - len(results))
+        ).all()
+        offset = 0
+        results.extend(rows)
+    return results
+
+
+@messages_cli.command('archive')
+@click.option('--older-than-days', type=int, default=180, help='Archive messages older than this.')
+@click.option('--batch-size', type=int, default=1000)
+def archive_command(older_than_days, batch_size):
+    """Move old messages out of the hot message table."""
+    cutoff = datetime.utcnow() - timedelta(days=older_than_days)
+    moved = archive_messages(cutoff, batch_size)
+    click.echo(f'Archived {moved} messages older than {cutoff:%Y-%m-%d}.')
@@ -1,25 +1,40 @@
-import os
 import bcrypt
-from flask import request, jsonify
+from flask import request, jsonify, current_app
 from flask_jwt_extended import create_access_token, jwt_required, get_jwt_identity
-from authlib.integrations.flask_client import OAuth
 from models import db, User
+from media import picture_urls
+from suggestions import queue_suggestion_refresh, wake_suggestion_worker
 import json
 
 def init_auth(app):
-    oauth = OAuth(app)
-    google = oauth.register(
-        name='google',
-        client_id=os.getenv('GOOGLE_CLIENT_ID'),
-        client_secret=os.getenv('GOOGLE_CLIENT_SECRET'),
-        access_token_url='https://accounts.google.com/o/oauth2/token',
-        access_token_params=None,
-        authorize_url='https://accounts.google.com/o/oauth2/auth',
-        authorize_params=None,
-        api_base_url='https://www.googleapis.com/oauth2/v1/',
-        client_kwargs={'scope': 'openid email profile'},
-    )
-    return oauth, google
+    """Prepare the app for OAuth without building any clients yet.
+
+    Authlib and the Google client are only loaded on first use through
+    get_google_client(), so importing and booting the app stays cheap.
+    """
+    app.extensions.setdefault('roomimatch_oauth', None)
+
+def get_google_client(app=None):
+    """Return the Google OAuth client, registering it on first call."""
+    app = app or current_app._get_current_object()
+    state = app.extensions.get('roomimatch_oauth')
+    if state is None:
+        from authlib.integrations.flask_client import OAuth
+
+        oauth = OAuth(app)
+        google = oauth.register(
+            name='google',
+            client_id=app.config.get('GOOGLE_CLIENT_ID'),
+            client_secret=app.config.get('GOOGLE_CLIENT_SECRET'),
+            access_token_url='https://accounts.google.com/o/oauth2/token',
+            access_token_params=None,
+            authorize_url='https://accounts.google.com/o/oauth2/auth',
+            authorize_params=None,
+            api_base_url='https://www.googleapis.com/oauth2/v1/',
+            client_kwargs={'scope': 'openid email profile'},
+        )
+        state = app.extensions['roomimatch_oauth'] = (oauth, google)
+    return state[1]
 
 def hash_password(password):
     return bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt()).decode('utf-8')
@@ -53,7 +68,10 @@ def register_user(data):
         )
 
         db.session.add(user)
+        db.session.flush()
+        queue_suggestion_refresh(user.id)
         db.session.commit()
+        wake_suggestion_worker()
 
         # Create access token
         access_token = create_access_token(identity=user.id)
@@ -114,7 +132,8 @@ def get_current_user():
             'interests': json.loads(user.interests),
             'bio': user.bio,
             'location': user.location,
-            'profile_picture': user.profile_picture
+            'profile_picture': user.profile_picture,
+            'profile_pictures': picture_urls(user)
         }, 200
 
     except Exception as e:
@@ -132,13 +151,19 @@ def update_profile(user_id, data):
             if field in data:
                 setattr(user, field, data[field])
 
+        if 'profile_picture' in data:
+            # A plain URL replaces any uploaded picture and its variants
+            user.picture_hash = None
+
         if 'habits' in data:
             user.habits = json.dumps(data['habits'])
 
         if 'interests' in data:
             user.interests = json.dumps(data['interests'])
 
+        queue_suggestion_refresh(user.id)
         db.session.commit()
+        wake_suggestion_worker()
 
         return {'message': 'Profile updated successfully'}, 200
 
@@ -0,0 +1,160 @@
+"""Per-call overhead of the hot chat/match/notification queries.
+
+Compares the previous Query-API expressions, rebuilt on every call, with the
+prebuilt bound-parameter statements now used by chat.py, matching.py and
+notifications.py. Runs against an in-memory SQLite database so the numbers
+are dominated by Python-side statement construction and compilation.
+
+A second table compares loading and scoring a candidate population as full
+User entities against UserRow projections (read_models.py).
+
+    python bench_queries.py [calls] > bench_output.txt
+"""
+import sys
+import time
+import tracemalloc
+from app import create_app
+from config import TestingConfig
+from models import db, User, Match, Message, Notification
+from chat import CONVERSATION_PAGE, LATEST_MESSAGES
+from matching import MATCH_BETWEEN
+from notifications import USER_NOTIFICATIONS
+from matching import compatibility_score
+from read_models import user_rows
+
+USERS = 50
+MESSAGES_PER_PAIR = 4
+
+
+def seed():
+    db.session.add_all(User(
+        name=f'User {n}', email=f'user{n}@bench.test', password_hash='hash',
+        age=20 + n % 15, gender='Male', occupation='Student', budget='₹8000',
+        habits='[]', interests='[]'
+    ) for n in range(1, USERS + 1))
+    db.session.flush()
+    for n in range(2, USERS + 1):
+        for i in range(MESSAGES_PER_PAIR):
+            sender, receiver = (1, n) if i % 2 else (n, 1)
+            db.session.add(Message(sender_id=sender, receiver_id=receiver, content=f'm{i}'))
+        db.session.add(Match(user1_id=1, user2_id=n, status='pending'))
+        db.session.add(Notification(user_id=1, title='t', message='m', notification_type='system'))
+    db.session.commit()
+
+
+def legacy_conversation(n):
+    return Message.query.filter(
+        ((Message.sender_id == 1) & (Message.receiver_id == n)) |
+        ((Message.sender_id == n) & (Message.receiver_id == 1))
+    ).order_by(Message.created_at.desc()).offset(0).limit(50).all()
+
+
+def cached_conversation(n):
+    return db.session.execute(CONVERSATION_PAGE, {
+        'user1_id': 1, 'user2_id': n, 'offset': 0, 'limit': 50
+    }).scalars().all()
+
+
+def legacy_match_pair(n):
+    return Match.query.filter(
+        ((Match.user1_id == 1) & (Match.user2_id == n)) |
+        ((Match.user1_id == n) & (Match.user2_id == 1))
+    ).first()
+
+
+def cached_match_pair(n):
+    return db.session.execute(MATCH_BETWEEN, {'user1_id': 1, 'user2_id': n}).first()
+
+
+def legacy_recent(n):
+    subquery = db.session.query(
+        Message.sender_id,
+        Message.receiver_id,
+        db.func.max(Message.created_at).label('latest_message_time')
+    ).filter(
+        (Message.sender_id == n) | (Message.receiver_id == n)
+    ).group_by(
+        db.case((Message.sender_id == n, Message.receiver_id), else_=Message.sender_id)
+    ).subquery()
+    return db.session.query(Message).join(subquery, db.and_(
+        db.or_(
+            db.and_(Message.sender_id == n, Message.receiver_id == subquery.c.receiver_id),
+            db.and_(Message.sender_id == subquery.c.sender_id, Message.receiver_id == n)
+        ),
+        Message.created_at == subquery.c.latest_message_time
+    )).all()
+
+
+def cached_recent(n):
+    return db.session.execute(LATEST_MESSAGES, {'user_id': n}).scalars().all()
+
+
+def legacy_notifications(n):
+    return Notification.query.filter_by(user_id=n).order_by(Notification.created_at.desc()).all()
+
+
+def cached_notifications(n):
+    return db.session.execute(USER_NOTIFICATIONS, {'user_id': n}).scalars().all()
+
+
+def per_call_us(fn, calls):
+    for n in range(2, 12):
+        fn(n)  # warm the statement caches
+    started = time.perf_counter()
+    for i in range(calls):
+        fn(2 + i % (USERS - 1))
+    return (time.perf_counter() - started) / calls * 1e6
+
+
+def hydrate(load, population):
+    """(ms, peak KiB) to load `population` users with `load` and score them."""
+    db.session.expunge_all()
+    me = db.session.get(User, 1)
+    tracemalloc.start()
+    started = time.perf_counter()
+    candidates = load(User.query.filter(User.id <= population))
+    for other in candidates:
+        compatibility_score(me, other)
+    elapsed = time.perf_counter() - started
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    db.session.expunge_all()
+    return elapsed * 1000, peak / 1024
+
+
+def bench_hydration(population=20000):
+    db.session.add_all(User(
+        name=f'Extra {n}', email=f'extra{n}@bench.test', password_hash='$2b$12$' + 'x' * 53,
+        age=20 + n % 15, gender='Female', occupation='Engineer', budget='₹9000',
+        habits='["early", "tidy"]', interests='["music"]', bio='Looking for a quiet flatmate.',
+        location='Pune'
+    ) for n in range(population - USERS))
+    db.session.commit()
+
+    print(f'\n{"candidates":<24}{"entities ms":>16}{"rows ms":>16}{"entities KiB":>14}{"rows KiB":>12}')
+    for size in (1000, population):
+        entity_ms, entity_kib = hydrate(lambda query: query.all(), size)
+        row_ms, row_kib = hydrate(user_rows, size)
+        print(f'{size:<24}{entity_ms:>16.1f}{row_ms:>16.1f}{entity_kib:>14.0f}{row_kib:>12.0f}')
+
+
+def main(calls=2000):
+    app = create_app(TestingConfig)
+    with app.app_context():
+        db.create_all()
+        seed()
+        print(f'{"query":<24}{"before us/call":>16}{"after us/call":>16}{"speedup":>10}')
+        for name, legacy, cached in (
+            ('conversation page', legacy_conversation, cached_conversation),
+            ('match pair lookup', legacy_match_pair, cached_match_pair),
+            ('recent conversations', legacy_recent, cached_recent),
+            ('notifications', legacy_notifications, cached_notifications),
+        ):
+            before = per_call_us(legacy, calls)
+            after = per_call_us(cached, calls)
+            print(f'{name:<24}{before:>16.1f}{after:>16.1f}{before / after:>9.2f}x')
+        bench_hydration()
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 2000)
@@ -1,21 +1,78 @@
 from models import db, Message, Notification, User
-from flask_socketio import emit, join_room, leave_room
+from flask import current_app, request, session
+from flask_jwt_extended import decode_token
+from flask_socketio import ConnectionRefusedError, emit, join_room, leave_room
+from presence import get_presence, online_status
+from media import picture_urls
+from rate_limit import rate_limited
+from archive import archived_conversation
+from outbox import outbox_handler, enqueue_event, emit_event, wake_outbox_worker
+from read_models import user_rows
+from read_receipts import get_read_receipts, get_watermarks, latest_message_id, unread_messages_query
+from sqlalchemy import and_, bindparam, case, func, or_, select
+from sqlalchemy.exc import IntegrityError
 import json
+from datetime import timezone
+
+# Positional layout of a message in compact (batched) socket payloads
+COMPACT_MESSAGE_FIELDS = ('id', 'client_id', 'receiver_id', 'content', 'message_type', 'created_at')
+
+# Hot read queries are built once with bound parameters, so each call skips
+# rebuilding the expression and its cache key and reuses the compiled SQL.
+_pair = (
+    ((Message.sender_id == bindparam('user1_id')) & (Message.receiver_id == bindparam('user2_id'))) |
+    ((Message.sender_id == bindparam('user2_id')) & (Message.receiver_id == bindparam('user1_id')))
+)
+CONVERSATION_PAGE = select(Message).where(_pair) \
+    .order_by(Message.created_at.desc()).offset(bindparam('offset')).limit(bindparam('limit'))
+CONVERSATION_COUNT = select(func.count(Message.id)).where(_pair)
+
+_user_id = bindparam('user_id')
+_latest = select(
+    Message.sender_id,
+    Message.receiver_id,
+    func.max(Message.created_at).label('latest_message_time')
+).where(
+    (Message.sender_id == _user_id) | (Message.receiver_id == _user_id)
+).group_by(
+    case((Message.sender_id == _user_id, Message.receiver_id), else_=Message.sender_id)
+).subquery()
+# The newest message of each of a user's conversations
+LATEST_MESSAGES = select(Message).join(_latest, and_(
+    or_(
+        and_(Message.sender_id == _user_id, Message.receiver_id == _latest.c.receiver_id),
+        and_(Message.sender_id == _latest.c.sender_id, Message.receiver_id == _user_id)
+    ),
+    Message.created_at == _latest.c.latest_message_time
+))
 
 def init_socket_events(socketio):
     @socketio.on('connect')
-    def handle_connect():
-        print('Client connected')
+    def handle_connect(auth=None):
+        """Accept `{'token': <access token>}` as connect auth; the session then
+        belongs to that user. Sessions without a token stay anonymous."""
+        token = auth.get('token') if isinstance(auth, dict) else None
+        if token:
+            try:
+                claims = decode_token(token)
+            except Exception:
+                raise ConnectionRefusedError('invalid_token')
+            if claims.get('type') != 'access':
+                raise ConnectionRefusedError('invalid_token')
+            session['user_id'] = claims['sub']
+        current_app.logger.debug(f'Client connected: {request.sid}')
 
     @socketio.on('disconnect')
     def handle_disconnect():
-        print('Client disconnected')
+        get_presence().disconnect(request.sid)
 
     @socketio.on('join')
+    @rate_limited('join')
     def handle_join(data):
         user_id = data.get('user_id')
         if user_id:
             join_room(f'user_{user_id}')
+            get_presence().connect(user_id, request.sid)
             emit('joined', {'message': f'Joined room for user {user_id}'})
 
     @socketio.on('leave')
@@ -23,9 +80,27 @@ def init_socket_events(socketio):
         user_id = data.get('user_id')
         if user_id:
             leave_room(f'user_{user_id}')
+            get_presence().disconnect(request.sid)
             emit('left', {'message': f'Left room for user {user_id}'})
 
+    @socketio.on('heartbeat')
+    @rate_limited('heartbeat')
+    def handle_heartbeat(data=None):
+        """Keep this session online; {'ok': False} means the client must join again."""
+        return {'ok': get_presence().heartbeat(request.sid)}
+
+    @socketio.on('presence')
+    @rate_limited('presence')
+    def handle_presence(data):
+        """Bulk online-status lookup: {'user_ids': [...]} -> {id: bool}."""
+        try:
+            statuses = online_status(data['user_ids'])
+            return {str(user_id): online for user_id, online in statuses.items()}
+        except Exception as e:
+            emit('error', {'message': str(e)})
+
     @socketio.on('send_message')
+    @rate_limited('send_message')
     def handle_send_message(data):
         try:
             sender_id = data['sender_id']
@@ -33,78 +108,236 @@ def init_socket_events(socketio):
             content = data['content']
             message_type = data.get('message_type', 'text')
 
-            # Save message to database
+            # Save the message; notification and emits are delivered by the outbox
             message = Message(
                 sender_id=sender_id,
                 receiver_id=receiver_id,
                 content=content,
-                message_type=message_type
+                message_type=message_type,
+                client_id=data.get('client_id')
             )
             db.session.add(message)
+            db.session.flush()
+            enqueue_event('message.created', {'message_id': message.id})
             db.session.commit()
+            wake_outbox_worker()
 
-            # Create notification for receiver
-            sender = User.query.get(sender_id)
-            notification = Notification(
-                user_id=receiver_id,
-                title='New Message',
-                message=f'You have a new message from {sender.name}',
-                notification_type='message'
-            )
-            db.session.add(notification)
-            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            emit('error', {'message': str(e)})
 
-            # Emit message to receiver's room
-            message_data = {
-                'id': message.id,
-                'sender_id': sender_id,
-                'receiver_id': receiver_id,
-                'content': content,
-                'message_type': message_type,
-                'is_read': False,
-                'created_at': message.created_at.isoformat(),
-                'sender_name': sender.name
-            }
+    @socketio.on('send_messages')
+    @rate_limited('send_messages')
+    def handle_send_messages(data):
+        """Persist a burst of messages at once; the return value is the per-item ack."""
+        try:
+            sender_id = data['sender_id']
+            items = data['messages']
+            if len(items) > current_app.config['MAX_MESSAGE_BATCH']:
+                emit('error', {'message': f"At most {current_app.config['MAX_MESSAGE_BATCH']} messages per batch"})
+                return []
 
-            emit('receive_message', message_data, room=f'user_{receiver_id}')
-            emit('message_sent', message_data, room=f'user_{sender_id}')
+            acks, created = save_message_batch(sender_id, items)
+            if created:
+                wake_outbox_worker()
+
+            return acks
 
         except Exception as e:
             emit('error', {'message': str(e)})
 
     @socketio.on('mark_messages_read')
+    @rate_limited('mark_messages_read')
     def handle_mark_messages_read(data):
         try:
             user_id = data['user_id']
             other_user_id = data['other_user_id']
 
-            # Mark messages as read
-            Message.query.filter(
-                Message.sender_id == other_user_id,
-                Message.receiver_id == user_id,
-                Message.is_read == False
-            ).update({'is_read': True})
-
-            db.session.commit()
+            # Move the watermark; writes are coalesced by the buffer. A client
+            # can't mark past the newest message it has actually been sent.
+            latest = latest_message_id(other_user_id, user_id)
+            message_id = min(int(data['message_id']), latest) if data.get('message_id') else latest
+            if message_id and get_read_receipts().mark(user_id, other_user_id, message_id):
+                emit('messages_read', {'reader_id': user_id, 'last_read_message_id': message_id},
+                     room=f'user_{other_user_id}')
 
-            emit('messages_marked_read', {'other_user_id': other_user_id})
+            emit('messages_marked_read', {'other_user_id': other_user_id, 'last_read_message_id': message_id})
 
         except Exception as e:
             emit('error', {'message': str(e)})
 
+def compact_message(message):
+    """Encode a message as a list in COMPACT_MESSAGE_FIELDS order."""
+    return [
+        message.id,
+        message.client_id,
+        message.receiver_id,
+        message.content,
+        message.message_type,
+        # created_at is naive UTC; without a tzinfo timestamp() assumes local time
+        int(message.created_at.replace(tzinfo=timezone.utc).timestamp() * 1000)
+    ]
+
+def _as_id(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+def save_message_batch(sender_id, items):
+    """Store a batch of messages from one sender in a single transaction.
+
+    Each item needs a client-generated `client_id`; items whose id was already
+    stored (a retried send) are acked as duplicates instead of inserted again,
+    and items addressed to unknown users get an error ack. Delivery of the
+    new messages is queued as one outbox event.
+    Returns (acks, created messages).
+    """
+    sender = User.query.get(sender_id)
+    if not sender:
+        raise ValueError('Sender not found')
+
+    # Checked up front: one bad receiver would otherwise fail the whole batch's commit
+    receiver_ids = {_as_id(item.get('receiver_id')) for item in items} - {None}
+    known_receivers = {
+        row.id for row in db.session.query(User.id).filter(User.id.in_(receiver_ids))
+    } if receiver_ids else set()
+
+    for attempt in range(2):
+        client_ids = [str(item.get('client_id')) for item in items if item.get('client_id')]
+        existing = {
+            message.client_id: message.id
+            for message in Message.query.filter(
+                Message.sender_id == sender_id,
+                Message.client_id.in_(client_ids)
+            )
+        } if client_ids else {}
+
+        acks, created, pending = [], [], {}
+        for item in items:
+            client_id = str(item['client_id']) if item.get('client_id') else None
+            if not client_id or not item.get('receiver_id') or not item.get('content'):
+                acks.append({'client_id': client_id, 'status': 'error',
+                             'error': 'client_id, receiver_id and content are required'})
+            elif _as_id(item['receiver_id']) not in known_receivers:
+                acks.append({'client_id': client_id, 'status': 'error', 'error': 'Receiver not found'})
+            elif client_id in existing:
+                acks.append({'client_id': client_id, 'status': 'duplicate', 'id': existing[client_id]})
+            elif client_id in pending:
+                acks.append({'client_id': client_id, 'status': 'duplicate', 'message': pending[client_id]})
+            else:
+                message = Message(
+                    sender_id=sender_id,
+                    receiver_id=_as_id(item['receiver_id']),
+                    content=item['content'],
+                    message_type=item.get('message_type', 'text'),
+                    client_id=client_id
+                )
+                db.session.add(message)
+                created.append(message)
+                pending[client_id] = message
+                acks.append({'client_id': client_id, 'status': 'created', 'message': message})
+
+        try:
+            if created:
+                db.session.flush()
+                enqueue_event('messages.created', {
+                    'sender_id': sender_id,
+                    'message_ids': [message.id for message in created]
+                })
+            db.session.commit()
+            break
+        except IntegrityError:
+            # A concurrent retry stored some of these first; re-read and ack as duplicates
+            db.session.rollback()
+            if attempt:
+                raise
+
+    for ack in acks:
+        if 'message' in ack:
+            ack['id'] = ack.pop('message').id
+
+    return acks, created
+
+@outbox_handler('message.created')
+def deliver_message(payload):
+    """Outbox: notify the receiver and push the message to both users' rooms."""
+    message = Message.query.get(payload['message_id'])
+    if not message:
+        return
+    sender = User.query.get(message.sender_id)
+    db.session.add(Notification(
+        user_id=message.receiver_id,
+        title='New Message',
+        message=f'You have a new message from {sender.name}',
+        notification_type='message'
+    ))
+
+    message_data = {
+        'id': message.id,
+        'sender_id': message.sender_id,
+        'receiver_id': message.receiver_id,
+        'content': message.content,
+        'message_type': message.message_type,
+        'is_read': False,
+        'created_at': message.created_at.isoformat(),
+        'sender_name': sender.name
+    }
+    emit_event('receive_message', message_data, room=f'user_{message.receiver_id}')
+    emit_event('message_sent', message_data, room=f'user_{message.sender_id}')
+
+@outbox_handler('messages.created')
+def deliver_message_batch(payload):
+    """Outbox: one notification and one compact push per receiver for a batch."""
+    sender_id = payload['sender_id']
+    sender = User.query.get(sender_id)
+    created = Message.query.filter(Message.id.in_(payload['message_ids'])).order_by(Message.id).all()
+    if not created:
+        return
+
+    by_receiver = {}
+    for message in created:
+        by_receiver.setdefault(message.receiver_id, []).append(compact_message(message))
+    for receiver_id, messages in by_receiver.items():
+        count = len(messages)
+        db.session.add(Notification(
+            user_id=receiver_id,
+            title='New Message',
+            message=f'You have {count} new message{"s" if count > 1 else ""} from {sender.name}',
+            notification_type='message'
+        ))
+        emit_event('receive_messages', {'s': sender_id, 'n': sender.name, 'm': messages},
+                   room=f'user_{receiver_id}')
+    emit_event('messages_sent', {'m': [compact_message(m) for m in created]},
+               room=f'user_{sender_id}')
+
 def get_conversation(user1_id, user2_id, page=1, per_page=50):
     """Get conversation between two users"""
     try:
         offset = (page - 1) * per_page
 
-        messages = Message.query.filter(
-            ((Message.sender_id == user1_id) & (Message.receiver_id == user2_id)) |
-            ((Message.sender_id == user2_id) & (Message.receiver_id == user1_id))
-        ).order_by(Message.created_at.desc()).offset(offset).limit(per_page).all()
+        messages = db.session.execute(CONVERSATION_PAGE, {
+            'user1_id': user1_id, 'user2_id': user2_id, 'offset': offset, 'limit': per_page
+        }).scalars().all()
+
+        if len(messages) < per_page:
+            # Scrolled past the hot table: continue into the archive
+            if messages:
+                hot_total = offset + len(messages)
+            else:
+                hot_total = db.session.execute(
+                    CONVERSATION_COUNT, {'user1_id': user1_id, 'user2_id': user2_id}
+                ).scalar()
+            messages.extend(archived_conversation(
+                user1_id, user2_id, max(0, offset - hot_total), per_page - len(messages)
+            ))
 
         # Reverse to get chronological order
         messages.reverse()
 
+        user1_id, user2_id = int(user1_id), int(user2_id)
+        watermarks = get_watermarks([(user1_id, user2_id), (user2_id, user1_id)])
+
         message_data = []
         for message in messages:
             sender = User.query.get(message.sender_id)
@@ -114,7 +347,7 @@ def get_conversation(user1_id, user2_id, page=1, per_page=50):
                 'receiver_id': message.receiver_id,
                 'content': message.content,
                 'message_type': message.message_type,
-                'is_read': message.is_read,
+                'is_read': message.id <= watermarks[(message.receiver_id, message.sender_id)],
                 'created_at': message.created_at.isoformat(),
                 'sender_name': sender.name
             })
@@ -127,10 +360,7 @@ def get_conversation(user1_id, user2_id, page=1, per_page=50):
 def get_unread_count(user_id):
     """Get count of unread messages for a user"""
     try:
-        count = Message.query.filter(
-            Message.receiver_id == user_id,
-            Message.is_read == False
-        ).count()
+        count = unread_messages_query(user_id).count()
 
         return {'unread_count': count}, 200
 
@@ -141,55 +371,38 @@ def get_recent_conversations(user_id):
     """Get recent conversations for a user"""
     try:
         # Get the latest message for each conversation
-        subquery = db.session.query(
-            Message.sender_id,
-            Message.receiver_id,
-            db.func.max(Message.created_at).label('latest_message_time')
-        ).filter(
-            (Message.sender_id == user_id) | (Message.receiver_id == user_id)
-        ).group_by(
-            db.case(
-                (Message.sender_id == user_id, Message.receiver_id),
-                else_=Message.sender_id
-            )
-        ).subquery()
-
-        # Get the actual latest messages
-        latest_messages = db.session.query(Message).join(
-            subquery,
-            db.and_(
-                db.or_(
-                    db.and_(Message.sender_id == user_id, Message.receiver_id == subquery.c.receiver_id),
-                    db.and_(Message.sender_id == subquery.c.sender_id, Message.receiver_id == user_id)
-                ),
-                Message.created_at == subquery.c.latest_message_time
-            )
-        ).all()
+        latest_messages = db.session.execute(LATEST_MESSAGES, {'user_id': user_id}).scalars().all()
+
+        other_ids = [message.receiver_id if message.sender_id == user_id else message.sender_id
+                     for message in latest_messages]
+        online = online_status(other_ids)
+        users = {user.id: user for user in user_rows(User.query.filter(User.id.in_(other_ids)))} \
+            if other_ids else {}
+        unread_counts = dict(
+            unread_messages_query(user_id).with_entities(
+                Message.sender_id, db.func.count(Message.id)
+            ).group_by(Message.sender_id).all()
+        )
 
         conversations = []
         for message in latest_messages:
             other_user_id = message.receiver_id if message.sender_id == user_id else message.sender_id
-            other_user = User.query.get(other_user_id)
-
-            # Count unread messages in this conversation
-            unread_count = Message.query.filter(
-                Message.sender_id == other_user_id,
-                Message.receiver_id == user_id,
-                Message.is_read == False
-            ).count()
+            other_user = users[other_user_id]
 
             conversations.append({
                 'other_user': {
                     'id': other_user.id,
                     'name': other_user.name,
-                    'profile_picture': other_user.profile_picture
+                    'profile_picture': other_user.profile_picture,
+                    'profile_pictures': picture_urls(other_user),
+                    'is_online': online[other_user_id]
                 },
                 'latest_message': {
                     'content': message.content,
                     'created_at': message.created_at.isoformat(),
                     'is_from_me': message.sender_id == user_id
                 },
-                'unread_count': unread_count
+                'unread_count': unread_counts.get(other_user_id, 0)
             })
 
         # Sort by latest message time
@@ -0,0 +1,119 @@
+import os
+
+
+class Config:
+    """Default configuration, read from the environment."""
+    SECRET_KEY = os.getenv('SECRET_KEY', 'your-secret-key-here')
+    SQLALCHEMY_DATABASE_URI = os.getenv('DATABASE_URL', 'sqlite:///roomimatch.db')
+    SQLALCHEMY_TRACK_MODIFICATIONS = False
+    JWT_SECRET_KEY = os.getenv('JWT_SECRET_KEY', 'jwt-secret-key')
+
+    GOOGLE_CLIENT_ID = os.getenv('GOOGLE_CLIENT_ID')
+    GOOGLE_CLIENT_SECRET = os.getenv('GOOGLE_CLIENT_SECRET')
+
+    # Precomputed match suggestions: 'thread' runs the refresh worker inside
+    # the web process, 'off' leaves it to `flask suggestions worker`
+    MATCH_SUGGESTIONS_WORKER = os.getenv('MATCH_SUGGESTIONS_WORKER', 'off')
+    MATCH_SUGGESTIONS_TOP_N = int(os.getenv('MATCH_SUGGESTIONS_TOP_N', 50))
+    MATCH_SUGGESTIONS_POLL_INTERVAL = float(os.getenv('MATCH_SUGGESTIONS_POLL_INTERVAL', 5))
+    # Failed refreshes are retried after MATCH_SUGGESTIONS_RETRY_DELAY seconds,
+    # doubling each time up to the max; queueing the user again resets it
+    MATCH_SUGGESTIONS_RETRY_DELAY = float(os.getenv('MATCH_SUGGESTIONS_RETRY_DELAY', 5))
+    MATCH_SUGGESTIONS_MAX_RETRY_DELAY = float(os.getenv('MATCH_SUGGESTIONS_MAX_RETRY_DELAY', 3600))
+    # Seconds a user's cached match adjacency is trusted before reloading;
+    # bounds staleness from matches made by other processes
+    MATCH_GRAPH_TTL = float(os.getenv('MATCH_GRAPH_TTL', 300))
+
+    # Socket.IO wire format: 'default' (JSON) or 'msgpack'. Polling payloads
+    # over the threshold are compressed; WebSocket permessage-deflate is
+    # negotiated by the server when the client offers it.
+    SOCKETIO_SERIALIZER = os.getenv('SOCKETIO_SERIALIZER', 'default')
+    SOCKETIO_COMPRESSION_THRESHOLD = int(os.getenv('SOCKETIO_COMPRESSION_THRESHOLD', 512))
+    MAX_MESSAGE_BATCH = int(os.getenv('MAX_MESSAGE_BATCH', 50))
+    # Lets processes other than the web server (e.g. `flask outbox worker`)
+    # emit to connected clients, e.g. a redis:// URL
+    SOCKETIO_MESSAGE_QUEUE = os.getenv('SOCKETIO_MESSAGE_QUEUE')
+
+    # Outbox for notifications and socket emits: 'thread' drains it inside
+    # the web process, 'off' leaves it to `flask outbox worker`. Failed
+    # events are retried after OUTBOX_RETRY_DELAY seconds, doubling each time.
+    OUTBOX_WORKER = os.getenv('OUTBOX_WORKER', 'thread')
+    OUTBOX_POLL_INTERVAL = float(os.getenv('OUTBOX_POLL_INTERVAL', 5))
+    OUTBOX_RETRY_DELAY = float(os.getenv('OUTBOX_RETRY_DELAY', 2))
+    OUTBOX_MAX_ATTEMPTS = int(os.getenv('OUTBOX_MAX_ATTEMPTS', 8))
+    OUTBOX_LEASE = int(os.getenv('OUTBOX_LEASE', 60))
+
+    # Shared store for cross-worker state; 'memory://' is a process-local fake,
+    # a redis:// URL needs the optional `redis` package
+    SHARED_STORE_URL = os.getenv('SHARED_STORE_URL', 'memory://')
+
+    # Presence: 'local' (per process) or 'shared' (SHARED_STORE_URL).
+    # Sessions go offline if no heartbeat arrives within PRESENCE_TTL seconds.
+    PRESENCE_BACKEND = os.getenv('PRESENCE_BACKEND', 'local')
+    PRESENCE_TTL = int(os.getenv('PRESENCE_TTL', 60))
+
+    # Seconds to coalesce mark-read events before writing the watermark
+    READ_RECEIPT_DEBOUNCE = float(os.getenv('READ_RECEIPT_DEBOUNCE', 2))
+
+    # Token-bucket limits per user and route/socket event: (capacity, period
+    # in seconds), refilled evenly over the period. 'default' covers the rest.
+    RATE_LIMIT_ENABLED = os.getenv('RATE_LIMIT_ENABLED', 'true').lower() == 'true'
+    RATE_LIMIT_BACKEND = os.getenv('RATE_LIMIT_BACKEND', 'local')  # local, shared
+    RATE_LIMITS = {
+        'default': (120, 60),
+        'api.get_matches': (10, 60),
+        'api.api_get_users': (5, 60),
+        'api.api_search_users': (30, 60),
+        'api.register': (5, 300),
+        'api.login': (10, 300),
+        'api.upload_picture': (10, 3600),
+        'socket.send_message': (30, 10),
+        'socket.send_messages': (10, 10),
+        'socket.mark_messages_read': (30, 10),
+        'socket.presence': (20, 10),
+    }
+    RATE_LIMIT_EXEMPT = {'api.health_check', 'api.readiness_check', 'api.serve_media'}
+
+    # Readiness (/api/ready): comma-separated warm-up steps run once per
+    # process before it reports ready, over the READINESS_HOT_USERS most
+    # recently active users. Pool usage at or above the max is reported as
+    # 'degraded' but stays 200, since a restart would not free connections
+    READINESS_WARMUP_STEPS = os.getenv('READINESS_WARMUP_STEPS', 'statements,profiles,match_graph,matching')
+    READINESS_HOT_USERS = int(os.getenv('READINESS_HOT_USERS', 500))
+    READINESS_WARMUP_MATCHING_USERS = int(os.getenv('READINESS_WARMUP_MATCHING_USERS', 10))
+    READINESS_POOL_MAX_USAGE = float(os.getenv('READINESS_POOL_MAX_USAGE', 0.9))
+
+    # Profile pictures: content-addressed files in MEDIA_STORAGE, served at
+    # MEDIA_URL; variants need the optional Pillow. 'local' keeps them under
+    # MEDIA_ROOT (default instance/media, which does not survive a redeploy on
+    # ephemeral disks); 'module:factory' plugs in another backend.
+    MEDIA_STORAGE = os.getenv('MEDIA_STORAGE', 'local')
+    MEDIA_ROOT = os.getenv('MEDIA_ROOT')
+    MEDIA_URL = os.getenv('MEDIA_URL', '/media')
+    MEDIA_WORKERS = int(os.getenv('MEDIA_WORKERS', 2))
+    MEDIA_MAX_UPLOAD_BYTES = int(os.getenv('MEDIA_MAX_UPLOAD_BYTES', 5 * 1024 * 1024))
+    # Decoded size cap (width x height): a small compressed file can still
+    # expand to gigabytes when the variants are rendered
+    MEDIA_MAX_PIXELS = int(os.getenv('MEDIA_MAX_PIXELS', 25_000_000))
+    # Larger request bodies are refused with 413 before they are read;
+    # leaves room for multipart framing around an upload
+    MAX_CONTENT_LENGTH = MEDIA_MAX_UPLOAD_BYTES + 64 * 1024
+
+    # Reverse proxies in front of the app (Render: 1). Their X-Forwarded-For
+    # and X-Forwarded-Proto are trusted, so remote_addr is the real client.
+    TRUSTED_PROXIES = int(os.getenv('TRUSTED_PROXIES', 0))
+
+    CORS_ORIGINS = [
+        "http://localhost:8081",
+        "http://localhost:3000",
+        "https://roomimatch-frontend.onrender.com"
+    ]
+
+
+class TestingConfig(Config):
+    TESTING = True
+    SQLALCHEMY_DATABASE_URI = 'sqlite:///:memory:'
+    MATCH_SUGGESTIONS_WORKER = 'off'
+    OUTBOX_WORKER = 'off'
+    READ_RECEIPT_DEBOUNCE = 0
+    RATE_LIMIT_ENABLED = False
@@ -0,0 +1,159 @@
+import math
+
+EARTH_RADIUS_KM = 6371.0
+KM_PER_DEGREE = 111.32
+GEOHASH_PRECISION = 9
+
+_BASE32 = '0123456789bcdefghjkmnpqrstuvwxyz'
+
+# Offline city table: normalized name -> (latitude, longitude)
+CITY_COORDINATES = {
+    'agra': (27.1767, 78.0081),
+    'ahmedabad': (23.0225, 72.5714),
+    'amritsar': (31.6340, 74.8723),
+    'bengaluru': (12.9716, 77.5946),
+    'bhopal': (23.2599, 77.4126),
+    'bhubaneswar': (20.2961, 85.8245),
+    'chandigarh': (30.7333, 76.7794),
+    'chennai': (13.0827, 80.2707),
+    'coimbatore': (11.0168, 76.9558),
+    'dehradun': (30.3165, 78.0322),
+    'delhi': (28.6139, 77.2090),
+    'faridabad': (28.4089, 77.3178),
+    'ghaziabad': (28.6692, 77.4538),
+    'goa': (15.4909, 73.8278),
+    'gurugram': (28.4595, 77.0266),
+    'guwahati': (26.1445, 91.7362),
+    'hyderabad': (17.3850, 78.4867),
+    'indore': (22.7196, 75.8577),
+    'jaipur': (26.9124, 75.7873),
+    'kanpur': (26.4499, 80.3319),
+    'kochi': (9.9312, 76.2673),
+    'kolkata': (22.5726, 88.3639),
+    'lucknow': (26.8467, 80.9462),
+    'ludhiana': (30.9010, 75.8573),
+    'madurai': (9.9252, 78.1198),
+    'mangaluru': (12.9141, 74.8560),
+    'mumbai': (19.0760, 72.8777),
+    'mysuru': (12.2958, 76.6394),
+    'nagpur': (21.1458, 79.0882),
+    'nashik': (19.9975, 73.7898),
+    'navi mumbai': (19.0330, 73.0297),
+    'noida': (28.5355, 77.3910),
+    'patna': (25.5941, 85.1376),
+    'pune': (18.5204, 73.8567),
+    'raipur': (21.2514, 81.6296),
+    'ranchi': (23.3441, 85.3096),
+    'surat': (21.1702, 72.8311),
+    'thane': (19.2183, 72.9781),
+    'thiruvananthapuram': (8.5241, 76.9366),
+    'vadodara': (22.3072, 73.1812),
+    'varanasi': (25.3176, 82.9739),
+    'vijayawada': (16.5062, 80.6480),
+    'visakhapatnam': (17.6868, 83.2185),
+}
+
+CITY_ALIASES = {
+    'bangalore': 'bengaluru',
+    'bombay': 'mumbai',
+    'calcutta': 'kolkata',
+    'madras': 'chennai',
+    'gurgaon': 'gurugram',
+    'new delhi': 'delhi',
+    'mysore': 'mysuru',
+    'mangalore': 'mangaluru',
+    'trivandrum': 'thiruvananthapuram',
+    'vizag': 'visakhapatnam',
+    'cochin': 'kochi',
+    'poona': 'pune',
+}
+
+
+def resolve_city(location):
+    """Canonical city name for a free-text location, or None if unknown.
+
+    Tries the whole string, then each comma-separated part, so
+    'Koramangala, Bangalore' resolves to 'bengaluru'.
+    """
+    if not location:
+        return None
+    parts = [' '.join(part.lower().split()) for part in str(location).split(',')]
+    for name in [', '.join(parts)] + parts:
+        name = CITY_ALIASES.get(name, name)
+        if name in CITY_COORDINATES:
+            return name
+    return None
+
+
+def geocode(location):
+    """Look up (lat, lon) for a free-text location, or None if unknown."""
+    city = resolve_city(location)
+    return CITY_COORDINATES[city] if city else None
+
+
+def haversine_km(lat1, lon1, lat2, lon2):
+    """Great-circle distance between two points in kilometres."""
+    phi1, phi2 = math.radians(lat1), math.radians(lat2)
+    dphi = phi2 - phi1
+    dlambda = math.radians(lon2 - lon1)
+    a = math.sin(dphi / 2) ** 2 + math.cos(phi1) * math.cos(phi2) * math.sin(dlambda / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(math.sqrt(a))
+
+
+def geohash_encode(lat, lon, precision=GEOHASH_PRECISION):
+    """Encode a point as a base32 geohash string."""
+    lat_range, lon_range = [-90.0, 90.0], [-180.0, 180.0]
+    chars = []
+    bits, bit_count, even = 0, 0, True
+    while len(chars) < precision:
+        rng, value = (lon_range, lon) if even else (lat_range, lat)
+        mid = (rng[0] + rng[1]) / 2
+        bits <<= 1
+        if value >= mid:
+            bits |= 1
+            rng[0] = mid
+        else:
+            rng[1] = mid
+        even = not even
+        bit_count += 1
+        if bit_count == 5:
+            chars.append(_BASE32[bits])
+            bits, bit_count = 0, 0
+    return ''.join(chars)
+
+
+def _cell_size(precision):
+    """(lat, lon) size in degrees of a geohash cell at `precision`."""
+    lon_bits = (precision * 5 + 1) // 2
+    lat_bits = precision * 5 // 2
+    return 180.0 / 2 ** lat_bits, 360.0 / 2 ** lon_bits
+
+
+def covering_prefixes(lat, lon, radius_km):
+    """Geohash prefixes whose cells together cover the circle around (lat, lon).
+
+    Uses the finest precision whose cells are at least `radius_km` across, so
+    the centre cell and its eight neighbours always contain the circle.
+    """
+    dlat = radius_km / KM_PER_DEGREE
+    # Longitude degrees shrink towards the poles; size for the circle's far edge
+    edge_lat = min(abs(lat) + dlat, 89.9)
+    dlon = radius_km / (KM_PER_DEGREE * math.cos(math.radians(edge_lat)))
+
+    precision = 0
+    while precision < GEOHASH_PRECISION:
+        cell_lat, cell_lon = _cell_size(precision + 1)
+        if cell_lat < dlat or cell_lon < dlon:
+            break
+        precision += 1
+    if precision == 0:
+        return ['']
+
+    cell_lat, cell_lon = _cell_size(precision)
+    prefixes = set()
+    for i in (-1, 0, 1):
+        for j in (-1, 0, 1):
+            p_lat = min(max(lat + i * cell_lat, -89.999999), 89.999999)
+            p_lon = (lon + j * cell_lon + 180.0) % 360.0 - 180.0
+            prefixes.add(geohash_encode(p_lat, p_lon, precision))
+    return sorted(prefixes)
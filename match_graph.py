@@ -0,0 +1,106 @@
+import threading
+import time
+from flask import current_app
+from sqlalchemy import bindparam, select
+from models import db, Match
+
+# Every match touching a set of users; user1_id is covered by the unique
+# constraint and user2_id by its own index
+USERS_MATCHES = select(Match.id, Match.user1_id, Match.user2_id, Match.status).where(
+    Match.user1_id.in_(bindparam('user_ids', expanding=True)) |
+    Match.user2_id.in_(bindparam('user_ids', expanding=True))
+)
+
+
+class MatchGraph:
+    """Per-process adjacency of the match graph: user id -> {other id: (match id, status)}.
+
+    A user's edges are loaded on first use and reloaded after `ttl` seconds,
+    which bounds how long matches made by other processes go unseen; writes
+    from this process are applied immediately through record(). Once every
+    `ttl` seconds, users whose edges have gone stale are evicted, so the cache
+    only holds recently active users.
+    """
+
+    def __init__(self, ttl, clock=time.monotonic):
+        self.ttl = ttl
+        self._clock = clock
+        self._edges = {}  # user_id -> {other_id: (match_id, status)}
+        self._loaded_at = {}
+        self._writes = 0
+        self._next_sweep = clock() + ttl
+        self._lock = threading.Lock()
+
+    def _fresh(self, user_id, now):
+        loaded = self._loaded_at.get(user_id)
+        return loaded is not None and now - loaded < self.ttl
+
+    def preload(self, user_ids):
+        """Load the edges of every user in `user_ids` that is missing or stale."""
+        now = self._clock()
+        with self._lock:
+            if now >= self._next_sweep:
+                self._evict_stale(now)
+            missing = {int(user_id) for user_id in user_ids if not self._fresh(int(user_id), now)}
+            writes = self._writes
+        if not missing:
+            return
+
+        edges = {user_id: {} for user_id in missing}
+        for match_id, user1_id, user2_id, status in db.session.execute(
+                USERS_MATCHES, {'user_ids': list(missing)}):
+            if user1_id in edges:
+                edges[user1_id][user2_id] = (match_id, status)
+            if user2_id in edges:
+                edges[user2_id][user1_id] = (match_id, status)
+
+        with self._lock:
+            self._edges.update(edges)
+            # A record() that raced this read may be missing; reload next time
+            if self._writes == writes:
+                self._loaded_at.update(dict.fromkeys(edges, now))
+
+    def _evict_stale(self, now):
+        """Drop users not loaded within the TTL; they reload on next use. Caller holds the lock."""
+        for user_id in [user_id for user_id in self._edges if not self._fresh(user_id, now)]:
+            del self._edges[user_id]
+            self._loaded_at.pop(user_id, None)
+        self._next_sweep = now + self.ttl
+
+    def __len__(self):
+        with self._lock:
+            return len(self._edges)
+
+    def neighbours(self, user_id):
+        """{other id: (match id, status)} for everyone `user_id` has a match with."""
+        user_id = int(user_id)
+        self.preload([user_id])
+        with self._lock:
+            return dict(self._edges.get(user_id, {}))
+
+    def matched_ids(self, user_id):
+        return set(self.neighbours(user_id))
+
+    def record(self, match_id, user1_id, user2_id, status):
+        """Apply a committed match insert or status change to loaded users."""
+        user1_id, user2_id = int(user1_id), int(user2_id)
+        with self._lock:
+            self._writes += 1
+            for user_id, other_id in ((user1_id, user2_id), (user2_id, user1_id)):
+                if user_id in self._edges:
+                    self._edges[user_id][other_id] = (match_id, status)
+
+    def clear(self):
+        with self._lock:
+            self._edges.clear()
+            self._loaded_at.clear()
+
+
+def init_match_graph(app):
+    graph = MatchGraph(app.config['MATCH_GRAPH_TTL'])
+    app.extensions['match_graph'] = graph
+    return graph
+
+
+def get_match_graph():
+    return current_app.extensions['match_graph']
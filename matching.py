@@ -1,37 +1,69 @@
 import json
-from models import db, User, Match
+import math
+from sqlalchemy import bindparam, select
+from models import db, User, Match, parse_budget, normalize_location
+from presence import online_status
+from match_graph import get_match_graph
+from media import picture_urls
+from read_models import user_rows, get_user_row
+from geo import KM_PER_DEGREE, covering_prefixes, haversine_km
+
+# Width of the age (years) and budget (rupees) buckets used for blocking.
+# The default candidate window is the user's own bucket plus one either side.
+AGE_BAND = 5
+BUDGET_BAND = 5000
+
+# Weights of the compatibility_score terms, shared with score_upper_bound and
+# the parallel rerank so all three rank candidates identically. The age and
+# budget terms start at their maximum and lose a point per year / per step.
+MAX_AGE_SCORE = 20
+MAX_BUDGET_SCORE = 20
+BUDGET_SCORE_STEP = 1000
+SAME_GENDER_SCORE = 10
+SAME_OCCUPATION_SCORE = 10
+SHARED_HABIT_SCORE = 5
+SHARED_INTEREST_SCORE = 4
+
+# Optional proximity term: full marks in the same spot, minus one per step
+MAX_DISTANCE_SCORE = 20
+DISTANCE_STEP_KM = 5
+
+
+def age_score(age, other_age):
+    return max(0, MAX_AGE_SCORE - abs(age - other_age))
+
+
+def budget_score(budget, other_budget):
+    return max(0, MAX_BUDGET_SCORE - abs(budget - other_budget) // BUDGET_SCORE_STEP)
 
 
 def compatibility_score(user: User, other: User) -> float:
-    """Calculate compatibility between two users."""
+    """Calculate compatibility between two users (User entities or UserRows)."""
     score = 0
 
     # Age similarity
     if user.age and other.age:
-        age_diff = abs(user.age - other.age)
-        score += max(0, 20 - age_diff)
+        score += age_score(user.age, other.age)
 
     # Same gender
     if user.gender == other.gender:
-        score += 10
+        score += SAME_GENDER_SCORE
 
     # Same occupation
     if user.occupation == other.occupation:
-        score += 10
+        score += SAME_OCCUPATION_SCORE
 
     # Budget closeness
-    try:
-        b1 = int(str(user.budget).replace("₹", "").replace("k", "000"))
-        b2 = int(str(other.budget).replace("₹", "").replace("k", "000"))
-        score += max(0, 20 - abs(b1 - b2) // 1000)
-    except:
-        pass
+    b1 = parse_budget(user.budget)
+    b2 = parse_budget(other.budget)
+    if b1 is not None and b2 is not None:
+        score += budget_score(b1, b2)
 
     # Habit similarity
     try:
         u_habits = set(json.loads(user.habits))
         o_habits = set(json.loads(other.habits))
-        score += len(u_habits.intersection(o_habits)) * 5
+        score += len(u_habits.intersection(o_habits)) * SHARED_HABIT_SCORE
     except:
         pass
 
@@ -39,50 +71,229 @@ def compatibility_score(user: User, other: User) -> float:
     try:
         u_interests = set(json.loads(user.interests))
         o_interests = set(json.loads(other.interests))
-        score += len(u_interests.intersection(o_interests)) * 4
+        score += len(u_interests.intersection(o_interests)) * SHARED_INTEREST_SCORE
     except:
         pass
 
     return score
 
 
-def find_potential_matches(user_id, filters=None):
-    """Return sorted list of potential matches."""
+def distance_km(user, other):
+    """Distance between two geocoded users, or None if either is unknown."""
+    if user.latitude is None or other.latitude is None:
+        return None
+    return haversine_km(user.latitude, user.longitude, other.latitude, other.longitude)
 
-    user = User.query.get(user_id)
-    if not user:
-        return []
 
-    query = User.query.filter(User.id != user_id)
+def distance_score(km):
+    return max(0, MAX_DISTANCE_SCORE - int(km // DISTANCE_STEP_KM))
 
-    # Apply filters
+
+def _json_set(value):
+    try:
+        return set(json.loads(value))
+    except (TypeError, ValueError):
+        return set()
+
+
+def score_upper_bound(user, age_radius, budget_radius, score_distance=False):
+    """Best score any candidate outside the given age/budget window can reach.
+
+    A candidate outside the window is either more than `age_radius` years or
+    more than `budget_radius` rupees away, so at most one of those two terms
+    can still be at its maximum.
+    """
+    bound = SAME_GENDER_SCORE + SAME_OCCUPATION_SCORE
+    bound += len(_json_set(user.habits)) * SHARED_HABIT_SCORE
+    bound += len(_json_set(user.interests)) * SHARED_INTEREST_SCORE
+    if score_distance:
+        bound += MAX_DISTANCE_SCORE
+
+    age_outside = max(0, MAX_AGE_SCORE - (age_radius + 1))
+    if parse_budget(user.budget) is None:
+        return bound + age_outside
+
+    budget_outside = max(0, MAX_BUDGET_SCORE - (budget_radius + 1) // BUDGET_SCORE_STEP)
+    return bound + max(MAX_AGE_SCORE + budget_outside, age_outside + MAX_BUDGET_SCORE)
+
+
+def _window(user, age_radius, budget_radius):
+    """SQL condition for candidates within the given age/budget radius."""
+    condition = User.age.between(user.age - age_radius, user.age + age_radius)
+    budget = parse_budget(user.budget)
+    if budget is not None:
+        # Unparseable budgets form their own bucket, compatible with every user
+        condition = condition & (
+            User.budget_amount.between(budget - budget_radius, budget + budget_radius) |
+            User.budget_amount.is_(None)
+        )
+    return condition
+
+
+def _geohash_condition(user, radius_km):
+    """Index range scan over the geohash cells covering `radius_km` around `user`."""
+    condition = db.false()
+    for prefix in covering_prefixes(user.latitude, user.longitude, radius_km):
+        if not prefix:
+            return User.geohash.isnot(None)
+        # '~' sorts after every base32 character
+        condition = condition | ((User.geohash >= prefix) & (User.geohash < prefix + '~'))
+    return condition
+
+
+def radius_condition(user, radius_km):
+    """Geohash pre-filter plus a lat/lon bounding box around `user`.
+
+    The box is a square approximation of the circle; callers that need exact
+    distances check them with distance_km() after loading.
+    """
+    dlat = radius_km / KM_PER_DEGREE
+    edge_lat = min(abs(user.latitude) + dlat, 89.9)
+    dlon = radius_km / (KM_PER_DEGREE * math.cos(math.radians(edge_lat)))
+    return _geohash_condition(user, radius_km) \
+        & User.latitude.between(user.latitude - dlat, user.latitude + dlat) \
+        & User.longitude.between(user.longitude - dlon, user.longitude + dlon)
+
+
+def apply_filters(query, filters):
+    """Apply the exact-match profile filters shared by matching and search."""
     if filters:
         if "gender" in filters:
-            query = query.filter_by(gender=filters["gender"])
+            query = query.filter(User.gender == filters["gender"])
         if "budget" in filters:
-            query = query.filter_by(budget=filters["budget"])
+            query = query.filter(User.budget == filters["budget"])
         if "occupation" in filters:
-            query = query.filter_by(occupation=filters["occupation"])
+            query = query.filter(User.occupation == filters["occupation"])
+    return query
+
+
+def candidate_query(user, filters=None):
+    """Base candidate query: everyone but `user` and the users they already have
+    a match with, in a compatible location bucket.
+
+    With a `radius_km` filter the free-text location bucket is replaced by a
+    geohash pre-filter; exact distances are checked after loading.
+    """
+    query = User.query.filter(User.id != user.id)
+    matched = get_match_graph().matched_ids(user.id)
+    if matched:
+        query = query.filter(User.id.notin_(matched))
+
+    radius_km = filters.get("radius_km") if filters else None
+    if radius_km is not None:
+        if user.latitude is None:
+            return query.filter(db.false())
+        query = query.filter(radius_condition(user, radius_km))
+    else:
+        location_key = normalize_location(user.location)
+        if location_key:
+            query = query.filter((User.location_key == location_key) | User.location_key.is_(None))
+
+    return apply_filters(query, filters)
+
+
+def _scorer(user, filters=None, score_distance=False):
+    """Return a function scoring a candidate, or None if it is out of radius."""
+    radius_km = filters.get("radius_km") if filters else None
+    if radius_km is None and not score_distance:
+        return lambda other: compatibility_score(user, other)
+
+    def score(other):
+        km = distance_km(user, other)
+        if radius_km is not None and (km is None or km > radius_km):
+            return None
+        value = compatibility_score(user, other)
+        if score_distance and km is not None:
+            value += distance_score(km)
+        return value
+
+    return score
+
 
-    candidates = query.all()
+def _score_all(scorer, query):
     results = []
+    for other in user_rows(query):
+        score = scorer(other)
+        if score is not None:
+            results.append((other, score))
+    return results
+
 
-    for other in candidates:
-        score = compatibility_score(user, other)
-        results.append((other, score))
+def generate_candidates(user, filters=None, limit=None, guaranteed_recall=False, score_distance=False):
+    """Return scored (UserRow, score) pairs from the user's neighbouring buckets.
 
-    # Sort highest compatibility first
-    results.sort(key=lambda x: x[1], reverse=True)
+    By default only users in the same location bucket and within one age and
+    budget band are scored. With `guaranteed_recall` the window grows one band
+    at a time until the `limit`-th best score is at least the best score any
+    user outside the window could reach, so the top `limit` matches are exact.
+    """
+    query = candidate_query(user, filters)
+    scorer = _scorer(user, filters, score_distance)
+
+    if not guaranteed_recall:
+        return _score_all(scorer, query.filter(_window(user, AGE_BAND, BUDGET_BAND)))
+
+    if not limit:
+        raise ValueError("guaranteed_recall requires a limit")
+
+    results = []
+    previous = None
+    step = 1
+    while True:
+        age_radius, budget_radius = step * AGE_BAND, step * BUDGET_BAND
+        window = _window(user, age_radius, budget_radius)
+        ring = query.filter(window)
+        if previous is not None:
+            ring = ring.filter(~previous)
+        results.extend(_score_all(scorer, ring))
+
+        bound = score_upper_bound(user, age_radius, budget_radius, score_distance)
+        if len(results) >= limit:
+            cutoff = sorted((score for _, score in results), reverse=True)[limit - 1]
+            if cutoff >= bound:
+                return results
+
+        if age_radius > MAX_AGE_SCORE and budget_radius > MAX_BUDGET_SCORE * BUDGET_SCORE_STEP:
+            # Widening further cannot lower the bound; score whatever is left
+            results.extend(_score_all(scorer, query.filter(~window)))
+            return results
+
+        previous = window
+        step += 1
+
+
+def find_potential_matches(user_id, filters=None, limit=None, guaranteed_recall=False,
+                           score_distance=False):
+    """Return sorted list of (UserRow, score) potential matches.
+
+    `filters` may include gender, budget, occupation and radius_km. With
+    `score_distance`, proximity between geocoded users adds to the score.
+    """
+
+    user = get_user_row(user_id)
+    if not user:
+        return []
+
+    results = generate_candidates(user, filters, limit, guaranteed_recall, score_distance)
+
+    # Highest compatibility first, ties by id, the same order rerank stores
+    results.sort(key=lambda x: (-x[1], x[0].id))
+    if limit:
+        results = results[:limit]
     return results
 
 
+# Built once with bound parameters so repeat calls reuse the compiled SQL
+MATCH_BETWEEN = select(Match.id).where(
+    ((Match.user1_id == bindparam('user1_id')) & (Match.user2_id == bindparam('user2_id'))) |
+    ((Match.user1_id == bindparam('user2_id')) & (Match.user2_id == bindparam('user1_id')))
+).limit(1)
+
+
 def create_match(user1_id, user2_id):
     """Create a new match if not exists."""
 
-    existing = Match.query.filter(
-        ((Match.user1_id == user1_id) & (Match.user2_id == user2_id)) |
-        ((Match.user1_id == user2_id) & (Match.user2_id == user1_id))
-    ).first()
+    existing = db.session.execute(MATCH_BETWEEN, {'user1_id': user1_id, 'user2_id': user2_id}).first()
 
     if existing:
         return {"error": "Match already exists"}, 400
@@ -95,25 +306,26 @@ def create_match(user1_id, user2_id):
 
     db.session.add(match)
     db.session.commit()
+    get_match_graph().record(match.id, user1_id, user2_id, match.status)
 
     return {"message": "Match created", "match_id": match.id}, 201
 
 
 def get_user_matches(user_id):
     """Return all matches for a user."""
-    matches = Match.query.filter(
-        (Match.user1_id == user_id) | (Match.user2_id == user_id)
-    ).all()
-
+    edges = get_match_graph().neighbours(user_id)
+    users = {user.id: user for user in user_rows(User.query.filter(User.id.in_(edges)))} if edges else {}
+    online = online_status(list(edges))
     result = []
 
-    for m in matches:
-        other_id = m.user2_id if m.user1_id == user_id else m.user1_id
-        other_user = User.query.get(other_id)
+    for other_id, (match_id, status) in sorted(edges.items(), key=lambda edge: edge[1][0]):
+        other_user = users.get(other_id)
+        if not other_user:
+            continue
 
         result.append({
-            "match_id": m.id,
-            "status": m.status,
+            "match_id": match_id,
+            "status": status,
             "user": {
                 "id": other_user.id,
                 "name": other_user.name,
@@ -126,6 +338,8 @@ def get_user_matches(user_id):
                 "bio": other_user.bio,
                 "location": other_user.location,
                 "profile_picture": other_user.profile_picture,
+                "profile_pictures": picture_urls(other_user),
+                "is_online": online[other_id],
             }
         })
 
@@ -145,5 +359,6 @@ def update_match_status(match_id, user_id, status):
 
     match.status = status
     db.session.commit()
+    get_match_graph().record(match.id, match.user1_id, match.user2_id, status)
 
     return {"message": "Match status updated"}, 200
@@ -0,0 +1,335 @@
+"""Profile pictures: content-addressed storage and resized variants.
+
+An upload is stored under the SHA-256 of its bytes, so a URL never changes
+meaning and can be cached forever. Thumbnail and medium JPEG variants are
+rendered in a background pool next to the original; until a variant exists
+(or if Pillow is not installed) its URL serves the original instead.
+
+Dimensions are read from the image header before anything is stored, so
+uploads that don't parse or would decode to more than MEDIA_MAX_PIXELS are
+refused up front.
+"""
+import hashlib
+import io
+import os
+import struct
+import threading
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from flask import current_app
+from werkzeug.utils import import_string
+from models import db, User
+
+# name -> longest edge in pixels
+VARIANTS = {'thumb': 128, 'medium': 512}
+IMMUTABLE_CACHE = 'public, max-age=31536000, immutable'
+
+# Leading bytes -> stored extension; anything else is rejected
+_SIGNATURES = (
+    (b'\xff\xd8\xff', 'jpg'),
+    (b'\x89PNG\r\n\x1a\n', 'png'),
+    (b'GIF87a', 'gif'),
+    (b'GIF89a', 'gif'),
+)
+EXTENSIONS = ('jpg', 'png', 'gif', 'webp')
+
+# JPEG start-of-frame markers, which carry the dimensions (not DHT/JPG/DAC)
+_JPEG_SOF = set(range(0xC0, 0xD0)) - {0xC4, 0xC8, 0xCC}
+
+
+STORAGE_BACKENDS = {}
+
+
+def storage_backend(name):
+    """Register a factory building a MEDIA_STORAGE backend from the app."""
+    def register(factory):
+        STORAGE_BACKENDS[name] = factory
+        return factory
+    return register
+
+
+class LocalStorage:
+    """Files under a directory on this machine.
+
+    Other backends (object stores, a mounted volume) need the same exists(),
+    save() and open() methods.
+    """
+
+    def __init__(self, root):
+        self.root = root
+
+    def path(self, key):
+        return os.path.join(self.root, *key.split('/'))
+
+    def exists(self, key):
+        return os.path.exists(self.path(key))
+
+    def open(self, key):
+        """Binary file object for a stored key."""
+        return open(self.path(key), 'rb')
+
+    def save(self, key, data):
+        path = self.path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Write then rename so readers never see a partial file
+        tmp = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+        with open(tmp, 'wb') as f:
+            f.write(data)
+        os.replace(tmp, path)
+
+
+@storage_backend('local')
+def _local_storage(app):
+    return LocalStorage(app.config['MEDIA_ROOT'] or os.path.join(app.instance_path, 'media'))
+
+
+def init_media(app):
+    """Build the MEDIA_STORAGE backend: a registered name or a 'module:factory' path."""
+    name = app.config['MEDIA_STORAGE']
+    if name in STORAGE_BACKENDS:
+        factory = STORAGE_BACKENDS[name]
+    elif ':' in name:
+        factory = import_string(name)
+    else:
+        raise ValueError(f'Unknown media storage backend: {name}')
+    app.extensions['media'] = {'storage': factory(app), 'pool': None}
+
+
+def get_storage():
+    return current_app.extensions['media']['storage']
+
+
+def _pool(app):
+    state = app.extensions['media']
+    if state['pool'] is None:
+        state['pool'] = ThreadPoolExecutor(max_workers=app.config['MEDIA_WORKERS'],
+                                           thread_name_prefix='media')
+    return state['pool']
+
+
+def sniff_extension(data):
+    """File extension for a supported image, or None."""
+    for signature, extension in _SIGNATURES:
+        if data.startswith(signature):
+            return extension
+    if data[:4] == b'RIFF' and data[8:12] == b'WEBP':
+        return 'webp'
+    return None
+
+
+def _png_size(data):
+    if data[12:16] != b'IHDR' or len(data) < 33:
+        return None
+    # A corrupt header chunk means a corrupt file
+    if struct.unpack('>I', data[29:33])[0] != zlib.crc32(data[12:29]):
+        return None
+    return struct.unpack('>II', data[16:24])
+
+
+def _gif_size(data):
+    return struct.unpack('<HH', data[6:10]) if len(data) >= 10 else None
+
+
+def _jpeg_size(data):
+    offset = 2
+    while offset + 4 <= len(data):
+        if data[offset] != 0xFF:
+            return None
+        marker = data[offset + 1]
+        if marker == 0xFF:
+            offset += 1
+            continue
+        if marker in _JPEG_SOF:
+            if offset + 9 > len(data):
+                return None
+            height, width = struct.unpack('>HH', data[offset + 5:offset + 9])
+            return width, height
+        if marker == 0x01 or 0xD0 <= marker <= 0xD8:
+            offset += 2
+            continue
+        if marker == 0xD9:
+            return None
+        offset += 2 + struct.unpack('>H', data[offset + 2:offset + 4])[0]
+    return None
+
+
+def _webp_size(data):
+    chunk = data[12:16]
+    if chunk == b'VP8 ' and data[23:26] == b'\x9d\x01\x2a' and len(data) >= 30:
+        width, height = struct.unpack('<HH', data[26:30])
+        return width & 0x3FFF, height & 0x3FFF
+    if chunk == b'VP8L' and len(data) >= 25 and data[20] == 0x2F:
+        bits = int.from_bytes(data[21:25], 'little')
+        return (bits & 0x3FFF) + 1, ((bits >> 14) & 0x3FFF) + 1
+    if chunk == b'VP8X' and len(data) >= 30:
+        return int.from_bytes(data[24:27], 'little') + 1, int.from_bytes(data[27:30], 'little') + 1
+    return None
+
+
+_SIZE_READERS = {'png': _png_size, 'gif': _gif_size, 'jpg': _jpeg_size, 'webp': _webp_size}
+
+
+def image_size(data, extension):
+    """(width, height) from the header of a sniffed image, or None if it doesn't parse."""
+    size = _SIZE_READERS[extension](data)
+    if not size or not all(size):
+        return None
+    return size
+
+
+def _verify(data):
+    """Let Pillow, when installed, check the file's structure beyond its header."""
+    try:
+        from PIL import Image
+    except ImportError:
+        return True
+    try:
+        with Image.open(io.BytesIO(data)) as image:
+            image.verify()
+    except Exception:
+        return False
+    return True
+
+
+def original_key(digest, extension):
+    return f'avatars/{digest[:2]}/{digest}/original.{extension}'
+
+
+def variant_key(digest, variant):
+    return f'avatars/{digest[:2]}/{digest}/{variant}.jpg'
+
+
+def media_url(key):
+    return f"{current_app.config['MEDIA_URL']}/{key}"
+
+
+def picture_urls(user):
+    """{'thumb', 'medium', 'original'} URLs for a user's picture, or None.
+
+    Pictures set as a plain URL (e.g. from OAuth) have no variants, so every
+    size points at that URL.
+    """
+    if user.picture_hash:
+        urls = {name: media_url(variant_key(user.picture_hash, name)) for name in VARIANTS}
+        urls['original'] = user.profile_picture
+        return urls
+    if user.profile_picture:
+        return dict.fromkeys((*VARIANTS, 'original'), user.profile_picture)
+    return None
+
+
+def render_variants(storage, digest, extension, max_pixels=None):
+    """Write the missing resized variants of a stored original.
+
+    Originals over `max_pixels` (e.g. stored before the cap was lowered) are
+    left without variants rather than decoded.
+    """
+    try:
+        from PIL import Image, ImageOps
+    except ImportError:
+        return []
+
+    written = []
+    for name, size in VARIANTS.items():
+        key = variant_key(digest, name)
+        if storage.exists(key):
+            continue
+        with storage.open(original_key(digest, extension)) as source, Image.open(source) as image:
+            width, height = image.size
+            if max_pixels and width * height > max_pixels:
+                raise ValueError(f'{width}x{height} is over MEDIA_MAX_PIXELS')
+            # JPEGs decode straight at the smallest DCT scale still covering the variant
+            image.draft('RGB', (size, size))
+            image = ImageOps.exif_transpose(image).convert('RGB')
+            # Other formats shrink by whole-pixel reduce() first, then resample
+            image.thumbnail((size, size), reducing_gap=2.0)
+            out = io.BytesIO()
+            image.save(out, 'JPEG', quality=85, optimize=True, progressive=True)
+        storage.save(key, out.getvalue())
+        written.append(key)
+    return written
+
+
+def store_picture(data):
+    """Store an uploaded image and schedule its variants.
+
+    Returns (digest, extension, future); the future resolves to the list of
+    variant keys written.
+    """
+    extension = sniff_extension(data)
+    if extension is None:
+        raise ValueError('Unsupported image type; use JPEG, PNG, GIF or WebP')
+    size = image_size(data, extension)
+    if size is None:
+        raise ValueError('Picture could not be read')
+    max_pixels = current_app.config['MEDIA_MAX_PIXELS']
+    if size[0] * size[1] > max_pixels:
+        raise ValueError(f'Picture is too large; at most {max_pixels} pixels')
+    if not _verify(data):
+        raise ValueError('Picture could not be read')
+
+    storage = get_storage()
+    digest = hashlib.sha256(data).hexdigest()
+    key = original_key(digest, extension)
+    if not storage.exists(key):
+        storage.save(key, data)
+
+    app = current_app._get_current_object()
+    future = _pool(app).submit(render_variants, storage, digest, extension, max_pixels)
+
+    def log_failure(done):
+        if done.exception():
+            app.logger.error(f'Rendering variants of {digest} failed: {done.exception()}')
+    future.add_done_callback(log_failure)
+    return digest, extension, future
+
+
+def resolve_media(key):
+    """Stored key to serve for `key` and whether it may be cached forever.
+
+    A variant that has not been rendered yet falls back to its original,
+    which must not be cached under the variant's URL. Returns (None, False)
+    for unknown keys.
+    """
+    storage = get_storage()
+    if '..' in key.split('/'):
+        return None, False
+    if storage.exists(key):
+        return key, True
+
+    parts = key.split('/')
+    if len(parts) == 4 and parts[0] == 'avatars' and parts[3] in {f'{name}.jpg' for name in VARIANTS}:
+        for extension in EXTENSIONS:
+            original = original_key(parts[2], extension)
+            if storage.exists(original):
+                return original, False
+    return None, False
+
+
+def upload_profile_picture(user_id, upload):
+    """Store `upload` (a werkzeug FileStorage) as the user's profile picture."""
+    try:
+        user = User.query.get(user_id)
+        if not user:
+            return {'error': 'User not found'}, 404
+        if upload is None:
+            return {'error': 'No picture uploaded'}, 400
+
+        data = upload.read(current_app.config['MEDIA_MAX_UPLOAD_BYTES'] + 1)
+        if len(data) > current_app.config['MEDIA_MAX_UPLOAD_BYTES']:
+            return {'error': 'Picture is too large'}, 413
+
+        try:
+            digest, extension, _ = store_picture(data)
+        except ValueError as e:
+            return {'error': str(e)}, 400
+
+        user.picture_hash = digest
+        user.profile_picture = media_url(original_key(digest, extension))
+        db.session.commit()
+
+        return {'profile_picture': user.profile_picture, 'profile_pictures': picture_urls(user)}, 201
+
+    except Exception as e:
+        db.session.rollback()
+        return {'error': str(e)}, 500
@@ -1,5 +1,7 @@
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import event
 from datetime import datetime
+from geo import CITY_COORDINATES, resolve_city, geohash_encode
 
 db = SQLAlchemy()
 
@@ -15,8 +17,16 @@ class User(db.Model):
     habits = db.Column(db.Text, nullable=False)  # JSON string
     interests = db.Column(db.Text, nullable=False)  # JSON string
     profile_picture = db.Column(db.String(200))
+    picture_hash = db.Column(db.String(64))  # set for uploads stored by media.py
     bio = db.Column(db.Text)
     location = db.Column(db.String(100))
+    # Derived from budget/location for candidate blocking, kept in sync below
+    budget_amount = db.Column(db.Integer, index=True)
+    location_key = db.Column(db.String(100))
+    # Geocoded from location via the offline city table
+    latitude = db.Column(db.Float)
+    longitude = db.Column(db.Float)
+    geohash = db.Column(db.String(12), index=True)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
 
@@ -27,6 +37,117 @@ class User(db.Model):
     received_messages = db.relationship('Message', foreign_keys='Message.receiver_id', backref='receiver_user', lazy=True)
     notifications = db.relationship('Notification', backref='user', lazy=True)
 
+    __table_args__ = (db.Index('ix_user_location_age', 'location_key', 'age'),)
+
+
+def parse_budget(budget):
+    """Parse a budget string such as '₹8000' or '8k' into rupees, or None."""
+    try:
+        return int(str(budget).replace("₹", "").replace("k", "000"))
+    except (TypeError, ValueError):
+        return None
+
+
+def normalize_location(location):
+    """Normalize a free-text location into a blocking key, or None if blank.
+
+    Known cities map to their canonical name so spellings share a bucket.
+    """
+    if not location:
+        return None
+    city = resolve_city(location)
+    if city:
+        return city
+    key = ' '.join(str(location).lower().split())
+    return key or None
+
+
+@event.listens_for(User, 'before_insert')
+@event.listens_for(User, 'before_update')
+def _sync_blocking_keys(mapper, connection, target):
+    target.budget_amount = parse_budget(target.budget)
+    target.location_key = normalize_location(target.location)
+
+    city = resolve_city(target.location)
+    if city:
+        target.latitude, target.longitude = CITY_COORDINATES[city]
+        target.geohash = geohash_encode(target.latitude, target.longitude)
+    else:
+        target.latitude = target.longitude = target.geohash = None
+
+def backfill_blocking_keys(batch_size=500):
+    """Fill derived blocking/geo columns for rows written before they existed.
+
+    Rows whose keys are legitimately NULL (blank location, unparseable budget)
+    are revisited but left unchanged. Returns the number of users updated.
+    """
+    missing = (User.budget_amount.is_(None) | User.location_key.is_(None) |
+               (User.geohash.is_(None) & User.location.isnot(None)))
+    updated = 0
+    last_id = 0
+    while True:
+        users = User.query.filter(missing, User.id > last_id).order_by(User.id).limit(batch_size).all()
+        if not users:
+            return updated
+        for user in users:
+            _sync_blocking_keys(None, None, user)
+            updated += db.session.is_modified(user)
+        db.session.commit()
+        last_id = users[-1].id
+
+
+def dialect_insert(model):
+    """INSERT construct with ON CONFLICT support for `model`'s table, or None
+    if the session's dialect has none."""
+    dialect = db.session.get_bind().dialect.name
+    if dialect == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert
+    elif dialect == 'sqlite':
+        from sqlalchemy.dialects.sqlite import insert
+    else:
+        return None
+    return insert(model.__table__)
+
+def upgrade_schema():
+    """Add columns, indexes and unique constraints the models define but an
+    existing database lacks; create_all() only creates missing tables.
+
+    New columns are added as nullable. Returns the names of what was added.
+    """
+    engine = db.engine
+    inspector = db.inspect(engine)
+    quote = engine.dialect.identifier_preparer.quote
+    added = []
+    with engine.begin() as conn:
+        for table in db.metadata.sorted_tables:
+            if not inspector.has_table(table.name):
+                continue
+            columns = {column['name'] for column in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name not in columns:
+                    conn.execute(db.text(
+                        f'ALTER TABLE {quote(table.name)} ADD COLUMN {quote(column.name)} '
+                        f'{column.type.compile(dialect=engine.dialect)}'
+                    ))
+                    added.append(f'{table.name}.{column.name}')
+
+            indexes = {index['name'] for index in inspector.get_indexes(table.name)}
+            indexes |= {constraint['name'] for constraint in inspector.get_unique_constraints(table.name)}
+            for index in table.indexes:
+                if index.name not in indexes:
+                    index.create(conn)
+                    added.append(index.name)
+            for constraint in table.constraints:
+                if isinstance(constraint, db.UniqueConstraint) and constraint.name \
+                        and constraint.name not in indexes:
+                    # A unique index enforces the same rule and can be added in place
+                    conn.execute(db.text(
+                        f'CREATE UNIQUE INDEX {quote(constraint.name)} ON {quote(table.name)} '
+                        f"({', '.join(quote(column.name) for column in constraint.columns)})"
+                    ))
+                    added.append(constraint.name)
+    return added
+
 class Match(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     user1_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
@@ -35,7 +156,10 @@ class Match(db.Model):
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
 
-    __table_args__ = (db.UniqueConstraint('user1_id', 'user2_id', name='unique_match'),)
+    __table_args__ = (
+        db.UniqueConstraint('user1_id', 'user2_id', name='unique_match'),
+        db.Index('ix_match_user2', 'user2_id'),
+    )
 
 class Message(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -43,9 +167,38 @@ class Message(db.Model):
     receiver_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
     content = db.Column(db.Text, nullable=False)
     message_type = db.Column(db.String(20), default='text')  # text, image, etc.
-    is_read = db.Column(db.Boolean, default=False)
+    # Read state lives in ConversationRead; see read_receipts.py
+    client_id = db.Column(db.String(64))  # client-generated, for idempotent retries
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
 
+    __table_args__ = (
+        db.UniqueConstraint('sender_id', 'client_id', name='unique_client_message'),
+        db.Index('ix_message_pair', 'sender_id', 'receiver_id', 'id'),
+    )
+
+class ConversationRead(db.Model):
+    """Read watermark: `user_id` has read every message from `other_user_id` up to this id."""
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), primary_key=True)
+    other_user_id = db.Column(db.Integer, db.ForeignKey('user.id'), primary_key=True)
+    last_read_message_id = db.Column(db.Integer, nullable=False, default=0)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+class ArchivePartition(db.Model):
+    """Registry of monthly message archive tables created by archive.py."""
+    table_name = db.Column(db.String(64), primary_key=True)
+    month_start = db.Column(db.DateTime, nullable=False, index=True)
+    message_count = db.Column(db.Integer, nullable=False, default=0)
+
+class ConversationArchive(db.Model):
+    """Which archive partitions hold a conversation's messages, and how many.
+
+    The pair is stored with the lower user id first.
+    """
+    user1_id = db.Column(db.Integer, primary_key=True)
+    user2_id = db.Column(db.Integer, primary_key=True)
+    month_start = db.Column(db.DateTime, primary_key=True)
+    message_count = db.Column(db.Integer, nullable=False, default=0)
+
 class Notification(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
@@ -54,3 +207,38 @@ class Notification(db.Model):
     notification_type = db.Column(db.String(50), nullable=False)  # match, message, system
     is_read = db.Column(db.Boolean, default=False)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+class MatchSuggestion(db.Model):
+    """Precomputed top-N candidate for a user, maintained by suggestions.py."""
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False, index=True)
+    candidate_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False, index=True)
+    score = db.Column(db.Float, nullable=False)
+    rank = db.Column(db.Integer, nullable=False)
+    computed_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    __table_args__ = (db.UniqueConstraint('user_id', 'candidate_id', name='unique_suggestion'),)
+
+class SuggestionState(db.Model):
+    """When a user's stored suggestions were last computed, even if none were found."""
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), primary_key=True)
+    computed_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+class SuggestionRefresh(db.Model):
+    """Users whose profile changed since their suggestions were last computed."""
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), primary_key=True)
+    queued_at = db.Column(db.DateTime, default=datetime.utcnow)
+    attempts = db.Column(db.Integer, default=0)
+    available_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)
+
+class OutboxEvent(db.Model):
+    """Side effect recorded in the same transaction as its change; drained by outbox.py."""
+    id = db.Column(db.Integer, primary_key=True)
+    topic = db.Column(db.String(50), nullable=False)
+    payload = db.Column(db.Text, nullable=False)  # JSON string
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    available_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)
+    claim = db.Column(db.String(32), index=True)
+    last_error = db.Column(db.Text)
+    failed_at = db.Column(db.DateTime)  # set once retries are exhausted
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
@@ -1,9 +1,15 @@
+from sqlalchemy import bindparam, select
 from models import db, Notification
+from outbox import outbox_handler, enqueue_event, wake_outbox_worker
+
+# Built once with a bound parameter so repeat calls reuse the compiled SQL
+USER_NOTIFICATIONS = select(Notification).where(Notification.user_id == bindparam('user_id')) \
+    .order_by(Notification.created_at.desc())
 
 def get_user_notifications(user_id):
     """Get notifications for a user"""
     try:
-        notifications = Notification.query.filter_by(user_id=user_id).order_by(Notification.created_at.desc()).all()
+        notifications = db.session.execute(USER_NOTIFICATIONS, {'user_id': user_id}).scalars().all()
 
         notification_data = []
         for notification in notifications:
@@ -39,20 +45,24 @@ def mark_notification_read(notification_id):
         return {'error': str(e)}, 500
 
 def create_notification(user_id, title, message, notification_type):
-    """Create a new notification"""
+    """Queue a new notification; the outbox worker inserts it"""
     try:
-        notification = Notification(
-            user_id=user_id,
-            title=title,
-            message=message,
-            notification_type=notification_type
-        )
-
-        db.session.add(notification)
+        enqueue_event('notification.created', {
+            'user_id': user_id,
+            'title': title,
+            'message': message,
+            'notification_type': notification_type
+        })
         db.session.commit()
+        wake_outbox_worker()
 
-        return notification, 201
+        return {'message': 'Notification queued'}, 202
 
     except Exception as e:
         db.session.rollback()
         return {'error': str(e)}, 500
+
+@outbox_handler('notification.created')
+def deliver_notification(payload):
+    """Outbox: insert a notification queued by create_notification"""
+    db.session.add(Notification(**payload))
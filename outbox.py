@@ -0,0 +1,169 @@
+"""Transactional outbox for notifications and socket emits.
+
+Request handlers add an OutboxEvent to the same session as their own write,
+so an event exists exactly when the change that caused it committed. A
+worker (a thread in the web process, or `flask outbox worker`) hands each
+event to the handler registered for its topic and retries failures with
+exponential backoff.
+
+A handler's database writes commit together with the removal of its event,
+so they happen once; its socket emits are at-least-once.
+"""
+import json
+import threading
+import time
+from datetime import datetime, timedelta
+from uuid import uuid4
+import click
+from flask import current_app
+from flask.cli import AppGroup
+from models import db, OutboxEvent
+
+outbox_cli = AppGroup('outbox', help='Deliver queued notifications and socket events.')
+
+_handlers = {}
+_wake = threading.Event()
+_start_lock = threading.Lock()
+
+
+def outbox_handler(topic):
+    """Register the function that delivers events of `topic`; it gets the payload dict."""
+    def register(handler):
+        _handlers[topic] = handler
+        return handler
+    return register
+
+
+def enqueue_event(topic, payload):
+    """Record a side effect in the current session; it runs after the caller commits."""
+    db.session.add(OutboxEvent(topic=topic, payload=json.dumps(payload)))
+
+
+def wake_outbox_worker():
+    """Nudge the worker after an event has been committed, starting it if configured."""
+    app = current_app._get_current_object()
+    if app.config['OUTBOX_WORKER'] == 'thread':
+        start_outbox_worker(app)
+    _wake.set()
+
+
+def emit_event(event, data, room):
+    """Emit to a room from outside a socket handler (e.g. the outbox worker)."""
+    current_app.extensions['socketio'].emit(event, data, room=room)
+
+
+def _claim_events(batch_size):
+    """Lease up to `batch_size` due events to this worker.
+
+    The lease hides them from other workers; if this one dies mid-batch they
+    become due again once OUTBOX_LEASE seconds pass.
+    """
+    now = datetime.utcnow()
+    due = db.and_(OutboxEvent.failed_at.is_(None), OutboxEvent.available_at <= now)
+    ids = [row.id for row in db.session.query(OutboxEvent.id).filter(due)
+           .order_by(OutboxEvent.id).limit(batch_size)]
+    if not ids:
+        return []
+
+    token = uuid4().hex
+    OutboxEvent.query.filter(OutboxEvent.id.in_(ids), due).update({
+        'claim': token,
+        'available_at': now + timedelta(seconds=current_app.config['OUTBOX_LEASE'])
+    }, synchronize_session=False)
+    db.session.commit()
+    return OutboxEvent.query.filter_by(claim=token).order_by(OutboxEvent.id).all()
+
+
+def _record_failure(event_id, attempts, error):
+    config = current_app.config
+    now = datetime.utcnow()
+    values = {'attempts': attempts, 'last_error': str(error)[:1000], 'claim': None}
+    if attempts >= config['OUTBOX_MAX_ATTEMPTS']:
+        values['failed_at'] = now
+        current_app.logger.error(f'Outbox event {event_id} failed permanently: {error}')
+    else:
+        delay = config['OUTBOX_RETRY_DELAY'] * 2 ** (attempts - 1)
+        values['available_at'] = now + timedelta(seconds=delay)
+    OutboxEvent.query.filter_by(id=event_id).update(values, synchronize_session=False)
+    db.session.commit()
+
+
+def process_outbox(batch_size=100):
+    """Deliver due events in id order. Returns how many were claimed."""
+    events = _claim_events(batch_size)
+    for event in events:
+        event_id, attempts = event.id, event.attempts
+        try:
+            handler = _handlers.get(event.topic)
+            if handler is None:
+                raise LookupError(f'No outbox handler for {event.topic!r}')
+            handler(json.loads(event.payload))
+            db.session.delete(event)
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            _record_failure(event_id, attempts + 1, e)
+    return len(events)
+
+
+def run_outbox_worker(app, stop_event=None):
+    """Drain the outbox until `stop_event` is set."""
+    interval = app.config['OUTBOX_POLL_INTERVAL']
+    while stop_event is None or not stop_event.is_set():
+        with app.app_context():
+            try:
+                processed = process_outbox()
+            except Exception as e:
+                app.logger.error(f"Outbox worker error: {e}")
+                processed = 0
+            finally:
+                db.session.remove()
+        if not processed:
+            _wake.wait(interval)
+            _wake.clear()
+
+
+def start_outbox_worker(app):
+    """Start the in-process outbox worker thread for `app` (once)."""
+    if 'outbox_worker' in app.extensions:
+        return app.extensions['outbox_worker']
+
+    with _start_lock:
+        if 'outbox_worker' not in app.extensions:
+            stop_event = threading.Event()
+            thread = threading.Thread(target=run_outbox_worker, args=(app, stop_event),
+                                      name='outbox-worker', daemon=True)
+            thread.start()
+            app.extensions['outbox_worker'] = (thread, stop_event)
+    return app.extensions['outbox_worker']
+
+
+def init_outbox(app):
+    """In 'thread' mode, start the worker with the first request so backlog left
+    by a previous process drains without waiting for a new event."""
+    if app.config['OUTBOX_WORKER'] != 'thread':
+        return
+
+    @app.before_request
+    def _ensure_outbox_worker():
+        start_outbox_worker(app)
+
+
+@outbox_cli.command('worker')
+def worker_command():
+    """Run the outbox worker in the foreground."""
+    click.echo('Outbox worker started.')
+    run_outbox_worker(current_app._get_current_object())
+
+
+@outbox_cli.command('drain')
+def drain_command():
+    """Deliver everything currently due, then exit."""
+    started = time.perf_counter()
+    total = 0
+    while True:
+        processed = process_outbox()
+        if not processed:
+            break
+        total += processed
+    click.echo(f'Processed {total} outbox events in {time.perf_counter() - started:.1f}s.')
@@ -0,0 +1,145 @@
+import threading
+import time
+from flask import current_app
+from shared_store import connect_shared_store
+
+
+class LocalPresenceStore:
+    """Process-local map of user id -> socket sessions with heartbeat expiry."""
+
+    def __init__(self, ttl, clock=time.monotonic):
+        self.ttl = ttl
+        self._clock = clock
+        self._sessions = {}  # sid -> (user_id, expires_at)
+        self._users = {}  # user_id -> set of sids
+        self._lock = threading.Lock()
+
+    def connect(self, user_id, sid):
+        user_id = int(user_id)
+        with self._lock:
+            previous = self._sessions.get(sid)
+            if previous and previous[0] != user_id:
+                self._drop(sid, previous[0])
+            self._sessions[sid] = (user_id, self._clock() + self.ttl)
+            self._users.setdefault(user_id, set()).add(sid)
+
+    def heartbeat(self, sid):
+        """Extend a session. Returns False if it is unknown or already expired."""
+        with self._lock:
+            session = self._sessions.get(sid)
+            if not session:
+                return False
+            if session[1] <= self._clock():
+                self._drop(sid, session[0])
+                return False
+            self._sessions[sid] = (session[0], self._clock() + self.ttl)
+            return True
+
+    def disconnect(self, sid):
+        with self._lock:
+            session = self._sessions.get(sid)
+            if session:
+                self._drop(sid, session[0])
+                return session[0]
+            return None
+
+    def session_user(self, sid):
+        """User id a session joined as, or None."""
+        with self._lock:
+            session = self._sessions.get(sid)
+            return session[0] if session else None
+
+    def online_status(self, user_ids):
+        now = self._clock()
+        with self._lock:
+            return {
+                user_id: any(self._sessions[sid][1] > now for sid in self._users.get(int(user_id), ()))
+                for user_id in user_ids
+            }
+
+    def _drop(self, sid, user_id):
+        self._sessions.pop(sid, None)
+        sids = self._users.get(user_id)
+        if sids is not None:
+            sids.discard(sid)
+            if not sids:
+                del self._users[user_id]
+
+
+class SharedPresenceStore:
+    """Presence in a Redis-compatible store, shared by every worker.
+
+    Each user has a sorted set of sids scored by expiry time, so stale
+    sessions from crashed workers age out without cleanup.
+    """
+
+    def __init__(self, client, ttl, clock=time.time):
+        self.ttl = ttl
+        self._client = client
+        self._clock = clock
+
+    def _touch(self, user_id, sid):
+        now = self._clock()
+        user_key = f'presence:user:{user_id}'
+        pipe = self._client.pipeline()
+        pipe.zremrangebyscore(user_key, '-inf', now)
+        pipe.zadd(user_key, {sid: now + self.ttl})
+        pipe.expire(user_key, int(self.ttl) + 1)
+        pipe.set(f'presence:sid:{sid}', user_id, ex=int(self.ttl) + 1)
+        pipe.execute()
+
+    def connect(self, user_id, sid):
+        previous = self._client.get(f'presence:sid:{sid}')
+        if previous is not None and int(previous) != int(user_id):
+            self._client.zrem(f'presence:user:{previous}', sid)
+        self._touch(int(user_id), sid)
+
+    def heartbeat(self, sid):
+        user_id = self._client.get(f'presence:sid:{sid}')
+        if user_id is None:
+            return False
+        self._touch(int(user_id), sid)
+        return True
+
+    def disconnect(self, sid):
+        user_id = self._client.get(f'presence:sid:{sid}')
+        if user_id is None:
+            return None
+        pipe = self._client.pipeline()
+        pipe.delete(f'presence:sid:{sid}')
+        pipe.zrem(f'presence:user:{user_id}', sid)
+        pipe.execute()
+        return int(user_id)
+
+    def session_user(self, sid):
+        user_id = self._client.get(f'presence:sid:{sid}')
+        return int(user_id) if user_id is not None else None
+
+    def online_status(self, user_ids):
+        user_ids = list(user_ids)
+        if not user_ids:
+            return {}
+        now = self._clock()
+        pipe = self._client.pipeline()
+        for user_id in user_ids:
+            pipe.zcount(f'presence:user:{int(user_id)}', now, '+inf')
+        return {user_id: count > 0 for user_id, count in zip(user_ids, pipe.execute())}
+
+
+def init_presence(app):
+    ttl = app.config['PRESENCE_TTL']
+    if app.config['PRESENCE_BACKEND'] == 'shared':
+        store = SharedPresenceStore(connect_shared_store(app.config['SHARED_STORE_URL']), ttl)
+    else:
+        store = LocalPresenceStore(ttl)
+    app.extensions['presence'] = store
+    return store
+
+
+def get_presence():
+    return current_app.extensions['presence']
+
+
+def online_status(user_ids):
+    """Bulk online lookup for the current app; no database access."""
+    return get_presence().online_status(user_ids)
@@ -0,0 +1,176 @@
+import math
+import threading
+import time
+from functools import wraps
+from flask import current_app, jsonify, request, session
+from flask_jwt_extended import get_jwt_identity, verify_jwt_in_request
+from flask_socketio import emit
+from shared_store import FakeRedis, connect_shared_store
+
+# Atomic token bucket for the shared store. State is a hash of tokens and the
+# last refill time; idle buckets expire once they would be full again.
+TOKEN_BUCKET_LUA = """
+local capacity = tonumber(ARGV[1])
+local rate = tonumber(ARGV[2])
+local now = tonumber(ARGV[3])
+local cost = tonumber(ARGV[4])
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(state[1]) or capacity
+local ts = tonumber(state[2]) or now
+tokens = math.min(capacity, tokens + math.max(0, now - ts) * rate)
+local allowed = 0
+local retry_after = 0
+if tokens >= cost then
+    tokens = tokens - cost
+    allowed = 1
+else
+    retry_after = (cost - tokens) / rate
+end
+redis.call('HSET', KEYS[1], 'tokens', tokens, 'ts', now)
+redis.call('EXPIRE', KEYS[1], math.ceil(capacity / rate) + 1)
+return {allowed, tostring(retry_after)}
+"""
+
+
+def _take(tokens, ts, now, capacity, rate, cost):
+    """Refill a bucket to `now` and try to take `cost` tokens.
+
+    Returns (tokens left, allowed, seconds until enough tokens).
+    """
+    tokens = min(capacity, tokens + max(0.0, now - ts) * rate)
+    if tokens >= cost:
+        return tokens - cost, True, 0.0
+    return tokens, False, (cost - tokens) / rate
+
+
+def _token_bucket_fake(store, keys, args):
+    capacity, rate, now, cost = (float(arg) for arg in args)
+    state = store.get(keys[0])
+    tokens, ts = map(float, state.split(':')) if state else (capacity, now)
+    tokens, allowed, retry_after = _take(tokens, ts, now, capacity, rate, cost)
+    store.set(keys[0], f'{tokens}:{now}', ex=math.ceil(capacity / rate) + 1)
+    return [int(allowed), str(retry_after)]
+
+
+FakeRedis.register_script_handler(TOKEN_BUCKET_LUA, _token_bucket_fake)
+
+
+class LocalRateLimiter:
+    """Token buckets in process memory; limits apply per worker.
+
+    A bucket that has refilled is the same as no bucket, so those are evicted
+    every `sweep_interval` seconds to keep one entry per recently seen caller.
+    """
+
+    def __init__(self, clock=time.monotonic, sweep_interval=60):
+        self._buckets = {}  # key -> (tokens, last refill, time it is full again)
+        self._lock = threading.Lock()
+        self._clock = clock
+        self.sweep_interval = sweep_interval
+        self._next_sweep = clock() + sweep_interval
+
+    def acquire(self, key, capacity, period, cost=1):
+        """Take `cost` tokens from `key`. Returns (allowed, retry_after seconds)."""
+        rate = capacity / period
+        now = self._clock()
+        with self._lock:
+            tokens, ts, _ = self._buckets.get(key, (capacity, now, now))
+            tokens, allowed, retry_after = _take(tokens, ts, now, capacity, rate, cost)
+            self._buckets[key] = (tokens, now, now + (capacity - tokens) / rate)
+            if now >= self._next_sweep:
+                self._evict_full(now)
+        return allowed, retry_after
+
+    def _evict_full(self, now):
+        self._buckets = {key: bucket for key, bucket in self._buckets.items() if bucket[2] > now}
+        self._next_sweep = now + self.sweep_interval
+
+
+class SharedRateLimiter:
+    """Token buckets in the shared store, so limits hold across workers."""
+
+    def __init__(self, client, clock=time.time):
+        self._script = client.register_script(TOKEN_BUCKET_LUA)
+        self._clock = clock
+
+    def acquire(self, key, capacity, period, cost=1):
+        allowed, retry_after = self._script(
+            keys=[f'ratelimit:{key}'],
+            args=[capacity, capacity / period, self._clock(), cost]
+        )
+        return bool(int(allowed)), float(retry_after)
+
+
+def _limit_for(name):
+    limits = current_app.config['RATE_LIMITS']
+    return limits.get(name, limits['default'])
+
+
+def check_rate_limit(name, identity):
+    """Apply the limit configured for `name` to `identity`. Returns (allowed, retry_after)."""
+    if not current_app.config['RATE_LIMIT_ENABLED'] or name in current_app.config['RATE_LIMIT_EXEMPT']:
+        return True, 0.0
+    capacity, period = _limit_for(name)
+    return current_app.extensions['rate_limiter'].acquire(f'{name}:{identity}', capacity, period)
+
+
+def _request_identity():
+    try:
+        verify_jwt_in_request(optional=True)
+        user_id = get_jwt_identity()
+    except Exception:
+        user_id = None
+    return f'user:{user_id}' if user_id is not None else f'ip:{request.remote_addr}'
+
+
+def _limit_request():
+    if request.endpoint is None or request.method == 'OPTIONS':
+        return None
+    allowed, retry_after = check_rate_limit(request.endpoint, _request_identity())
+    if allowed:
+        return None
+    retry_after = max(1, math.ceil(retry_after))
+    response = jsonify({'error': 'Too many requests', 'retry_after': retry_after})
+    response.status_code = 429
+    response.headers['Retry-After'] = str(retry_after)
+    return response
+
+
+def _socket_identity():
+    """The user whose access token authenticated this connection, else the
+    client address, so reconnecting doesn't reset an anonymous bucket.
+
+    Ids in the event payload are client-chosen, so they never pick the bucket.
+    """
+    user_id = session.get('user_id')
+    return f'user:{user_id}' if user_id is not None else f'ip:{request.remote_addr}'
+
+
+def rate_limited(event):
+    """Limit a Socket.IO handler per user; over-limit calls get an `error` event."""
+    def decorator(handler):
+        @wraps(handler)
+        def wrapper(data=None, *args):
+            identity = _socket_identity()
+
+            allowed, retry_after = check_rate_limit(f'socket.{event}', identity)
+            if not allowed:
+                emit('error', {
+                    'message': 'Too many requests',
+                    'event': event,
+                    'retry_after': round(retry_after, 2)
+                })
+                return None
+            return handler(data, *args)
+        return wrapper
+    return decorator
+
+
+def init_rate_limits(app):
+    if app.config['RATE_LIMIT_BACKEND'] == 'shared':
+        limiter = SharedRateLimiter(connect_shared_store(app.config['SHARED_STORE_URL']))
+    else:
+        limiter = LocalRateLimiter()
+    app.extensions['rate_limiter'] = limiter
+    app.before_request(_limit_request)
+    return limiter
@@ -0,0 +1,30 @@
+"""Column-projected, untracked user rows for list and scoring paths.
+
+A UserRow carries only the profile columns those paths read (no email or
+password hash) as a plain tuple: no identity map entry, no attribute
+instrumentation and no per-instance __dict__. Field names match User's, so
+compatibility_score(), distance_km() and picture_urls() accept either.
+"""
+from collections import namedtuple
+from models import db, User
+
+USER_ROW_COLUMNS = (
+    User.id, User.name, User.age, User.gender, User.occupation, User.budget,
+    User.habits, User.interests, User.bio, User.location, User.location_key,
+    User.profile_picture, User.picture_hash, User.latitude, User.longitude,
+)
+
+
+class UserRow(namedtuple('UserRow', [column.key for column in USER_ROW_COLUMNS])):
+    __slots__ = ()
+
+
+def user_rows(query):
+    """Run a User query projected to UserRow columns, keeping its filters and order."""
+    return [UserRow._make(row) for row in query.with_entities(*USER_ROW_COLUMNS)]
+
+
+def get_user_row(user_id):
+    """UserRow for one id, or None."""
+    row = db.session.execute(db.select(*USER_ROW_COLUMNS).where(User.id == user_id)).first()
+    return UserRow._make(row) if row else None
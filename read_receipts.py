@@ -0,0 +1,190 @@
+import threading
+from datetime import datetime
+from flask import current_app
+from models import db, Message, ConversationRead, dialect_insert
+
+
+class ReadReceiptBuffer:
+    """Coalesces read-watermark updates and writes them after a short window.
+
+    Each (reader, other user) pair keeps only its highest pending message id,
+    so any number of mark-read events inside the window cost one upsert.
+    """
+
+    def __init__(self, app, window):
+        self.app = app
+        self.window = window
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._timer = None
+
+    def mark(self, user_id, other_user_id, message_id):
+        """Queue a watermark. Returns True if it moves past what was pending or stored."""
+        key = (int(user_id), int(other_user_id))
+        with self._lock:
+            floor = self._pending.get(key)
+        if floor is None:
+            # Nothing pending: compare with what earlier flushes already wrote
+            floor = stored_watermark(*key)
+        with self._lock:
+            if message_id <= max(floor, self._pending.get(key, 0)):
+                return False
+            self._pending[key] = message_id
+            if self.window > 0 and self._timer is None:
+                self._timer = threading.Timer(self.window, self._flush_in_context)
+                self._timer.daemon = True
+                self._timer.start()
+        if self.window <= 0:
+            self.flush()
+        return True
+
+    def pending(self, user_id):
+        """Unflushed watermarks for a reader, as {other_user_id: message_id}."""
+        with self._lock:
+            return {other: message_id for (reader, other), message_id in self._pending.items()
+                    if reader == int(user_id)}
+
+    def flush(self, user_id=None):
+        """Write pending watermarks (all, or one reader's) in one transaction."""
+        with self._lock:
+            if user_id is None:
+                batch, self._pending = self._pending, {}
+                if self._timer is not None:
+                    self._timer.cancel()
+                    self._timer = None
+            else:
+                batch = {key: value for key, value in self._pending.items() if key[0] == int(user_id)}
+                for key in batch:
+                    del self._pending[key]
+        if not batch:
+            return
+        try:
+            for (reader, other), message_id in batch.items():
+                upsert_watermark(reader, other, message_id)
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            with self._lock:
+                for key, message_id in batch.items():
+                    self._pending[key] = max(message_id, self._pending.get(key, 0))
+            raise
+
+    def _flush_in_context(self):
+        with self.app.app_context():
+            try:
+                self.flush()
+            except Exception as e:
+                self.app.logger.error(f"Read receipt flush failed: {e}")
+            finally:
+                db.session.remove()
+
+
+def stored_watermark(user_id, other_user_id):
+    return db.session.query(ConversationRead.last_read_message_id).filter_by(
+        user_id=user_id, other_user_id=other_user_id
+    ).scalar() or 0
+
+
+def upsert_watermark(user_id, other_user_id, message_id):
+    """Single-row upsert that only ever moves the watermark forward."""
+    table = ConversationRead.__table__
+    stmt = dialect_insert(ConversationRead)
+    if stmt is None:
+        row = db.session.get(ConversationRead, (user_id, other_user_id))
+        if row is None:
+            db.session.add(ConversationRead(user_id=user_id, other_user_id=other_user_id,
+                                            last_read_message_id=message_id))
+        elif row.last_read_message_id < message_id:
+            row.last_read_message_id = message_id
+        return
+
+    stmt = stmt.values(
+        user_id=user_id,
+        other_user_id=other_user_id,
+        last_read_message_id=message_id,
+        updated_at=datetime.utcnow()
+    )
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[table.c.user_id, table.c.other_user_id],
+        set_={
+            'last_read_message_id': db.case(
+                (stmt.excluded.last_read_message_id > table.c.last_read_message_id,
+                 stmt.excluded.last_read_message_id),
+                else_=table.c.last_read_message_id
+            ),
+            'updated_at': stmt.excluded.updated_at,
+        }
+    )
+    db.session.execute(stmt)
+
+
+def backfill_watermarks():
+    """Seed watermarks from a legacy `message.is_read` column, if the table still has one.
+
+    Each (receiver, sender) pair gets the highest id it had marked read. The
+    upsert only moves watermarks forward, so running this again is a no-op.
+    Returns how many pairs were written.
+    """
+    table = Message.__table__.name
+    if 'is_read' not in {column['name'] for column in db.inspect(db.engine).get_columns(table)}:
+        return 0
+
+    rows = db.session.execute(db.text(
+        f'SELECT receiver_id, sender_id, max(id) FROM "{table}" '
+        'WHERE is_read = :read GROUP BY receiver_id, sender_id'
+    ), {'read': True}).all()
+    for receiver_id, sender_id, message_id in rows:
+        upsert_watermark(receiver_id, sender_id, message_id)
+    db.session.commit()
+    return len(rows)
+
+
+def init_read_receipts(app):
+    app.extensions['read_receipts'] = ReadReceiptBuffer(app, app.config['READ_RECEIPT_DEBOUNCE'])
+
+
+def get_read_receipts():
+    return current_app.extensions['read_receipts']
+
+
+def latest_message_id(sender_id, receiver_id):
+    return db.session.query(db.func.max(Message.id)).filter(
+        Message.sender_id == sender_id,
+        Message.receiver_id == receiver_id
+    ).scalar() or 0
+
+
+def get_watermarks(pairs):
+    """Effective watermarks for (reader, other) pairs, including pending ones."""
+    pairs = [(int(reader), int(other)) for reader, other in pairs]
+    if not pairs:
+        return {}
+    rows = ConversationRead.query.filter(
+        db.tuple_(ConversationRead.user_id, ConversationRead.other_user_id).in_(pairs)
+    )
+    watermarks = {pair: 0 for pair in pairs}
+    for row in rows:
+        watermarks[(row.user_id, row.other_user_id)] = row.last_read_message_id
+
+    buffer = get_read_receipts()
+    for reader in {reader for reader, _ in pairs}:
+        for other, message_id in buffer.pending(reader).items():
+            if (reader, other) in watermarks:
+                watermarks[(reader, other)] = max(watermarks[(reader, other)], message_id)
+    return watermarks
+
+
+def unread_messages_query(user_id):
+    """Query over messages to `user_id` newer than that conversation's watermark.
+
+    Pending watermarks for the user are flushed first so counts are current.
+    """
+    get_read_receipts().flush(user_id)
+    return Message.query.outerjoin(
+        ConversationRead,
+        (ConversationRead.user_id == Message.receiver_id) &
+        (ConversationRead.other_user_id == Message.sender_id)
+    ).filter(
+        Message.receiver_id == user_id,
+        Message.id > db.func.coalesce(ConversationRead.last_read_message_id, 0)
+    )
@@ -0,0 +1,194 @@
+"""Readiness probe: dependency checks plus a one-off warm-up per process.
+
+/api/health only says the process is up. /api/ready also checks the
+database, and reports ready only after the warm-up steps have run in this
+process, so a load balancer can hold traffic back from a freshly started
+worker. Connection pool saturation is reported but doesn't fail the probe:
+it means the process is busy, and restarting or draining it (often the only
+instance) would make that worse.
+"""
+import threading
+import time
+from flask import current_app
+from sqlalchemy import text
+from models import db, User, Message
+from match_graph import get_match_graph, USERS_MATCHES
+from matching import MATCH_BETWEEN, find_potential_matches
+from read_models import user_rows
+from chat import CONVERSATION_PAGE, CONVERSATION_COUNT, LATEST_MESSAGES
+from notifications import USER_NOTIFICATIONS
+
+WARMUP_STEPS = {}
+
+
+def warmup_step(name):
+    """Register a warm-up step; it gets the hot user ids and returns an item count."""
+    def register(step):
+        WARMUP_STEPS[name] = step
+        return step
+    return register
+
+
+@warmup_step('statements')
+def _warm_statements(hot_ids):
+    """Compile the prebuilt hot statements into the engine's statement cache."""
+    statements = (
+        (CONVERSATION_PAGE, {'user1_id': 0, 'user2_id': 0, 'offset': 0, 'limit': 1}),
+        (CONVERSATION_COUNT, {'user1_id': 0, 'user2_id': 0}),
+        (LATEST_MESSAGES, {'user_id': 0}),
+        (MATCH_BETWEEN, {'user1_id': 0, 'user2_id': 0}),
+        (USER_NOTIFICATIONS, {'user_id': 0}),
+        (USERS_MATCHES, {'user_ids': [0]}),
+    )
+    for statement, params in statements:
+        db.session.execute(statement, params).all()
+    return len(statements)
+
+
+@warmup_step('profiles')
+def _warm_profiles(hot_ids):
+    """Read the hot users' profiles so the database has their pages cached."""
+    return len(user_rows(User.query.filter(User.id.in_(hot_ids)))) if hot_ids else 0
+
+
+@warmup_step('match_graph')
+def _warm_match_graph(hot_ids):
+    get_match_graph().preload(hot_ids)
+    return len(hot_ids)
+
+
+@warmup_step('matching')
+def _warm_matching(hot_ids):
+    """Run live matching for a few hot users to compile the candidate queries."""
+    users = hot_ids[:current_app.config['READINESS_WARMUP_MATCHING_USERS']]
+    for user_id in users:
+        find_potential_matches(user_id)
+    return len(users)
+
+
+def hot_user_ids(limit):
+    """Participants in the latest messages, topped up with recently updated users."""
+    ids = []
+    seen = set()
+    recent = db.session.query(Message.sender_id, Message.receiver_id) \
+        .order_by(Message.id.desc()).limit(limit)
+    updated = db.session.query(User.id).order_by(User.updated_at.desc()).limit(limit)
+    for user_id in [i for row in recent for i in row] + [row.id for row in updated]:
+        if user_id not in seen:
+            seen.add(user_id)
+            ids.append(user_id)
+    return ids[:limit]
+
+
+class Warmup:
+    """Runs the configured warm-up steps once per process, in the background."""
+
+    def __init__(self, steps, hot_users):
+        self.steps = steps
+        self.hot_users = hot_users
+        self.state = 'pending'  # pending, warming, done, failed
+        self.timings = {}
+        self.total_ms = None
+        self.error = None
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def start(self, app):
+        """Start warming unless it is running or done; a failed run is retried."""
+        with self._lock:
+            if self.state in ('warming', 'done'):
+                return
+            self.state, self.error, self.timings = 'warming', None, {}
+            self._thread = threading.Thread(target=self._run, args=(app,), name='warmup', daemon=True)
+            self._thread.start()
+
+    def wait(self, timeout=None):
+        if self._thread:
+            self._thread.join(timeout)
+
+    def _run(self, app):
+        started = time.perf_counter()
+        name = 'hot_users'
+        with app.app_context():
+            try:
+                hot_ids = hot_user_ids(self.hot_users)
+                for name in self.steps:
+                    step_started = time.perf_counter()
+                    items = WARMUP_STEPS[name](hot_ids)
+                    self.timings[name] = {
+                        'ms': round((time.perf_counter() - step_started) * 1000, 1),
+                        'items': items
+                    }
+                self.total_ms = round((time.perf_counter() - started) * 1000, 1)
+                self.state = 'done'
+            except Exception as e:
+                # Details go to the log only; the probe is unauthenticated
+                app.logger.error(f'Warm-up step {name} failed: {e}')
+                self.error = f'{name}_failed'
+                self.state = 'failed'
+            finally:
+                db.session.remove()
+
+    def report(self):
+        report = {'state': self.state, 'steps': dict(self.timings), 'total_ms': self.total_ms}
+        if self.error:
+            report['error'] = self.error
+        return report
+
+
+def init_readiness(app):
+    steps = [name.strip() for name in app.config['READINESS_WARMUP_STEPS'].split(',') if name.strip()]
+    unknown = set(steps) - set(WARMUP_STEPS)
+    if unknown:
+        raise ValueError(f"Unknown warm-up steps: {', '.join(sorted(unknown))}")
+    app.extensions['warmup'] = Warmup(steps, app.config['READINESS_HOT_USERS'])
+
+
+def pool_usage(engine):
+    """Checked-out connections against the pool's capacity, where the pool reports them."""
+    pool = engine.pool
+    if not hasattr(pool, 'checkedout'):
+        return {'checked_out': None, 'capacity': None, 'usage': None}
+    max_overflow = getattr(pool, '_max_overflow', 0)
+    capacity = pool.size() + max_overflow if max_overflow >= 0 else None
+    checked_out = pool.checkedout()
+    return {
+        'checked_out': checked_out,
+        'capacity': capacity,
+        'usage': round(checked_out / capacity, 2) if capacity else None
+    }
+
+
+def check_readiness():
+    """Dependency checks plus warm-up progress; 200 once the database answers
+    and the warm-up is done, with status 'degraded' if the pool is saturated."""
+    app = current_app._get_current_object()
+    warmup = app.extensions['warmup']
+    warmup.start(app)
+
+    # Measure the pool before this probe takes a connection itself
+    pool = pool_usage(db.engine)
+    pool['ok'] = pool['usage'] is None or pool['usage'] < app.config['READINESS_POOL_MAX_USAGE']
+
+    started = time.perf_counter()
+    try:
+        db.session.execute(text('SELECT 1'))
+        database = {'ok': True}
+    except Exception as e:
+        db.session.rollback()
+        app.logger.error(f'Readiness database check failed: {e}')
+        database = {'ok': False, 'error': 'database_unavailable'}
+    database['ms'] = round((time.perf_counter() - started) * 1000, 1)
+
+    report = warmup.report()
+    ready = database['ok'] and report['state'] == 'done'
+    if not ready:
+        status = 'not_ready'
+    else:
+        status = 'ready' if pool['ok'] else 'degraded'
+    result = {
+        'status': status,
+        'checks': {'database': database, 'pool': pool},
+        'warmup': report
+    }
+    return result, 200 if ready else 503
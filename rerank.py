@@ -0,0 +1,277 @@
+"""Parallel full-population rebuild of the MatchSuggestion table.
+
+The parent process snapshots every user's scoring features into a flat
+memory-mapped file. Worker processes map that file read-only, score one shard
+of users each against the same blocked candidate window find_potential_matches
+uses (minus users they already have a match with), and bulk-write their
+shard's suggestions over their own DB connection. Finished shards are
+recorded in the state directory so an interrupted rebuild can be resumed
+with `flask suggestions rerank --resume`.
+"""
+import json
+import mmap
+import multiprocessing
+import os
+import time
+from bisect import bisect_left, bisect_right
+from datetime import datetime
+from sqlalchemy import create_engine
+from models import db, User, Match, MatchSuggestion, SuggestionState
+from matching import (
+    AGE_BAND, BUDGET_BAND, SAME_GENDER_SCORE, SAME_OCCUPATION_SCORE, SHARED_HABIT_SCORE,
+    SHARED_INTEREST_SCORE, age_score, budget_score
+)
+
+NO_BUDGET = -(2 ** 63)
+COLUMNS = ('id', 'age', 'gender', 'occupation', 'location', 'budget')
+WORD = 8
+
+_state = {}
+
+
+def _mask_words(items, vocab):
+    """Intern JSON list items into a bit mask; unparseable lists score nothing."""
+    try:
+        values = set(json.loads(items))
+    except (TypeError, ValueError):
+        return 0
+    mask = 0
+    for value in values:
+        mask |= 1 << vocab.setdefault(value, len(vocab))
+    return mask
+
+
+def build_feature_file(state_dir, shard_size):
+    """Write the users' scoring features to `state_dir`. Returns the layout.
+
+    The layout records `shard_size`, since done.txt shard indices only mean
+    the same users under the size they were checkpointed with.
+    """
+    codes = {'gender': {None: 0}, 'occupation': {None: 0}, 'location': {None: 0}}
+    habit_vocab, interest_vocab = {}, {}
+    rows = {name: [] for name in COLUMNS}
+    habits, interests = [], []
+
+    query = db.session.query(
+        User.id, User.age, User.gender, User.occupation, User.location_key,
+        User.budget_amount, User.habits, User.interests
+    ).order_by(User.id).execution_options(yield_per=1000)
+
+    for row in query:
+        rows['id'].append(row.id)
+        rows['age'].append(row.age or 0)
+        for name, value in (('gender', row.gender), ('occupation', row.occupation),
+                            ('location', row.location_key)):
+            rows[name].append(codes[name].setdefault(value, len(codes[name])))
+        rows['budget'].append(NO_BUDGET if row.budget_amount is None else row.budget_amount)
+        habits.append(_mask_words(row.habits, habit_vocab))
+        interests.append(_mask_words(row.interests, interest_vocab))
+
+    count = len(rows['id'])
+    layout = {
+        'count': count,
+        'habit_words': max(1, (len(habit_vocab) + 63) // 64),
+        'interest_words': max(1, (len(interest_vocab) + 63) // 64),
+        'shard_size': shard_size,
+    }
+
+    with open(os.path.join(state_dir, 'features.bin'), 'wb') as f:
+        for name in COLUMNS:
+            for value in rows[name]:
+                f.write(value.to_bytes(WORD, 'little', signed=True))
+        for masks, words in ((habits, layout['habit_words']), (interests, layout['interest_words'])):
+            for mask in masks:
+                f.write(mask.to_bytes(words * WORD, 'little'))
+
+    with open(os.path.join(state_dir, 'features.json'), 'w') as f:
+        json.dump(layout, f)
+    return layout
+
+
+def _init_worker(state_dir, database_uri, top_n):
+    with open(os.path.join(state_dir, 'features.json')) as f:
+        layout = json.load(f)
+    count = layout['count']
+
+    with open(os.path.join(state_dir, 'features.bin'), 'rb') as f:
+        buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    view = memoryview(buf)
+
+    columns = {}
+    offset = 0
+    for name in COLUMNS:
+        columns[name] = view[offset:offset + count * WORD].cast('q')
+        offset += count * WORD
+    for name in ('habits', 'interests'):
+        width = layout[f'{name[:-1]}_words'] * WORD
+        columns[name] = (view[offset:offset + count * width], width)
+        offset += count * width
+
+    # Per location bucket, row indices sorted by age for range lookups
+    buckets = {}
+    ages, locations = columns['age'], columns['location']
+    for i in sorted(range(count), key=ages.__getitem__):
+        bucket = buckets.setdefault(locations[i], ([], []))
+        bucket[0].append(ages[i])
+        bucket[1].append(i)
+
+    _state.update(
+        buf=buf, columns=columns, buckets=buckets, count=count, top_n=top_n,
+        engine=create_engine(database_uri),
+    )
+
+
+def _mask(name, i):
+    data, width = _state['columns'][name]
+    return int.from_bytes(data[i * width:(i + 1) * width], 'little')
+
+
+def _score(i, j, habits_i, interests_i):
+    """compatibility_score() over the mapped features of rows i and j."""
+    c = _state['columns']
+    score = 0
+    if c['age'][i] and c['age'][j]:
+        score += age_score(c['age'][i], c['age'][j])
+    if c['gender'][i] == c['gender'][j]:
+        score += SAME_GENDER_SCORE
+    if c['occupation'][i] == c['occupation'][j]:
+        score += SAME_OCCUPATION_SCORE
+    if c['budget'][i] != NO_BUDGET and c['budget'][j] != NO_BUDGET:
+        score += budget_score(c['budget'][i], c['budget'][j])
+    score += (habits_i & _mask('habits', j)).bit_count() * SHARED_HABIT_SCORE
+    score += (interests_i & _mask('interests', j)).bit_count() * SHARED_INTEREST_SCORE
+    return score
+
+
+def _candidates(i):
+    """Row indices in the same blocked window as matching._window()."""
+    c = _state['columns']
+    age, location, budget = c['age'][i], c['location'][i], c['budget'][i]
+
+    if location:
+        buckets = [_state['buckets'].get(location), _state['buckets'].get(0)]
+    else:
+        buckets = list(_state['buckets'].values())
+
+    for bucket in buckets:
+        if not bucket:
+            continue
+        bucket_ages, indices = bucket
+        lo = bisect_left(bucket_ages, age - AGE_BAND)
+        hi = bisect_right(bucket_ages, age + AGE_BAND)
+        for j in indices[lo:hi]:
+            if j == i:
+                continue
+            other_budget = c['budget'][j]
+            if budget != NO_BUDGET and other_budget != NO_BUDGET \
+                    and abs(other_budget - budget) > BUDGET_BAND:
+                continue
+            yield j
+
+
+def _matched_ids(first_id, last_id):
+    """{user id: ids they have a match with} for users in [first_id, last_id]."""
+    table = Match.__table__
+    matched = {}
+    with _state['engine'].connect() as conn:
+        for user1_id, user2_id in conn.execute(
+            db.select(table.c.user1_id, table.c.user2_id).where(
+                table.c.user1_id.between(first_id, last_id) | table.c.user2_id.between(first_id, last_id)
+            )
+        ):
+            matched.setdefault(user1_id, set()).add(user2_id)
+            matched.setdefault(user2_id, set()).add(user1_id)
+    return matched
+
+
+def score_shard(shard):
+    """Score rows [start, stop) and replace their stored suggestions."""
+    index, start, stop = shard
+    ids = _state['columns']['id']
+    top_n = _state['top_n']
+    now = datetime.utcnow()
+    matched = _matched_ids(ids[start], ids[stop - 1])
+
+    rows = []
+    for i in range(start, stop):
+        habits_i, interests_i = _mask('habits', i), _mask('interests', i)
+        excluded = matched.get(ids[i], ())
+        scored = [(-_score(i, j, habits_i, interests_i), ids[j]) for j in _candidates(i)
+                  if ids[j] not in excluded]
+        # Same order as find_potential_matches: best score first, ties by id
+        scored.sort()
+        rows.extend({
+            'user_id': ids[i],
+            'candidate_id': candidate_id,
+            'score': -score,
+            'rank': rank,
+            'computed_at': now,
+        } for rank, (score, candidate_id) in enumerate(scored[:top_n]))
+
+    table = MatchSuggestion.__table__
+    state = SuggestionState.__table__
+    with _state['engine'].begin() as conn:
+        conn.execute(table.delete().where(table.c.user_id.between(ids[start], ids[stop - 1])))
+        if rows:
+            conn.execute(table.insert(), rows)
+        # Record users left with no candidates too, so reads don't go live
+        conn.execute(state.delete().where(state.c.user_id.between(ids[start], ids[stop - 1])))
+        conn.execute(state.insert(), [{'user_id': ids[i], 'computed_at': now} for i in range(start, stop)])
+
+    return index, stop - start
+
+
+def rerank_all(state_dir, workers=None, shard_size=1000, top_n=50, resume=False, progress=print):
+    """Rebuild every user's suggestions across a process pool.
+
+    With `resume`, the feature snapshot from the previous run is reused and
+    shards already marked done in `state_dir` are skipped; this raises
+    ValueError if that run used a different `shard_size`.
+    """
+    os.makedirs(state_dir, exist_ok=True)
+    done_path = os.path.join(state_dir, 'done.txt')
+    layout_path = os.path.join(state_dir, 'features.json')
+
+    if resume and os.path.exists(layout_path) and os.path.exists(done_path):
+        with open(layout_path) as f:
+            layout = json.load(f)
+        if layout.get('shard_size') != shard_size:
+            raise ValueError(
+                f"{state_dir} was checkpointed with --shard-size {layout.get('shard_size')}; "
+                f"resume with that size or run without --resume"
+            )
+        with open(done_path) as f:
+            done = {int(line) for line in f if line.strip()}
+    else:
+        layout = build_feature_file(state_dir, shard_size)
+        open(done_path, 'w').close()
+        done = set()
+
+    count = layout['count']
+    shards = [(n, start, min(start + shard_size, count))
+              for n, start in enumerate(range(0, count, shard_size)) if n not in done]
+    total_shards = (count + shard_size - 1) // shard_size
+    if not shards:
+        progress(f'Nothing to do: {total_shards} shards already complete.')
+        return 0
+
+    database_uri = db.engine.url.render_as_string(hide_password=False)
+    # Forked/spawned workers must not share the parent's pooled connections
+    db.engine.dispose()
+
+    started = time.perf_counter()
+    scored = 0
+    context = multiprocessing.get_context('spawn')
+    with context.Pool(workers, initializer=_init_worker,
+                      initargs=(state_dir, database_uri, top_n)) as pool, \
+            open(done_path, 'a') as checkpoint:
+        for index, users in pool.imap_unordered(score_shard, shards):
+            checkpoint.write(f'{index}\n')
+            checkpoint.flush()
+            done.add(index)
+            scored += users
+            elapsed = time.perf_counter() - started
+            progress(f'[{len(done)}/{total_shards}] shard {index} done, '
+                     f'{scored} users in {elapsed:.1f}s ({scored / elapsed:.0f} users/s)')
+
+    return scored
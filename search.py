@@ -0,0 +1,181 @@
+import json
+import re
+from sqlalchemy import DDL, event, text
+from models import db, User
+from matching import apply_filters, radius_condition, distance_km
+from geo import haversine_km
+from media import picture_urls
+from read_models import user_rows, get_user_row
+
+# SQLite: an FTS5 table keyed by user id, kept in sync by the mapper events below.
+# PostgreSQL: a GIN expression index, so the table itself needs no sync.
+SQLITE_FTS = 'user_search'
+PG_VECTOR = (
+    "to_tsvector('simple', coalesce(bio, '') || ' ' || coalesce(occupation, '') || ' ' || "
+    "coalesce(habits, '') || ' ' || coalesce(interests, ''))"
+)
+
+SQLITE_FTS_DDL = DDL(
+    f"CREATE VIRTUAL TABLE IF NOT EXISTS {SQLITE_FTS} "
+    "USING fts5(bio, occupation, habits, interests, tokenize='unicode61')"
+)
+PG_INDEX_DDL = DDL(f'CREATE INDEX IF NOT EXISTS ix_user_search ON "user" USING GIN ({PG_VECTOR})')
+
+event.listen(User.__table__, 'after_create', SQLITE_FTS_DDL.execute_if(dialect='sqlite'))
+event.listen(User.__table__, 'before_drop', DDL(
+    f"DROP TABLE IF EXISTS {SQLITE_FTS}"
+).execute_if(dialect='sqlite'))
+event.listen(User.__table__, 'after_create', PG_INDEX_DDL.execute_if(dialect='postgresql'))
+
+
+def _flatten(value):
+    try:
+        return ' '.join(str(item) for item in json.loads(value))
+    except (TypeError, ValueError):
+        return value or ''
+
+
+@event.listens_for(User, 'after_insert')
+@event.listens_for(User, 'after_update')
+def _sync_search_index(mapper, connection, target):
+    if connection.dialect.name != 'sqlite':
+        return
+    connection.execute(text(
+        f"INSERT OR REPLACE INTO {SQLITE_FTS} (rowid, bio, occupation, habits, interests) "
+        "VALUES (:id, :bio, :occupation, :habits, :interests)"
+    ), {
+        'id': target.id,
+        'bio': target.bio or '',
+        'occupation': target.occupation or '',
+        'habits': _flatten(target.habits),
+        'interests': _flatten(target.interests),
+    })
+
+
+@event.listens_for(User, 'after_delete')
+def _remove_from_search_index(mapper, connection, target):
+    if connection.dialect.name == 'sqlite':
+        connection.execute(text(f"DELETE FROM {SQLITE_FTS} WHERE rowid = :id"), {'id': target.id})
+
+
+def rebuild_search_index(batch_size=1000):
+    """Create the search index if missing and backfill it from the user table."""
+    with db.engine.begin() as conn:
+        if conn.dialect.name == 'postgresql':
+            conn.execute(PG_INDEX_DDL)
+            return
+        if conn.dialect.name != 'sqlite':
+            return
+
+        conn.execute(SQLITE_FTS_DDL)
+        indexed = conn.execute(text(f"SELECT count(*) FROM {SQLITE_FTS}")).scalar()
+        if indexed == conn.execute(db.select(db.func.count(User.id))).scalar():
+            return
+
+        conn.execute(text(f"DELETE FROM {SQLITE_FTS}"))
+        rows = conn.execute(db.select(
+            User.id, User.bio, User.occupation, User.habits, User.interests
+        )).fetchall()
+        for start in range(0, len(rows), batch_size):
+            conn.execute(text(
+                f"INSERT INTO {SQLITE_FTS} (rowid, bio, occupation, habits, interests) "
+                "VALUES (:id, :bio, :occupation, :habits, :interests)"
+            ), [{
+                'id': row.id,
+                'bio': row.bio or '',
+                'occupation': row.occupation or '',
+                'habits': _flatten(row.habits),
+                'interests': _flatten(row.interests),
+            } for row in rows[start:start + batch_size]])
+
+
+def _ranked_matches(terms):
+    """Subquery of (user_id, rank) for users matching every term, best first."""
+    if db.engine.dialect.name == 'postgresql':
+        return text(
+            f"SELECT id AS user_id, -ts_rank({PG_VECTOR}, to_tsquery('simple', :q)) AS rank "
+            f'FROM "user" WHERE {PG_VECTOR} @@ to_tsquery(\'simple\', :q)'
+        ).bindparams(q=' & '.join(f'{term}:*' for term in terms)) \
+            .columns(user_id=db.Integer, rank=db.Float).subquery()
+
+    # bm25() is lower for better matches; quoted prefix terms are ANDed
+    return text(
+        f"SELECT rowid AS user_id, bm25({SQLITE_FTS}) AS rank "
+        f"FROM {SQLITE_FTS} WHERE {SQLITE_FTS} MATCH :q"
+    ).bindparams(q=' '.join(f'"{term}"*' for term in terms)) \
+        .columns(user_id=db.Integer, rank=db.Float).subquery()
+
+
+def search_users(q, filters=None, page=1, per_page=20, user_id=None):
+    """Ranked, paginated profile search over bio, occupation, habits and interests.
+
+    `filters` takes the same keys as find_potential_matches; radius_km needs
+    the searching `user_id`. It is applied as an index pre-filter, then the
+    pre-filtered ids are checked for exact distance before counting and paging.
+    """
+    try:
+        terms = re.findall(r'\w+', (q or '').lower())
+        if not terms:
+            return {'error': 'Search query is required'}, 400
+
+        matches = _ranked_matches(terms)
+        query = User.query.join(matches, User.id == matches.c.user_id)
+        query = apply_filters(query, filters)
+
+        user = None
+        radius_km = filters.get('radius_km') if filters else None
+        if radius_km is not None:
+            user = get_user_row(user_id) if user_id else None
+            if not user or user.latitude is None:
+                return {'error': 'radius_km requires a geocoded location'}, 400
+            query = query.filter(radius_condition(user, radius_km))
+        if user_id:
+            query = query.filter(User.id != user_id)
+
+        query = query.order_by(matches.c.rank, User.id)
+        offset = (page - 1) * per_page
+        if user:
+            # The pre-filter is a box; keep only ids inside the circle
+            in_radius = [row.id for row in query.with_entities(User.id, User.latitude, User.longitude)
+                         if haversine_km(user.latitude, user.longitude, row.latitude, row.longitude) <= radius_km]
+            total = len(in_radius)
+            page_ids = in_radius[offset:offset + per_page]
+            loaded = {other.id: other for other in user_rows(User.query.filter(User.id.in_(page_ids)))} \
+                if page_ids else {}
+            users = [loaded[other_id] for other_id in page_ids]
+        else:
+            total = query.count()
+            users = user_rows(query.offset(offset).limit(per_page))
+
+        results = []
+        for other in users:
+            data = {
+                'id': other.id,
+                'name': other.name,
+                'age': other.age,
+                'gender': other.gender,
+                'occupation': other.occupation,
+                'budget': other.budget,
+                'habits': json.loads(other.habits) if other.habits else [],
+                'interests': json.loads(other.interests) if other.interests else [],
+                'bio': other.bio,
+                'location': other.location,
+                'profile_picture': other.profile_picture,
+                'profile_pictures': picture_urls(other)
+            }
+            if user:
+                data['distance_km'] = round(distance_km(user, other), 1)
+            results.append(data)
+
+        return {
+            'results': results,
+            'pagination': {
+                'page': page,
+                'per_page': per_page,
+                'total': total,
+                'pages': (total + per_page - 1) // per_page
+            }
+        }, 200
+
+    except Exception as e:
+        return {'error': str(e)}, 500
@@ -0,0 +1,146 @@
+import threading
+import time
+
+
+def connect_shared_store(url):
+    """Return a client for the shared store at `url`.
+
+    'memory://' gives a process-local FakeRedis (tests, single-process dev);
+    anything else needs the optional `redis` package.
+    """
+    if url.startswith('memory://'):
+        return FakeRedis()
+    import redis
+
+    return redis.Redis.from_url(url, decode_responses=True)
+
+
+class FakeRedis:
+    """In-process stand-in for the subset of Redis commands the app uses.
+
+    Lua scripts cannot run here; modules that use one register a Python
+    twin with register_script_handler() and it runs under the store lock.
+    """
+
+    script_handlers = {}
+
+    @classmethod
+    def register_script_handler(cls, script, handler):
+        cls.script_handlers[script] = handler
+
+    def __init__(self, clock=time.time):
+        self._data = {}
+        self._expires = {}
+        self._lock = threading.RLock()
+        self._clock = clock
+
+    def _live(self, key):
+        expires = self._expires.get(key)
+        if expires is not None and expires <= self._clock():
+            self._data.pop(key, None)
+            self._expires.pop(key, None)
+        return self._data.get(key)
+
+    def pipeline(self, transaction=True):
+        return _FakePipeline(self)
+
+    def register_script(self, script):
+        handler = self.script_handlers[script]
+
+        def run(keys=(), args=()):
+            with self._lock:
+                return handler(self, list(keys), list(args))
+        return run
+
+    # Strings / keys
+    def get(self, key):
+        with self._lock:
+            return self._live(key)
+
+    def set(self, key, value, ex=None):
+        with self._lock:
+            self._data[key] = str(value)
+            if ex is None:
+                self._expires.pop(key, None)
+            else:
+                self._expires[key] = self._clock() + ex
+            return True
+
+    def delete(self, *keys):
+        with self._lock:
+            removed = 0
+            for key in keys:
+                if self._live(key) is not None:
+                    removed += 1
+                self._data.pop(key, None)
+                self._expires.pop(key, None)
+            return removed
+
+    def expire(self, key, seconds):
+        with self._lock:
+            if self._live(key) is None:
+                return False
+            self._expires[key] = self._clock() + seconds
+            return True
+
+    # Sorted sets
+    def zadd(self, key, mapping):
+        with self._lock:
+            zset = self._live(key)
+            if zset is None:
+                zset = self._data[key] = {}
+            added = sum(1 for member in mapping if member not in zset)
+            zset.update({member: float(score) for member, score in mapping.items()})
+            return added
+
+    def zrem(self, key, *members):
+        with self._lock:
+            zset = self._live(key) or {}
+            removed = sum(1 for member in members if zset.pop(member, None) is not None)
+            if not zset:
+                self._data.pop(key, None)
+            return removed
+
+    def zcount(self, key, min, max):
+        with self._lock:
+            lo, hi = float(min), float(max)
+            return sum(1 for score in (self._live(key) or {}).values() if lo <= score <= hi)
+
+    def zremrangebyscore(self, key, min, max):
+        with self._lock:
+            lo, hi = float(min), float(max)
+            zset = self._live(key) or {}
+            doomed = [member for member, score in zset.items() if lo <= score <= hi]
+            for member in doomed:
+                del zset[member]
+            if not zset:
+                self._data.pop(key, None)
+            return len(doomed)
+
+
+class _FakePipeline:
+    """Queues commands and runs them under the store lock on execute()."""
+
+    def __init__(self, store):
+        self._store = store
+        self._commands = []
+
+    def __getattr__(self, name):
+        method = getattr(self._store, name)
+
+        def queue(*args, **kwargs):
+            self._commands.append((method, args, kwargs))
+            return self
+        return queue
+
+    def execute(self):
+        with self._store._lock:
+            results = [method(*args, **kwargs) for method, args, kwargs in self._commands]
+        self._commands = []
+        return results
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self._commands = []
@@ -0,0 +1,306 @@
+import json
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+import click
+from flask import current_app
+from flask.cli import AppGroup
+from models import db, User, MatchSuggestion, SuggestionRefresh, SuggestionState, dialect_insert
+from matching import find_potential_matches, distance_km
+from media import picture_urls
+from match_graph import get_match_graph
+from read_models import USER_ROW_COLUMNS, UserRow
+
+suggestions_cli = AppGroup('suggestions', help='Maintain precomputed match suggestions.')
+
+_wake = threading.Event()
+_start_lock = threading.Lock()
+
+
+def _serialize_candidate(user, score):
+    return {
+        "id": user.id,
+        "name": user.name,
+        "age": user.age,
+        "gender": user.gender,
+        "occupation": user.occupation,
+        "budget": user.budget,
+        "habits": json.loads(user.habits) if user.habits else [],
+        "interests": json.loads(user.interests) if user.interests else [],
+        "bio": user.bio,
+        "location": user.location,
+        "profile_picture": user.profile_picture,
+        "profile_pictures": picture_urls(user),
+        "score": score,
+    }
+
+
+def queue_suggestion_refresh(user_id):
+    """Mark a user's suggestions stale and due now, clearing any retry backoff.
+    Runs in the current transaction; caller commits."""
+    now = datetime.utcnow()
+    stmt = dialect_insert(SuggestionRefresh)
+    if stmt is None:
+        db.session.merge(SuggestionRefresh(user_id=user_id, queued_at=now, attempts=0, available_at=now))
+        return
+
+    # An upsert, so concurrent requests queueing the same user can't collide on the key
+    stmt = stmt.values(user_id=user_id, queued_at=now, attempts=0, available_at=now)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[SuggestionRefresh.__table__.c.user_id],
+        set_={
+            'queued_at': stmt.excluded.queued_at,
+            'attempts': stmt.excluded.attempts,
+            'available_at': stmt.excluded.available_at,
+        }
+    )
+    db.session.execute(stmt)
+
+
+def wake_suggestion_worker():
+    """Nudge the in-process worker after a refresh has been committed."""
+    _wake.set()
+
+
+def refresh_user_suggestions(user_id, top_n=None):
+    """Recompute and store one user's top-N suggestions."""
+    top_n = top_n or current_app.config['MATCH_SUGGESTIONS_TOP_N']
+
+    MatchSuggestion.query.filter_by(user_id=user_id).delete()
+    for rank, (other, score) in enumerate(find_potential_matches(user_id, limit=top_n)):
+        db.session.add(MatchSuggestion(
+            user_id=user_id,
+            candidate_id=other.id,
+            score=score,
+            rank=rank
+        ))
+    db.session.merge(SuggestionState(user_id=user_id, computed_at=datetime.utcnow()))
+
+
+def affected_user_ids(user):
+    """Users whose stored suggestions may change because `user` changed.
+
+    That is the user, everyone currently listing them, and every materialized
+    neighbour whose list they would now enter.
+    """
+    top_n = current_app.config['MATCH_SUGGESTIONS_TOP_N']
+    affected = {user.id}
+
+    listing = db.session.query(MatchSuggestion.user_id).filter_by(candidate_id=user.id)
+    affected.update(row.user_id for row in listing)
+
+    neighbours = find_potential_matches(user.id)
+    if not neighbours:
+        return affected
+
+    stats = dict(
+        (row.user_id, (row.count, row.min_score))
+        for row in db.session.query(
+            MatchSuggestion.user_id,
+            db.func.count(MatchSuggestion.id).label('count'),
+            db.func.min(MatchSuggestion.score).label('min_score')
+        ).filter(
+            MatchSuggestion.user_id.in_([other.id for other, _ in neighbours])
+        ).group_by(MatchSuggestion.user_id)
+    )
+    for other, score in neighbours:
+        if other.id in stats:
+            count, min_score = stats[other.id]
+            if count < top_n or score > min_score:
+                affected.add(other.id)
+
+    return affected
+
+
+def _record_failure(user_id, queued_at, attempts):
+    """Push a failed entry back, doubling the delay each attempt up to the cap."""
+    config = current_app.config
+    delay = min(config['MATCH_SUGGESTIONS_RETRY_DELAY'] * 2 ** (attempts - 1),
+                config['MATCH_SUGGESTIONS_MAX_RETRY_DELAY'])
+    # Leave it alone if the user was queued again meanwhile; that entry is due now
+    SuggestionRefresh.query.filter_by(user_id=user_id, queued_at=queued_at).update({
+        'attempts': attempts,
+        'available_at': datetime.utcnow() + timedelta(seconds=delay),
+    }, synchronize_session=False)
+    db.session.commit()
+
+
+def process_refresh_queue(batch_size=100):
+    """Drain up to `batch_size` due users. Returns how many were refreshed."""
+    queued = db.session.query(
+        SuggestionRefresh.user_id, SuggestionRefresh.queued_at, SuggestionRefresh.attempts
+    ).filter(
+        db.or_(SuggestionRefresh.available_at.is_(None),
+               SuggestionRefresh.available_at <= datetime.utcnow())
+    ).order_by(SuggestionRefresh.queued_at).limit(batch_size).all()
+
+    refreshed = 0
+    for user_id, queued_at, attempts in queued:
+        try:
+            user = User.query.get(user_id)
+            if user:
+                for affected_id in affected_user_ids(user):
+                    refresh_user_suggestions(affected_id)
+            # Keep the entry if the user was queued again while we worked
+            SuggestionRefresh.query.filter_by(
+                user_id=user_id, queued_at=queued_at
+            ).delete()
+            db.session.commit()
+            refreshed += 1
+        except Exception as e:
+            db.session.rollback()
+            current_app.logger.error(f"Suggestion refresh failed for user {user_id}: {e}")
+            _record_failure(user_id, queued_at, (attempts or 0) + 1)
+
+    return refreshed
+
+
+def rebuild_all_suggestions(batch_size=500):
+    """Recompute every user's suggestions from scratch."""
+    total = 0
+    last_id = 0
+    while True:
+        ids = [row.id for row in db.session.query(User.id).filter(User.id > last_id)
+               .order_by(User.id).limit(batch_size)]
+        if not ids:
+            return total
+        for user_id in ids:
+            refresh_user_suggestions(user_id)
+        db.session.commit()
+        total += len(ids)
+        last_id = ids[-1]
+
+
+def get_nearby_matches(user_id, radius_km):
+    """Live matches within `radius_km`, with proximity counted in the score."""
+    try:
+        user = User.query.get(user_id)
+        if not user:
+            return {'error': 'User not found'}, 404
+
+        results = find_potential_matches(
+            user_id, filters={'radius_km': radius_km},
+            limit=current_app.config['MATCH_SUGGESTIONS_TOP_N'], score_distance=True
+        )
+
+        matches = []
+        for other, score in results:
+            data = _serialize_candidate(other, score)
+            data['distance_km'] = round(distance_km(user, other), 1)
+            matches.append(data)
+        return matches, 200
+
+    except Exception as e:
+        return {'error': str(e)}, 500
+
+
+def get_suggested_matches(user_id):
+    """Read precomputed suggestions, falling back to live matching."""
+    try:
+        rows = [(row[0], UserRow._make(row[1:])) for row in db.session.query(
+            MatchSuggestion.score, *USER_ROW_COLUMNS
+        ).join(
+            User, User.id == MatchSuggestion.candidate_id
+        ).filter(
+            MatchSuggestion.user_id == user_id
+        ).order_by(MatchSuggestion.rank)]
+
+        if rows or SuggestionState.query.get(user_id):
+            # Drop anyone matched since the list was computed and have it refilled
+            matched = get_match_graph().matched_ids(user_id)
+            fresh = [(score, user) for score, user in rows if user.id not in matched]
+            if len(fresh) < len(rows):
+                queue_suggestion_refresh(user_id)
+                db.session.commit()
+                wake_suggestion_worker()
+            return [_serialize_candidate(user, score) for score, user in fresh], 200
+
+        # Not materialized yet: answer live and let the worker fill it in
+        results = find_potential_matches(user_id, limit=current_app.config['MATCH_SUGGESTIONS_TOP_N'])
+        queue_suggestion_refresh(user_id)
+        db.session.commit()
+        wake_suggestion_worker()
+
+        return [_serialize_candidate(user, score) for user, score in results], 200
+
+    except Exception as e:
+        db.session.rollback()
+        return {'error': str(e)}, 500
+
+
+def run_worker(app, stop_event=None):
+    """Drain the refresh queue until `stop_event` is set."""
+    interval = app.config['MATCH_SUGGESTIONS_POLL_INTERVAL']
+    while stop_event is None or not stop_event.is_set():
+        with app.app_context():
+            try:
+                processed = process_refresh_queue()
+            except Exception as e:
+                app.logger.error(f"Suggestion worker error: {e}")
+                processed = 0
+            finally:
+                db.session.remove()
+        if not processed:
+            _wake.wait(interval)
+            _wake.clear()
+
+
+def start_suggestion_worker(app):
+    """Start the in-process worker thread for `app` (once)."""
+    if 'suggestion_worker' in app.extensions:
+        return app.extensions['suggestion_worker']
+
+    with _start_lock:
+        if 'suggestion_worker' not in app.extensions:
+            stop_event = threading.Event()
+            thread = threading.Thread(target=run_worker, args=(app, stop_event),
+                                      name='suggestion-worker', daemon=True)
+            thread.start()
+            app.extensions['suggestion_worker'] = (thread, stop_event)
+    return app.extensions['suggestion_worker']
+
+
+def init_suggestions(app):
+    """In 'thread' mode, start the worker with the first request, so importing
+    the app or running a CLI command (init-db, the worker, rerank) never does."""
+    if app.config['MATCH_SUGGESTIONS_WORKER'] != 'thread':
+        return
+
+    @app.before_request
+    def _ensure_suggestion_worker():
+        start_suggestion_worker(app)
+
+
+@suggestions_cli.command('rebuild')
+def rebuild_command():
+    """Recompute suggestions for every user."""
+    started = time.perf_counter()
+    total = rebuild_all_suggestions()
+    click.echo(f'Rebuilt suggestions for {total} users in {time.perf_counter() - started:.1f}s.')
+
+
+@suggestions_cli.command('rerank')
+@click.option('--workers', type=int, default=None, help='Worker processes (default: CPU count).')
+@click.option('--shard-size', type=int, default=1000, help='Users scored per task.')
+@click.option('--state-dir', default=None, help='Feature snapshot and checkpoint directory.')
+@click.option('--resume', is_flag=True, help='Skip shards finished by a previous run.')
+def rerank_command(workers, shard_size, state_dir, resume):
+    """Rebuild every user's suggestions in parallel."""
+    from rerank import rerank_all
+
+    state_dir = state_dir or os.path.join(current_app.instance_path, 'rerank')
+    try:
+        total = rerank_all(state_dir, workers=workers, shard_size=shard_size,
+                           top_n=current_app.config['MATCH_SUGGESTIONS_TOP_N'],
+                           resume=resume, progress=click.echo)
+    except ValueError as e:
+        raise click.UsageError(str(e))
+    click.echo(f'Re-ranked {total} users.')
+
+
+@suggestions_cli.command('worker')
+def worker_command():
+    """Run the suggestion refresh worker in the foreground."""
+    click.echo('Suggestion worker started.')
+    run_worker(current_app._get_current_object())
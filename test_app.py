@@ -2,25 +2,77 @@ import unittest
 from unittest.mock import Mock, patch, MagicMock
 import sys
 import os
+import subprocess
+import json
+import tempfile
+import shutil
+import io
+import struct
+import zlib
+from sqlalchemy import event
 
 # Add the backend directory to the path
 sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
 
-from app import app, db, jwt, socketio
-from models import User, Match, Message, Notification
+from app import app, create_app, db, jwt, socketio
+from config import TestingConfig
+from models import User, Match, Message, Notification, upgrade_schema
 from auth import register_user, login_user, get_current_user, update_profile
-from matching import find_potential_matches, create_match, get_user_matches
-from chat import get_conversation, get_unread_count, get_recent_conversations
+from matching import find_potential_matches, create_match, get_user_matches, compatibility_score, update_match_status
+from chat import get_conversation, get_unread_count, get_recent_conversations, save_message_batch, compact_message
 from notifications import get_user_notifications, mark_notification_read, create_notification
+from suggestions import get_suggested_matches, process_refresh_queue, queue_suggestion_refresh, rebuild_all_suggestions, wake_suggestion_worker
+from rerank import rerank_all
+from search import search_users
+from presence import LocalPresenceStore, SharedPresenceStore
+from shared_store import FakeRedis
+from read_receipts import ReadReceiptBuffer, backfill_watermarks
+from rate_limit import LocalRateLimiter, SharedRateLimiter
+from archive import archive_messages, rebuild_conversation_index
+from read_models import UserRow
+from match_graph import MatchGraph
+from media import image_size, init_media, render_variants, variant_key
+from flask_jwt_extended import create_access_token, create_refresh_token
+from outbox import process_outbox, outbox_handler, enqueue_event
+from datetime import datetime, timedelta
+from models import ConversationRead, ConversationArchive
+from models import MatchSuggestion, SuggestionRefresh, SuggestionState, OutboxEvent
+
+
+class AppTestCase(unittest.TestCase):
+    """Runs each test inside an app context over a fresh schema, with `users`
+    (ids 1..n in order) already added."""
+
+    users = ()
+
+    def app_config(self):
+        return TestingConfig
+
+    def setUp(self):
+        self.app = create_app(self.app_config())
+        self.client = self.app.test_client()
+        self.ctx = self.app.app_context()
+        self.ctx.push()
+        db.create_all()
+        for n in self.users:
+            db.session.add(User(
+                name=f'User {n}', email=f'user{n}@test.com', password_hash='hash',
+                age=25, gender='Male', occupation='Student', budget='₹8000',
+                habits='[]', interests='[]', location='Pune'
+            ))
+        db.session.commit()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.ctx.pop()
 
 
 class TestRoomiMatchBackend(unittest.TestCase):
 
     def setUp(self):
         """Set up test fixtures before each test method."""
-        self.app = app
-        self.app.config['TESTING'] = True
-        self.app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///:memory:'
+        self.app = create_app(TestingConfig)
         self.client = self.app.test_client()
 
         with self.app.app_context():
@@ -282,5 +334,1002 @@ class TestRoomiMatchBackend(unittest.TestCase):
         self.assertGreater(len(data), 0)
 
 
+class TestCandidateGeneration(AppTestCase):
+
+    def _user(self, n, age, budget, location='Pune', habits=(), interests=()):
+        user = User(
+            name=f'User {n}', email=f'user{n}@test.com', password_hash='hash',
+            age=age, gender='Male' if n % 2 else 'Female', occupation='Student',
+            budget=budget, habits=json.dumps(list(habits)),
+            interests=json.dumps(list(interests)), location=location
+        )
+        db.session.add(user)
+        return user
+
+    def test_blocking_skips_far_buckets(self):
+        """Users in other cities or far budget/age bands are never scored."""
+        me = self._user(0, 25, '₹8000')
+        near = self._user(1, 27, '₹9000')
+        far_budget = self._user(2, 25, '₹40000')
+        far_age = self._user(3, 60, '₹8000')
+        other_city = self._user(4, 25, '₹8000', location='Delhi')
+        no_city = self._user(5, 25, '₹8000', location='')
+        db.session.commit()
+
+        ids = {other.id for other, _ in find_potential_matches(me.id)}
+
+        self.assertEqual(ids, {near.id, no_city.id})
+        self.assertNotIn(far_budget.id, ids)
+        self.assertNotIn(far_age.id, ids)
+        self.assertNotIn(other_city.id, ids)
+
+    def test_candidates_are_untracked_rows(self):
+        """Candidates are projected rows, scored the same as full entities."""
+        me = self._user(1, 25, '₹8000', habits=['early'], interests=['chess'])
+        other = self._user(2, 27, '₹9000', habits=['early'], interests=['chess', 'music'])
+        db.session.commit()
+        expected = compatibility_score(me, other)
+        db.session.expunge_all()
+
+        (row, score), = find_potential_matches(me.id)
+
+        self.assertIsInstance(row, UserRow)
+        self.assertFalse(hasattr(row, 'password_hash'))
+        self.assertEqual((row.id, score), (other.id, expected))
+        self.assertEqual(len(db.session.identity_map), 0)
+
+    def test_guaranteed_recall_matches_full_scan(self):
+        """Guaranteed-recall top-K equals brute-force scoring of everyone."""
+        me = self._user(0, 30, '₹10000', habits=['early'], interests=['music', 'chess'])
+        for n in range(1, 40):
+            self._user(n, 18 + (n * 7) % 40, f'₹{(n * 3700) % 40000}',
+                       habits=['early'] if n % 3 == 0 else [],
+                       interests=['chess'] if n % 4 == 0 else ['music'])
+        db.session.commit()
+
+        everyone = [u for u in User.query.all() if u.id != me.id]
+        expected = sorted((compatibility_score(me, u) for u in everyone), reverse=True)[:10]
+
+        result = find_potential_matches(me.id, limit=10, guaranteed_recall=True)
+
+        self.assertEqual([score for _, score in result], expected)
+
+    def test_radius_filter_uses_geocoded_cities(self):
+        """radius_km keeps nearby cities and drops far or unknown locations."""
+        me = self._user(0, 25, '₹8000', location='Koramangala, Bangalore')
+        same_city = self._user(1, 25, '₹8000', location='Bengaluru')
+        nearby = self._user(2, 25, '₹8000', location='Mysore')
+        far = self._user(3, 25, '₹8000', location='Delhi')
+        unknown = self._user(4, 25, '₹8000', location='Atlantis')
+        db.session.commit()
+
+        result = find_potential_matches(me.id, filters={'radius_km': 200}, score_distance=True)
+        ids = [other.id for other, _ in result]
+
+        self.assertEqual(ids, [same_city.id, nearby.id])
+        self.assertNotIn(far.id, ids)
+        self.assertNotIn(unknown.id, ids)
+        self.assertEqual(me.location_key, 'bengaluru')
+
+    def test_search_ranks_and_stays_in_sync(self):
+        """Search covers bio/habits/interests, paginates and follows profile updates."""
+        cook = self._user(0, 25, '₹8000', interests=['cooking', 'music'])
+        cook.bio = 'I love cooking for flatmates'
+        musician = self._user(1, 25, '₹8000', interests=['music'])
+        db.session.commit()
+
+        result, status_code = search_users('cook')
+        self.assertEqual(status_code, 200)
+        self.assertEqual([r['id'] for r in result['results']], [cook.id])
+
+        result, _ = search_users('music', per_page=1)
+        self.assertEqual(result['pagination']['total'], 2)
+        self.assertEqual(len(result['results']), 1)
+
+        result, _ = search_users('music', filters={'gender': 'Male'})
+        self.assertEqual([r['id'] for r in result['results']], [musician.id])
+
+        update_profile(musician.id, {'interests': ['hiking']})
+        result, _ = search_users('music')
+        self.assertEqual([r['id'] for r in result['results']], [cook.id])
+
+
+    def test_search_radius_uses_exact_distance(self):
+        """Search radius drops users inside the pre-filter box but outside the circle."""
+        me = self._user(0, 25, '₹8000', location='Bengaluru')
+        mysuru = self._user(1, 25, '₹8000', location='Mysore', interests=['music'])
+        kochi = self._user(2, 25, '₹8000', location='Kochi', interests=['music'])
+        db.session.commit()
+
+        result, status_code = search_users('music', {'radius_km': 350}, per_page=1, user_id=me.id)
+
+        self.assertEqual(status_code, 200)
+        self.assertEqual([r['id'] for r in result['results']], [mysuru.id])
+        self.assertEqual(result['pagination']['total'], 1)
+        self.assertNotIn(kochi.id, [r['id'] for r in search_users(
+            'music', {'radius_km': 350}, page=2, per_page=1, user_id=me.id)[0]['results']])
+
+    def test_search_and_conversation_lists_load_rows(self):
+        """Search and recent conversations read projected rows, not User entities."""
+        me = self._user(0, 25, '₹8000', location='Bengaluru', interests=['music'])
+        other = self._user(1, 25, '₹8000', location='Mysore', interests=['music'])
+        db.session.flush()
+        db.session.add(Message(sender_id=other.id, receiver_id=me.id, content='hi'))
+        db.session.commit()
+        me_id, other_id = me.id, other.id
+        db.session.expunge_all()
+
+        statements = []
+        record = lambda conn, cursor, statement, *args: statements.append(statement)
+        event.listen(db.engine, 'before_cursor_execute', record)
+        try:
+            result, _ = search_users('music', {'radius_km': 200}, user_id=me_id)
+            conversations, _ = get_recent_conversations(me_id)
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', record)
+
+        self.assertEqual([r['id'] for r in result['results']], [other_id])
+        self.assertEqual([c['other_user']['id'] for c in conversations], [other_id])
+        self.assertFalse([sql for sql in statements if 'password_hash' in sql])
+
+    def test_search_route_clamps_paging(self):
+        """page and per_page below 1 are raised to 1 rather than failing."""
+        self._user(0, 25, '₹8000', interests=['music'])
+        db.session.commit()
+
+        response = self.app.test_client().get('/api/users/search?q=music&page=0&per_page=0')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.get_json()['pagination'], {'page': 1, 'per_page': 1, 'total': 1, 'pages': 1})
+
+
+class TestMatchSuggestions(AppTestCase):
+
+    def _register(self, n, age=25, budget='₹8000'):
+        result, status_code = register_user({
+            'name': f'User {n}', 'email': f'user{n}@test.com', 'password': 'pw',
+            'age': age, 'gender': 'Male', 'occupation': 'Student', 'budget': budget,
+            'location': 'Pune'
+        })
+        self.assertEqual(status_code, 201)
+        return result['user']['id']
+
+    def test_falls_back_to_live_matching(self):
+        """Users without stored suggestions get live results and are queued."""
+        me = self._register(1)
+        other = self._register(2)
+        process_refresh_queue()
+        MatchSuggestion.query.filter_by(user_id=me).delete()
+        SuggestionState.query.filter_by(user_id=me).delete()
+        db.session.commit()
+
+        result, status_code = get_suggested_matches(me)
+
+        self.assertEqual(status_code, 200)
+        self.assertEqual([m['id'] for m in result], [other])
+        self.assertIsNotNone(SuggestionRefresh.query.get(me))
+
+    def test_computed_empty_list_is_not_rescored(self):
+        """A user whose stored list came out empty is answered from it, not live."""
+        me = self._register(1)
+        process_refresh_queue()
+        self.assertIsNotNone(SuggestionState.query.get(me))
+
+        result, status_code = get_suggested_matches(me)
+
+        self.assertEqual((result, status_code), ([], 200))
+        self.assertIsNone(SuggestionRefresh.query.get(me))
+
+    def test_worker_starts_on_first_request(self):
+        """'thread' mode starts the worker with the first request, not at create_app."""
+        app = create_app({'TESTING': True, 'SQLALCHEMY_DATABASE_URI': 'sqlite:///:memory:',
+                          'MATCH_SUGGESTIONS_WORKER': 'thread', 'OUTBOX_WORKER': 'off',
+                          'RATE_LIMIT_ENABLED': False})
+        self.assertNotIn('suggestion_worker', app.extensions)
+
+        app.test_client().get('/api/health')
+        thread, stop_event = app.extensions['suggestion_worker']
+        self.assertTrue(thread.is_alive())
+        stop_event.set()
+        wake_suggestion_worker()
+        thread.join(5)
+
+    def test_worker_refreshes_affected_users(self):
+        """Registering and updating a user refreshes the lists they appear in."""
+        first = self._register(1)
+        second = self._register(2, age=26)
+        process_refresh_queue()
+        stored = lambda: [s.candidate_id for s in
+                          MatchSuggestion.query.filter_by(user_id=first).order_by(MatchSuggestion.rank)]
+        self.assertEqual(stored(), [second])
+
+        third = self._register(3, age=30, budget='₹9000')
+        process_refresh_queue()
+        self.assertEqual(stored(), [second, third])
+
+        # Moving out of every band drops the user from the neighbours' lists
+        update_profile(second, {'budget': '₹90000'})
+        process_refresh_queue()
+        self.assertEqual(stored(), [third])
+        self.assertEqual(MatchSuggestion.query.filter_by(candidate_id=second).count(), 0)
+        self.assertEqual(SuggestionRefresh.query.count(), 0)
+
+    def test_failed_refresh_backs_off(self):
+        """A failing refresh isn't counted and waits before its next attempt."""
+        me = self._register(1)
+        with patch('suggestions.affected_user_ids', side_effect=RuntimeError('boom')) as affected:
+            self.assertEqual(process_refresh_queue(), 0)
+            entry = SuggestionRefresh.query.get(me)
+            self.assertEqual(entry.attempts, 1)
+            self.assertGreater(entry.available_at, datetime.utcnow())
+
+            # Not due yet, so the worker goes back to sleep instead of retrying
+            self.assertEqual(process_refresh_queue(), 0)
+            self.assertEqual(affected.call_count, 1)
+
+        # Queueing the user again clears the backoff
+        queue_suggestion_refresh(me)
+        queue_suggestion_refresh(me)
+        db.session.commit()
+        self.assertEqual(SuggestionRefresh.query.get(me).attempts, 0)
+        self.assertEqual(process_refresh_queue(), 1)
+        self.assertEqual(SuggestionRefresh.query.count(), 0)
+
+    def test_matched_users_are_excluded(self):
+        """Once matched, a user leaves live and stored suggestions and shows in matches."""
+        me, other, third = self._register(1), self._register(2), self._register(3)
+        process_refresh_queue()
+        self.assertEqual([m['id'] for m in get_suggested_matches(me)[0]], [other, third])
+
+        result, status_code = create_match(me, other)
+        self.assertEqual(status_code, 201)
+        self.assertEqual([u.id for u, _ in find_potential_matches(me)], [third])
+        self.assertEqual([m['id'] for m in get_suggested_matches(me)[0]], [third])
+        self.assertIsNotNone(SuggestionRefresh.query.get(me))
+
+        update_match_status(result['match_id'], other, 'accepted')
+        matches, _ = get_user_matches(other)
+        self.assertEqual([(m['user']['id'], m['status']) for m in matches], [(me, 'accepted')])
+        self.assertEqual([u.id for u, _ in find_potential_matches(other)], [third])
+
+    def test_match_graph_evicts_stale_users(self):
+        """Users not looked up within the TTL leave the cache instead of piling up."""
+        me, other, third = self._register(1), self._register(2), self._register(3)
+        create_match(me, other)
+        clock = [0.0]
+        graph = MatchGraph(ttl=10, clock=lambda: clock[0])
+        for user_id in (me, other, third):
+            graph.neighbours(user_id)
+        self.assertEqual(len(graph), 3)
+
+        clock[0] += 11
+        self.assertEqual(set(graph.neighbours(me)), {other})
+        self.assertEqual(len(graph), 1)
+
+
+class TestParallelRerank(AppTestCase):
+
+    def app_config(self):
+        # Worker processes need a database file they can open themselves
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        return {'TESTING': True, 'SQLALCHEMY_DATABASE_URI': f'sqlite:///{self.tmp.name}/rerank.db'}
+
+    def _stored(self):
+        return {(s.user_id, s.candidate_id, s.score) for s in MatchSuggestion.query.all()}
+
+    def _populate(self, count):
+        for n in range(count):
+            db.session.add(User(
+                name=f'User {n}', email=f'user{n}@test.com', password_hash='hash',
+                age=20 + n % 12, gender='Male' if n % 2 else 'Female',
+                occupation='Student' if n % 3 else 'Engineer', budget=f'₹{6000 + (n % 5) * 1500}',
+                habits=json.dumps(['early'] if n % 2 else ['late']),
+                interests=json.dumps(['music', 'chess'][:n % 3]),
+                location='Pune' if n % 4 else ''
+            ))
+        db.session.add_all([Match(user1_id=2, user2_id=4), Match(user1_id=11, user2_id=1)])
+        db.session.commit()
+
+    def test_rerank_matches_serial_rebuild(self):
+        """Parallel re-ranking stores the same suggestions as the serial rebuild."""
+        self._populate(30)
+
+        rebuild_all_suggestions()
+        expected = self._stored()
+        MatchSuggestion.query.delete()
+        db.session.commit()
+
+        state_dir = os.path.join(self.tmp.name, 'state')
+        total = rerank_all(state_dir, workers=2, shard_size=8, top_n=50, progress=lambda msg: None)
+
+        self.assertEqual(total, 30)
+        self.assertNotIn(4, {candidate for user, candidate, _ in expected if user == 2})
+        self.assertEqual(self._stored(), expected)
+        self.assertEqual(rerank_all(state_dir, resume=True, shard_size=8, progress=lambda msg: None), 0)
+        # Shard indices from done.txt mean other users under another size
+        with self.assertRaises(ValueError):
+            rerank_all(state_dir, resume=True, shard_size=16, progress=lambda msg: None)
+
+    def test_rerank_truncates_ties_like_serial_rebuild(self):
+        """With top_n below the candidate count, tied scores are cut at the same users."""
+        self._populate(80)
+        self.app.config['MATCH_SUGGESTIONS_TOP_N'] = 3
+        ranked = lambda: {(s.user_id, s.rank, s.candidate_id, s.score) for s in MatchSuggestion.query.all()}
+
+        rebuild_all_suggestions()
+        expected = ranked()
+        MatchSuggestion.query.delete()
+        db.session.commit()
+
+        state_dir = os.path.join(self.tmp.name, 'state')
+        rerank_all(state_dir, workers=2, shard_size=16, top_n=3, progress=lambda msg: None)
+
+        self.assertEqual(len(expected), 80 * 3)
+        self.assertEqual(ranked(), expected)
+
+
+class TestBatchedMessages(AppTestCase):
+
+    users = (1, 2, 3)
+
+    def test_send_messages_batch_is_idempotent(self):
+        """A batch is stored once, acked per item, and retries are deduplicated."""
+        sender = socketio.test_client(self.app)
+        receiver = socketio.test_client(self.app)
+        receiver.emit('join', {'user_id': 2})
+        receiver.get_received()
+
+        batch = {'sender_id': 1, 'messages': [
+            {'client_id': 'a', 'receiver_id': 2, 'content': 'hi'},
+            {'client_id': 'b', 'receiver_id': 2, 'content': 'there'},
+            {'client_id': 'c', 'receiver_id': 3, 'content': 'yo'},
+            {'client_id': 'd', 'receiver_id': 2},
+        ]}
+        acks = sender.emit('send_messages', batch, callback=True)
+
+        self.assertEqual([a['status'] for a in acks], ['created', 'created', 'created', 'error'])
+        self.assertEqual(Message.query.count(), 3)
+        self.assertEqual(OutboxEvent.query.count(), 1)
+        self.assertEqual(process_outbox(), 1)
+        self.assertEqual(Notification.query.filter_by(user_id=2).count(), 1)
+
+        received = receiver.get_received()
+        self.assertEqual([r['name'] for r in received], ['receive_messages'])
+        payload = received[0]['args'][0]
+        self.assertEqual(payload['n'], 'User 1')
+        self.assertEqual([m[1] for m in payload['m']], ['a', 'b'])
+
+        retry = sender.emit('send_messages', batch, callback=True)
+        self.assertEqual([a['status'] for a in retry], ['duplicate', 'duplicate', 'duplicate', 'error'])
+        self.assertEqual([a['id'] for a in retry[:3]], [a['id'] for a in acks[:3]])
+        self.assertEqual(Message.query.count(), 3)
+        self.assertEqual(OutboxEvent.query.count(), 0)
+
+    def test_batch_acks_unknown_receiver_per_item(self):
+        """An unknown receiver errors only its own item, with UTC epoch timestamps."""
+        acks, created = save_message_batch(1, [
+            {'client_id': 'a', 'receiver_id': 2, 'content': 'hi'},
+            {'client_id': 'b', 'receiver_id': 999, 'content': 'lost'},
+        ])
+        db.session.expire_all()
+
+        self.assertEqual([a['status'] for a in acks], ['created', 'error'])
+        self.assertEqual(acks[1]['error'], 'Receiver not found')
+        message = Message.query.get(acks[0]['id'])
+        expected = (message.created_at - datetime(1970, 1, 1)).total_seconds() * 1000
+        self.assertEqual(compact_message(message)[5], int(expected))
+
+
+class TestOutbox(AppTestCase):
+
+    users = (1, 2, 3)
+
+    def test_send_message_is_delivered_through_outbox(self):
+        """The send path only writes the message and one outbox row; the worker delivers."""
+        sender = socketio.test_client(self.app)
+        receiver = socketio.test_client(self.app)
+        receiver.emit('join', {'user_id': 2})
+        receiver.get_received()
+
+        sender.emit('send_message', {'sender_id': 1, 'receiver_id': 2, 'content': 'hello'})
+        self.assertEqual(Message.query.count(), 1)
+        self.assertEqual(Notification.query.count(), 0)
+        self.assertEqual(receiver.get_received(), [])
+
+        process_outbox()
+        self.assertEqual(OutboxEvent.query.count(), 0)
+        self.assertEqual(Notification.query.filter_by(user_id=2).count(), 1)
+        received = receiver.get_received()
+        self.assertEqual([r['name'] for r in received], ['receive_message'])
+        self.assertEqual(received[0]['args'][0]['sender_name'], 'User 1')
+
+    def test_outbox_retries_with_backoff_then_gives_up(self):
+        """A failing handler is retried later and parked after OUTBOX_MAX_ATTEMPTS."""
+        calls = []
+
+        @outbox_handler('test.flaky')
+        def flaky(payload):
+            calls.append(payload)
+            raise RuntimeError('socket down')
+
+        self.app.config.update(OUTBOX_RETRY_DELAY=0, OUTBOX_MAX_ATTEMPTS=2)
+        enqueue_event('test.flaky', {'n': 1})
+        db.session.commit()
+
+        process_outbox()
+        event = OutboxEvent.query.one()
+        self.assertEqual((event.attempts, event.failed_at), (1, None))
+        self.assertEqual(event.last_error, 'socket down')
+
+        process_outbox()
+        db.session.refresh(event)
+        self.assertEqual(event.attempts, 2)
+        self.assertIsNotNone(event.failed_at)
+        self.assertEqual(process_outbox(), 0)
+        self.assertEqual(calls, [{'n': 1}, {'n': 1}])
+
+
+class TestReadReceipts(AppTestCase):
+
+    users = (1, 2, 3)
+
+    def test_read_watermark_drives_unread_state(self):
+        """Marking read moves one watermark; is_read and unread counts follow it."""
+        for n in range(3):
+            db.session.add(Message(sender_id=1, receiver_id=2, content=f'm{n}'))
+        db.session.commit()
+        self.assertEqual(get_unread_count(2)[0]['unread_count'], 3)
+
+        first_id = Message.query.order_by(Message.id).first().id
+        client = socketio.test_client(self.app)
+        client.emit('mark_messages_read', {'user_id': 2, 'other_user_id': 1, 'message_id': first_id})
+        self.assertEqual(get_unread_count(2)[0]['unread_count'], 2)
+
+        client.emit('mark_messages_read', {'user_id': 2, 'other_user_id': 1})
+        self.assertEqual(get_unread_count(2)[0]['unread_count'], 0)
+        self.assertEqual(ConversationRead.query.count(), 1)
+
+        messages, _ = get_conversation(1, 2)
+        self.assertTrue(all(m['is_read'] for m in messages))
+        conversations, _ = get_recent_conversations(2)
+        self.assertEqual(conversations[0]['unread_count'], 0)
+
+    def test_read_receipts_are_coalesced(self):
+        """Bursts within the debounce window collapse into one forward-only write."""
+        buffer = ReadReceiptBuffer(self.app, window=60)
+        self.assertTrue(buffer.mark(2, 1, 5))
+        self.assertTrue(buffer.mark(2, 1, 9))
+        self.assertFalse(buffer.mark(2, 1, 7))
+        self.assertEqual(buffer.pending(2), {1: 9})
+        self.assertEqual(ConversationRead.query.count(), 0)
+
+        buffer.flush()
+        self.assertFalse(buffer.mark(2, 1, 4))
+        self.assertFalse(buffer.mark(2, 1, 9))
+        buffer.flush()
+        self.assertEqual(ConversationRead.query.one().last_read_message_id, 9)
+
+    def test_mark_read_is_clamped_to_received_messages(self):
+        """A client-supplied message id can't move the watermark past what it was sent."""
+        db.session.add(Message(sender_id=1, receiver_id=2, content='hi'))
+        db.session.commit()
+        latest = Message.query.one().id
+
+        client = socketio.test_client(self.app)
+        client.emit('mark_messages_read', {'user_id': 2, 'other_user_id': 1, 'message_id': latest + 100})
+
+        self.assertEqual(ConversationRead.query.one().last_read_message_id, latest)
+        db.session.add(Message(sender_id=1, receiver_id=2, content='new'))
+        db.session.commit()
+        self.assertEqual(get_unread_count(2)[0]['unread_count'], 1)
+
+    def test_legacy_is_read_is_backfilled(self):
+        """init-db turns a legacy is_read column into per-conversation watermarks."""
+        db.session.execute(db.text('ALTER TABLE message ADD COLUMN is_read BOOLEAN'))
+        for n in range(3):
+            db.session.add(Message(sender_id=1, receiver_id=2, content=f'm{n}'))
+        db.session.add(Message(sender_id=3, receiver_id=2, content='unread'))
+        db.session.commit()
+        first, second = [m.id for m in Message.query.order_by(Message.id).limit(2)]
+        db.session.execute(db.text('UPDATE message SET is_read = :read WHERE id IN (:a, :b)'),
+                           {'read': True, 'a': first, 'b': second})
+        db.session.commit()
+
+        self.assertEqual(backfill_watermarks(), 1)
+        self.assertEqual(backfill_watermarks(), 1)
+
+        row = ConversationRead.query.one()
+        self.assertEqual((row.user_id, row.other_user_id, row.last_read_message_id), (2, 1, second))
+        self.assertEqual(get_unread_count(2)[0]['unread_count'], 2)
+
+
+class TestArchive(AppTestCase):
+
+    users = (1, 2, 3)
+
+    def test_archived_history_is_read_through(self):
+        """Archiving old messages keeps every page of the conversation the same."""
+        now = datetime.utcnow()
+        for n in range(12):
+            db.session.add(Message(
+                sender_id=1 if n % 2 else 2, receiver_id=2 if n % 2 else 1,
+                content=f'm{n}', created_at=now - timedelta(days=100 - n * 8)
+            ))
+        db.session.add(Message(sender_id=1, receiver_id=3, content='other', created_at=now - timedelta(days=90)))
+        db.session.commit()
+
+        pages = lambda: [[m['content'] for m in get_conversation(1, 2, page, 5)[0]] for page in (1, 2, 3, 4)]
+        before = pages()
+
+        moved = archive_messages(now - timedelta(days=30), batch_size=4)
+
+        self.assertEqual(moved, 10)
+        self.assertEqual(Message.query.count(), 3)
+        self.assertEqual(pages(), before)
+        self.assertEqual(before[2], ['m0', 'm1'])
+
+        # Archives from before the conversation index existed are indexed by init-db
+        ConversationArchive.query.delete()
+        db.session.commit()
+        self.assertEqual(rebuild_conversation_index(), 4)
+        self.assertEqual(pages(), before)
+
+    def test_recent_history_skips_unrelated_partitions(self):
+        """A conversation with nothing archived never reads the archive partitions."""
+        now = datetime.utcnow()
+        for months in range(1, 25):
+            db.session.add(Message(sender_id=1, receiver_id=3, content='old',
+                                   created_at=now - timedelta(days=31 * months)))
+        db.session.add(Message(sender_id=1, receiver_id=2, content='hi'))
+        db.session.commit()
+        archive_messages(now - timedelta(days=1))
+
+        statements = []
+        record = lambda conn, cursor, statement, *args: statements.append(statement)
+        event.listen(db.engine, 'before_cursor_execute', record)
+        try:
+            messages, _ = get_conversation(1, 2)
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', record)
+
+        self.assertEqual([m['content'] for m in messages], ['hi'])
+        self.assertFalse([sql for sql in statements if 'message_archive_' in sql])
+        self.assertLessEqual(len(statements), 5)
+        self.assertEqual(len(get_conversation(3, 1, 1, 50)[0]), 24)
+
+
+class TestPrebuiltQueries(AppTestCase):
+
+    users = (1, 2, 3)
+
+    def test_prebuilt_queries_bind_per_call(self):
+        """Shared statements return each caller's own rows."""
+        for sender, receiver, content in [(1, 2, 'a'), (2, 1, 'b'), (1, 3, 'c')]:
+            db.session.add(Message(sender_id=sender, receiver_id=receiver, content=content))
+        db.session.commit()
+
+        self.assertEqual([m['content'] for m in get_conversation(1, 2)[0]], ['a', 'b'])
+        self.assertEqual([m['content'] for m in get_conversation(3, 1)[0]], ['c'])
+        self.assertEqual(len(get_recent_conversations(1)[0]), 2)
+        self.assertEqual([c['other_user']['id'] for c in get_recent_conversations(3)[0]], [1])
+        self.assertEqual(create_match(1, 2)[1], 201)
+        self.assertEqual(create_match(2, 1)[1], 400)
+        self.assertEqual(create_match(1, 3)[1], 201)
+
+
+class TestPresence(unittest.TestCase):
+
+    def _check_store(self, store, clock):
+        store.connect(1, 'sid-a')
+        store.connect(1, 'sid-b')
+        store.connect(2, 'sid-c')
+        self.assertEqual(store.online_status([1, 2, 3]), {1: True, 2: True, 3: False})
+        self.assertEqual((store.session_user('sid-b'), store.session_user('sid-x')), (1, None))
+
+        store.disconnect('sid-a')
+        clock[0] += 40
+        self.assertTrue(store.heartbeat('sid-b'))
+        clock[0] += 40
+        # sid-c missed its heartbeat and expired; sid-b was refreshed
+        self.assertEqual(store.online_status([1, 2]), {1: True, 2: False})
+        self.assertFalse(store.heartbeat('sid-c'))
+
+    def test_local_store_expires_sessions(self):
+        clock = [1000.0]
+        self._check_store(LocalPresenceStore(60, clock=lambda: clock[0]), clock)
+
+    def test_shared_store_expires_sessions(self):
+        clock = [1000.0]
+        client = FakeRedis(clock=lambda: clock[0])
+        self._check_store(SharedPresenceStore(client, 60, clock=lambda: clock[0]), clock)
+
+    def test_socket_presence_and_match_list(self):
+        """Joining marks a user online for presence queries and match lists."""
+        test_app = create_app(TestingConfig)
+        with test_app.app_context():
+            db.create_all()
+            for n in (1, 2):
+                db.session.add(User(
+                    name=f'User {n}', email=f'user{n}@test.com', password_hash='hash',
+                    age=25, gender='Male', occupation='Student', budget='₹8000',
+                    habits='[]', interests='[]'
+                ))
+            db.session.add(Match(user1_id=1, user2_id=2))
+            db.session.commit()
+
+            client = socketio.test_client(test_app)
+            client.emit('join', {'user_id': 2})
+            self.assertEqual(client.emit('heartbeat', {}, callback=True), {'ok': True})
+            self.assertEqual(client.emit('presence', {'user_ids': [1, 2]}, callback=True),
+                             {'1': False, '2': True})
+
+            result, _ = get_user_matches(1)
+            self.assertTrue(result[0]['user']['is_online'])
+
+            client.disconnect()
+            result, _ = get_user_matches(1)
+            self.assertFalse(result[0]['user']['is_online'])
+            db.session.remove()
+            db.drop_all()
+
+
+class TestRateLimits(unittest.TestCase):
+
+    def _check_limiter(self, limiter, clock):
+        self.assertEqual([limiter.acquire('k', 3, 30)[0] for _ in range(4)], [True, True, True, False])
+        allowed, retry_after = limiter.acquire('k', 3, 30)
+        self.assertFalse(allowed)
+        self.assertAlmostEqual(retry_after, 10.0)
+        self.assertTrue(limiter.acquire('other', 3, 30)[0])
+
+        clock[0] += 10
+        self.assertTrue(limiter.acquire('k', 3, 30)[0])
+        self.assertFalse(limiter.acquire('k', 3, 30)[0])
+
+    def test_local_token_bucket(self):
+        clock = [0.0]
+        self._check_limiter(LocalRateLimiter(clock=lambda: clock[0]), clock)
+
+    def test_local_buckets_are_evicted_once_full(self):
+        clock = [0.0]
+        limiter = LocalRateLimiter(clock=lambda: clock[0], sweep_interval=60)
+        for n in range(100):
+            limiter.acquire(f'ip:{n}', 3, 30)
+        clock[0] += 5
+        limiter.acquire('busy', 3, 30, cost=3)
+        self.assertEqual(len(limiter._buckets), 101)
+
+        clock[0] += 60
+        self.assertTrue(limiter.acquire('new', 3, 30)[0])
+        # 'busy' has refilled too; only the bucket just touched is not yet full
+        self.assertEqual(set(limiter._buckets), {'new'})
+
+    def test_forwarded_client_addresses_get_own_buckets(self):
+        """Behind a trusted proxy, anonymous callers are keyed on X-Forwarded-For."""
+        test_app = create_app({
+            'TESTING': True, 'SQLALCHEMY_DATABASE_URI': 'sqlite:///:memory:',
+            'RATE_LIMIT_ENABLED': True, 'TRUSTED_PROXIES': 1,
+            'RATE_LIMITS': {'default': (100, 60), 'api.api_get_users': (1, 60)},
+        })
+        with test_app.app_context():
+            db.create_all()
+        client = test_app.test_client()
+        get = lambda ip: client.get('/api/users', headers={'X-Forwarded-For': ip}).status_code
+
+        self.assertEqual([get('203.0.113.1'), get('203.0.113.2'), get('203.0.113.1')], [200, 200, 429])
+
+    def test_shared_token_bucket(self):
+        clock = [1000.0]
+        self._check_limiter(SharedRateLimiter(FakeRedis(), clock=lambda: clock[0]), clock)
+
+    def test_rest_and_socket_limits(self):
+        """Over-limit requests get 429 / a socket error with a retry hint."""
+        test_app = create_app({
+            'TESTING': True,
+            'SQLALCHEMY_DATABASE_URI': 'sqlite:///:memory:',
+            'RATE_LIMIT_ENABLED': True,
+            'READ_RECEIPT_DEBOUNCE': 0,
+            'RATE_LIMITS': {'default': (100, 60), 'api.api_get_users': (2, 60),
+                            'socket.mark_messages_read': (1, 60)},
+        })
+        with test_app.app_context():
+            db.create_all()
+        client = test_app.test_client()
+
+        statuses = [client.get('/api/users').status_code for _ in range(3)]
+        self.assertEqual(statuses, [200, 200, 429])
+        response = client.get('/api/users')
+        self.assertGreaterEqual(int(response.headers['Retry-After']), 1)
+        self.assertEqual(client.get('/api/health').status_code, 200)
+
+        # The payload's user id is client-chosen; changing it doesn't reset the bucket
+        sock = socketio.test_client(test_app)
+        sock.emit('mark_messages_read', {'user_id': 5, 'other_user_id': 6, 'message_id': 1})
+        sock.emit('mark_messages_read', {'user_id': 7, 'other_user_id': 6, 'message_id': 2})
+        errors = [r['args'][0] for r in sock.get_received() if r['name'] == 'error']
+        self.assertEqual(errors[-1]['event'], 'mark_messages_read')
+        self.assertGreater(errors[-1]['retry_after'], 0)
+
+    def test_socket_limits_follow_the_authenticated_user(self):
+        """Sockets are keyed on their connect token's user, else the client address."""
+        test_app = create_app({
+            'TESTING': True, 'SQLALCHEMY_DATABASE_URI': 'sqlite:///:memory:',
+            'RATE_LIMIT_ENABLED': True,
+            'RATE_LIMITS': {'default': (100, 60), 'socket.heartbeat': (1, 60)},
+        })
+        with test_app.app_context():
+            token = lambda user_id: create_access_token(identity=str(user_id))
+            first, second, other = (token(1), token(1), token(2))
+            refresh = create_refresh_token(identity='1')
+
+        def limited(sock):
+            sock.emit('heartbeat', {})
+            return any(r['name'] == 'error' for r in sock.get_received())
+
+        # A second connection of the same user shares the bucket; another user doesn't
+        self.assertFalse(limited(socketio.test_client(test_app, auth={'token': first})))
+        self.assertTrue(limited(socketio.test_client(test_app, auth={'token': second})))
+        self.assertFalse(limited(socketio.test_client(test_app, auth={'token': other})))
+
+        # Anonymous sessions from one address share a bucket across reconnects
+        self.assertFalse(limited(socketio.test_client(test_app)))
+        self.assertTrue(limited(socketio.test_client(test_app)))
+
+        for bad in ('not-a-token', refresh):
+            self.assertFalse(socketio.test_client(test_app, auth={'token': bad}).is_connected())
+
+
+def _png(width=300, height=200):
+    """Encode a solid RGB PNG without needing an imaging library."""
+    def chunk(kind, data):
+        return struct.pack('>I', len(data)) + kind + data + struct.pack('>I', zlib.crc32(kind + data))
+    rows = b''.join(b'\x00' + b'\x10\x80\xf0' * width for _ in range(height))
+    return (b'\x89PNG\r\n\x1a\n'
+            + chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, 8, 2, 0, 0, 0))
+            + chunk(b'IDAT', zlib.compress(rows)) + chunk(b'IEND', b''))
+
+
+class MemoryStorage:
+    """Media backend without local paths, to check the storage interface."""
+
+    def __init__(self, app=None):
+        self.files = {}
+
+    def exists(self, key):
+        return key in self.files
+
+    def save(self, key, data):
+        self.files[key] = data
+
+    def open(self, key):
+        return io.BytesIO(self.files[key])
+
+
+class TestProfilePictures(AppTestCase):
+
+    users = (1,)
+
+    def setUp(self):
+        super().setUp()
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root, ignore_errors=True)
+        self.app.config['MEDIA_ROOT'] = self.media_root
+        init_media(self.app)
+        self.headers = {'Authorization': f'Bearer {create_access_token(identity="1")}'}
+
+    def _upload(self, data):
+        return self.client.post('/api/users/me/picture', headers=self.headers,
+                                data={'picture': (io.BytesIO(data), 'me.png')},
+                                content_type='multipart/form-data')
+
+    def test_upload_is_content_addressed_and_cacheable(self):
+        """Same bytes give the same URL; files are served with immutable caching."""
+        response = self._upload(_png())
+        self.assertEqual(response.status_code, 201)
+        urls = response.get_json()['profile_pictures']
+        self.assertEqual(set(urls), {'thumb', 'medium', 'original'})
+        self.assertEqual(self._upload(_png()).get_json()['profile_pictures'], urls)
+
+        original = self.client.get(urls['original'])
+        self.assertEqual(original.status_code, 200)
+        self.assertEqual(original.data, _png())
+        self.assertIn('immutable', original.headers['Cache-Control'])
+
+        users = self.client.get('/api/users').get_json()
+        self.assertEqual(users[0]['profile_pictures'], urls)
+        self.assertEqual(self._upload(b'not an image').status_code, 400)
+        self.assertEqual(self.client.get('/media/avatars/00/missing/thumb.jpg').status_code, 404)
+
+    def test_storage_backend_is_configurable(self):
+        """MEDIA_STORAGE plugs in another backend; unknown names are rejected."""
+        self.app.config['MEDIA_STORAGE'] = 'test_app:MemoryStorage'
+        init_media(self.app)
+        urls = self._upload(_png()).get_json()['profile_pictures']
+        self.app.extensions['media']['pool'].shutdown(wait=True)
+
+        self.assertEqual(os.listdir(self.media_root), [])
+        self.assertEqual(self.client.get(urls['original']).data, _png())
+        self.assertEqual(self.client.get(urls['thumb']).status_code, 200)
+
+        self.app.config['MEDIA_STORAGE'] = 's3'
+        with self.assertRaises(ValueError):
+            init_media(self.app)
+
+    def test_oversized_upload_is_refused_before_reading(self):
+        self.app.config['MAX_CONTENT_LENGTH'] = 1024
+        response = self._upload(_png(600, 600) + b'\0' * 4096)
+        self.assertEqual(response.status_code, 413)
+        self.assertEqual(response.get_json(), {'error': 'Request is too large'})
+        self.assertIsNone(User.query.get(1).picture_hash)
+
+    def test_unreadable_and_oversized_images_are_refused(self):
+        """Uploads are checked by their header, not just their leading bytes."""
+        bomb = bytearray(_png(1, 1))
+        bomb[16:24] = struct.pack('>II', 100000, 100000)
+        bomb[29:33] = struct.pack('>I', zlib.crc32(bytes(bomb[12:29])))
+        uploads = {
+            'garbage': b'\x89PNG\r\n\x1a\n' + b'not really a png' * 4,
+            'bomb': bytes(bomb),
+        }
+        for name, data in uploads.items():
+            response = self._upload(data)
+            self.assertEqual(response.status_code, 400, name)
+        self.assertIn('at most 25000000 pixels', response.get_json()['error'])
+        self.assertIsNone(User.query.get(1).picture_hash)
+        self.assertEqual(os.listdir(self.media_root), [])
+
+        self.app.config['MEDIA_MAX_PIXELS'] = 300 * 200
+        self.assertEqual(self._upload(_png(300, 201)).status_code, 400)
+        self.assertEqual(self._upload(_png(300, 200)).status_code, 201)
+
+        # Dimensions of the other formats come from their frame headers
+        jpeg = b'\xff\xd8\xff\xe0\x00\x04ab\xff\xc0\x00\x11\x08\x00\xc8\x01\x2c'
+        self.assertEqual(image_size(jpeg, 'jpg'), (300, 200))
+        self.assertEqual(image_size(b'GIF89a' + struct.pack('<HH', 300, 200), 'gif'), (300, 200))
+        self.assertIsNone(image_size(b'\xff\xd8\xff\xd9', 'jpg'))
+
+    def test_variant_falls_back_to_original_until_rendered(self):
+        """A variant URL serves the original, uncached, until its file exists."""
+        urls = self._upload(_png()).get_json()['profile_pictures']
+        digest = User.query.get(1).picture_hash
+        self.app.extensions['media']['pool'].shutdown(wait=True)
+        storage = self.app.extensions['media']['storage']
+
+        render_variants(storage, digest, 'png')
+        thumb = self.client.get(urls['thumb'])
+        self.assertEqual(thumb.status_code, 200)
+        if storage.exists(variant_key(digest, 'thumb')):
+            self.assertIn('immutable', thumb.headers['Cache-Control'])
+            self.assertLess(len(thumb.data), len(_png()))
+        else:
+            # Pillow is not installed: no variants, the original stands in
+            self.assertEqual(thumb.headers['Cache-Control'], 'no-cache')
+            self.assertEqual(thumb.data, _png())
+
+
+class TestReadiness(AppTestCase):
+
+    users = (1, 2)
+
+    def setUp(self):
+        super().setUp()
+        db.session.add(Match(user1_id=1, user2_id=2))
+        db.session.commit()
+
+    def test_ready_after_warmup(self):
+        """Readiness waits for the warm-up, reports its timings, and health stays separate."""
+        warmup = self.app.extensions['warmup']
+        first = self.client.get('/api/ready')
+        self.assertIn(first.status_code, (200, 503))
+        warmup.wait(5)
+
+        response = self.client.get('/api/ready')
+        self.assertEqual(response.status_code, 200)
+        body = response.get_json()
+        self.assertEqual(body['status'], 'ready')
+        self.assertTrue(body['checks']['database']['ok'])
+        self.assertEqual(set(body['warmup']['steps']), {'statements', 'profiles', 'match_graph', 'matching'})
+        self.assertEqual(body['warmup']['steps']['profiles']['items'], 2)
+        self.assertEqual(self.app.extensions['match_graph'].neighbours(1), {2: (1, 'pending')})
+        self.assertEqual(self.client.get('/api/health').get_json(), {'status': 'healthy'})
+
+    def test_saturated_pool_is_reported_not_failed(self):
+        """A saturated pool marks readiness degraded without failing the probe."""
+        self.client.get('/api/ready')
+        self.app.extensions['warmup'].wait(5)
+
+        with patch('readiness.pool_usage', return_value={'checked_out': 10, 'capacity': 10, 'usage': 1.0}):
+            response = self.client.get('/api/ready')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.get_json()['status'], 'degraded')
+        self.assertFalse(response.get_json()['checks']['pool']['ok'])
+
+    def test_failures_report_codes_not_details(self):
+        """Database and warm-up errors are logged; the probe only returns short codes."""
+        secret = 'could not connect to db.internal:5432 as roomimatch_user'
+        warmup = self.app.extensions['warmup']
+        with patch('readiness.hot_user_ids', side_effect=RuntimeError(secret)):
+            self.client.get('/api/ready')
+            warmup.wait(5)
+        self.assertEqual(warmup.report()['error'], 'hot_users_failed')
+
+        with patch.object(db.session, 'execute', side_effect=RuntimeError(secret)), \
+                self.assertLogs(self.app.logger, 'ERROR') as logs:
+            response = self.client.get('/api/ready')
+
+        self.assertEqual(response.status_code, 503)
+        self.assertNotIn('db.internal', response.get_data(as_text=True))
+        body = response.get_json()
+        self.assertEqual(body['checks']['database']['error'], 'database_unavailable')
+        self.assertIn(secret, '\n'.join(logs.output))
+
+
+class TestAppStartup(unittest.TestCase):
+
+    def test_import_is_lazy(self):
+        """Importing the app must not load OAuth or touch the database."""
+        backend_dir = os.path.dirname(os.path.abspath(__file__))
+        env = dict(os.environ, DATABASE_URL='sqlite:////nonexistent-dir/roomimatch.db')
+        proc = subprocess.run(
+            [sys.executable, '-X', 'importtime', '-c', 'import app'],
+            cwd=backend_dir, env=env, capture_output=True, text=True
+        )
+
+        self.assertEqual(proc.returncode, 0, proc.stderr)
+        imported = {line.rsplit('|', 1)[-1].strip() for line in proc.stderr.splitlines()
+                    if line.startswith('import time:')}
+        self.assertIn('models', imported)
+        self.assertNotIn('authlib.integrations.flask_client', imported)
+
+    def test_init_db_upgrades_existing_schema(self):
+        """init-db adds columns and indexes missing from an older database and backfills keys."""
+        tmp = tempfile.mkdtemp()
+        test_app = create_app({'TESTING': True, 'SQLALCHEMY_DATABASE_URI': f'sqlite:///{tmp}/old.db'})
+        added_later = {'budget_amount', 'location_key', 'latitude', 'longitude', 'geohash',
+                       'picture_hash', 'client_id'}
+        old = db.MetaData()
+        for name in ('user', 'match', 'message', 'notification'):
+            table = db.metadata.tables[name]
+            db.Table(name, old, *[db.Column(c.name, c.type, primary_key=c.primary_key)
+                                  for c in table.columns if c.name not in added_later])
+        try:
+            with test_app.app_context():
+                old.create_all(db.engine)
+                with db.engine.begin() as conn:
+                    conn.execute(old.tables['user'].insert().values(
+                        id=1, email='old@test.com', password_hash='hash', name='Old', age=25,
+                        gender='Male', occupation='Student', budget='₹8000',
+                        habits='[]', interests='[]', location='Pune'))
+
+            result = test_app.test_cli_runner().invoke(args=['init-db'])
+            self.assertIn('Database initialized.', result.output, result.output)
+            self.assertIn('user.picture_hash', result.output)
+
+            with test_app.app_context():
+                indexes = {i['name'] for i in db.inspect(db.engine).get_indexes('message')}
+                self.assertLessEqual({'ix_message_pair', 'unique_client_message'}, indexes)
+                user = User.query.get(1)
+                self.assertEqual((user.location_key, user.budget_amount), ('pune', 8000))
+                self.assertIsNotNone(user.geohash)
+                self.assertEqual(register_user({
+                    'name': 'New', 'email': 'new@test.com', 'password': 'pw', 'age': 25,
+                    'gender': 'Male', 'occupation': 'Student', 'budget': '₹8000'
+                })[1], 201)
+                self.assertEqual(upgrade_schema(), [])
+                db.session.remove()
+        finally:
+            shutil.rmtree(tmp, ignore_errors=True)
+
+    def test_create_app_accepts_overrides(self):
+        """Test create_app applies dict overrides on top of the defaults."""
+        test_app = create_app({'TESTING': True, 'SQLALCHEMY_DATABASE_URI': 'sqlite:///:memory:'})
+
+        self.assertTrue(test_app.config['TESTING'])
+        self.assertIn('api.health_check', test_app.view_functions)
+        self.assertIsNone(test_app.extensions['roomimatch_oauth'])
+
+
 if __name__ == '__main__':
     unittest.main()